@@ -0,0 +1,150 @@
+import uuid
+import numpy as np
+from shapely.geometry import LineString
+from shapely.ops import unary_union, split
+
+from get_shapes import find_coords
+from data_tkinter_classes import DEFAULT_LAYER, AnnotationsTkinter
+
+
+def canvas2norm(x_canvas, y_canvas, origin, imscale):
+    """ Converts canvas coordinates to (unrounded) coordinates on the image without zoom"""
+    return (x_canvas - origin[0]) / imscale, (y_canvas - origin[1]) / imscale
+
+
+def norm2canvas(coords_norm, origin, imscale):
+    """ Converts a list of normalized (x, y) coordinates to canvas coordinates"""
+    x, y = origin
+    return [(x + i[0] * imscale, y + i[1] * imscale) for i in coords_norm]
+
+
+def exterior(polygon):
+    return [tuple(x) for x in np.array(polygon.exterior.coords)]
+
+
+class AnnotationEngine:
+    """
+    Creates, moves, combines, cuts, loads and saves annotations without a display.
+    Works on an AnnotationsTkinter and normalized image coordinates only, so it can be used in
+    scripts and batch jobs. The Annotator is a view on top of it that draws the results.
+    Methods that create annotations return their unique ids, canvas ids are left to the view.
+    """
+
+    def __init__(self, data=None, image_size=None):
+        self.Data = data if data is not None else AnnotationsTkinter()
+        self.image_size = image_size  # (width, height), None if coordinates are not checked
+
+    def __len__(self):
+        return len(self.Data)
+
+    def inside_image(self, x, y):
+        if self.image_size is None:
+            return True
+        return 0 <= x <= self.image_size[0] and 0 <= y <= self.image_size[1]
+
+    def image_coords(self, x_canvas, y_canvas, origin, imscale):
+        """ Returns the rounded image coordinates of a canvas point, None outside of the image"""
+        x, y = canvas2norm(x_canvas, y_canvas, origin, imscale)
+        x, y = round(x), round(y)
+        if self.inside_image(x, y):
+            return (x, y)
+        else:
+            print("Outside of the image")
+
+    def load_annotations(self, path):
+        return self.Data.load_annotations(path)
+
+    def iter_annotations(self, path, batch_size=1000, progress=None):
+        return self.Data.iter_annotations(path, batch_size=batch_size, progress=progress)
+
+    def save_annotations(self, path, compress=False):
+        self.Data.save_annotations(path, compress=compress)
+
+    def create_annotation(self, coord1, coord2, shape, unique_id=None, layer=DEFAULT_LAYER):
+        """ Adds a circle, ellipse or rectangle defined by two points, returns its unique id"""
+        if shape == "polygon":
+            raise ValueError("Polygons are created with create_polygon")
+        unique_id = unique_id or str(uuid.uuid4())
+        self.Data.add_annotation(unique_id, None, [list(coord1), list(coord2)], shape, layer)
+        return unique_id
+
+    def create_polygon(self, points, unique_id=None, layer=DEFAULT_LAYER):
+        """ Adds a polygon (or a line for two points), returns its unique id"""
+        unique_id = unique_id or str(uuid.uuid4())
+        points = [tuple(point) for point in points]
+        self.Data.add_annotation(unique_id, None, points, "polygon", layer)
+        return unique_id
+
+    def delete_annotations(self, unique_ids):
+        for unique_id in unique_ids:
+            self.Data.delete_annotation(unique_id)
+
+    def find_annotation(self, x, y, halo=0):
+        """ Returns the unique id of the topmost annotation at (x, y), None if there is none"""
+        unique_ids = self.Data.query_point(x, y, halo=halo)
+        if unique_ids:
+            return unique_ids[0]
+
+    def move_annotation(self, unique_id, center):
+        """
+        Moves an annotation to a new center, returns its new coordinates.
+        Polygons are moved so the average of their points is at center, the other shapes keep
+        their size and get corners around center.
+        """
+        coords, shape = self.Data.get_coords_from_unique_id(unique_id)
+        if shape == "polygon":
+            dx, dy = np.asarray(center) - np.average(np.array(coords), 0)
+            self.Data.translate([unique_id], dx, dy)
+        else:
+            x_dim = abs(coords[0][0] - coords[1][0])
+            y_dim = abs(coords[0][1] - coords[1][1])
+            coord1, coord2 = find_coords(center, x_dim, y_dim)
+            self.Data.edit_annotation(
+                unique_id, self.Data.get_canvas_id(unique_id), [coord1, coord2]
+            )
+        return self.Data.annotations_tkinter[unique_id].coords_norm
+
+    def translate_annotations(self, unique_ids, dx, dy):
+        """ Moves the annotations by (dx, dy) in normalized coordinates"""
+        self.Data.translate(list(unique_ids), dx, dy)
+
+    def combine_annotations(self, unique_ids):
+        """
+        Replaces the annotations by their union, returns the unique id of the new polygon.
+        The union is in the layer of the first annotation.
+        Returns None and keeps the annotations if the union is not a single polygon, e.g. a line
+        annotation outside of the others.
+        """
+        union_polygon = unary_union([self.Data.get_geometry(i) for i in unique_ids])
+        if not hasattr(union_polygon, "exterior"):
+            return None
+        layer = self.Data.annotations_tkinter[unique_ids[0]].layer
+        combined_id = self.create_polygon(exterior(union_polygon), layer=layer)
+        self.delete_annotations(unique_ids)
+        return combined_id
+
+    def cut_annotations(self, line, layers=None):
+        """
+        Splits the annotations crossed by a line of normalized (x, y) points, only those in
+        layers if given. The pieces stay in the layer of the annotation.
+        Returns a dict with the unique id of every cut annotation and the ids of its pieces.
+        Lines and points (polygon annotations of less than 3 points) are not cut.
+        """
+        cut_line = LineString(line)
+        cut = {}
+        for unique_id in self.Data.query_box(*cut_line.bounds):
+            layer = self.Data.annotations_tkinter[unique_id].layer
+            if layers is not None and layer not in layers:
+                continue
+            if self.Data.get_geometry(unique_id).geom_type != "Polygon":
+                continue
+            if not self.Data.get_prepared_geometry(unique_id).intersects(cut_line):
+                continue
+            split_polygons = split(self.Data.get_geometry(unique_id), cut_line).geoms
+            if len(split_polygons) < 2:
+                continue
+            cut[unique_id] = [
+                self.create_polygon(exterior(p), layer=layer) for p in split_polygons
+            ]
+            self.Data.delete_annotation(unique_id)
+        return cut
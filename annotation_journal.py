@@ -0,0 +1,205 @@
+"""
+Write-ahead journal of the annotations, so a crash loses at most the last flush interval.
+
+Every add, edit and delete of an AnnotationsTkinter is appended as one json line. Records hold the
+full coordinates, so replaying them is idempotent. A background thread writes the records, and
+when the journal has grown it compacts it into a snapshot (an add record per annotation) that
+replaces the journal with an atomic rename. The thread keeps its own copy of the coordinates for
+the snapshot, so it never reads the store while the Tk thread edits it.
+"""
+import os
+import json
+import queue
+import hashlib
+import threading
+import numpy as np
+
+from annotation_store import json_values
+from data_tkinter_classes import DEFAULT_LAYER
+from pyramid_cache import cache_root
+
+
+def default_journal_dir():
+    """ Returns the default directory of the journals"""
+    return os.path.join(cache_root(), "journals")
+
+
+def journal_path(image_path, journal_dir=None):
+    """ Returns the journal of the annotations of an image"""
+    key = hashlib.sha1(os.path.abspath(image_path).encode("utf-8")).hexdigest()
+    return os.path.join(journal_dir or default_journal_dir(), key + ".jsonl")
+
+
+def read_journal(path):
+    """
+    Returns the annotations in a journal as ordered dict unique_id -> (shape, coords, layer).
+    A last line that was cut off by a crash is skipped.
+    """
+    state = {}
+    try:
+        f = open(path, "r")
+    except OSError:
+        return state
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            unique_id = record["id"]
+            if record["op"] == "add":
+                state.pop(unique_id, None)  # a new add is drawn on top
+                layer = record.get("layer", DEFAULT_LAYER)
+                state[unique_id] = (record["shape"], record["coords"], layer)
+            elif record["op"] == "edit" and unique_id in state:
+                layer = record.get("layer", DEFAULT_LAYER)
+                state[unique_id] = (state[unique_id][0], record["coords"], layer)
+            elif record["op"] == "delete":
+                state.pop(unique_id, None)
+    return state
+
+
+class AnnotationJournal:
+    """
+    Journals the changes of an AnnotationsTkinter to path.
+    replay() restores the annotations of a previous session, attach() starts journaling (a journal
+    that was not replayed is discarded).
+    Records are written every interval seconds, the journal is compacted once it holds more
+    records than compact_records and than annotations.
+    """
+
+    def __init__(self, path, interval=1.0, compact_records=10000):
+        self.path = path
+        self.interval = interval
+        self.compact_records = compact_records
+        self.data = None
+        self.queue = queue.Queue()
+        self.state = {}  # unique_id -> (shape, coords, layer), owned by the writer
+        self.records = 0  # records in the journal since the last snapshot
+        self.lock = threading.Lock()
+        self.__file = None
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def replay(self, data, state=None):
+        """
+        Adds the annotations of the journal to data, returns their unique ids.
+        state is the result of read_journal(), the journal is read if it is None.
+        """
+        if state is None:
+            state = read_journal(self.path)
+        for unique_id, (shape, coords, layer) in state.items():
+            data.add_annotation(unique_id, None, coords, shape, layer)
+        return list(state.keys())
+
+    def attach(self, data):
+        """ Starts journaling the changes of data, the journal starts with a snapshot of data"""
+        self.data = data
+        self.state = {
+            unique_id: (annotation.shape, data.store.coords(unique_id).copy(), annotation.layer)
+            for unique_id, annotation in data.annotations_tkinter.items()
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.compact()
+        data.observers.append(self.record)
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def record(self, action, unique_ids):
+        """
+        Observer of AnnotationsTkinter, queues the records of a batch of changed annotations.
+        The coordinates of the batch are copied from the store at once, the store may change.
+        """
+        unique_ids = list(unique_ids)
+        if action == "delete":
+            self.queue.put((action, [(unique_id, None, None, None) for unique_id in unique_ids]))
+            return
+        store = self.data.store
+        rows = store.get_rows(unique_ids)
+        index, _, _ = store.vertex_index(rows)
+        coords = np.split(store.vertices[index], np.cumsum(store.counts[rows])[:-1])
+        annotations = self.data.annotations_tkinter
+        batch = [
+            (unique_id, annotations[unique_id].shape, points, annotations[unique_id].layer)
+            for unique_id, points in zip(unique_ids, coords)
+        ]
+        self.queue.put((action, batch))
+
+    def flush(self):
+        """ Writes the queued records to disk"""
+        with self.lock:
+            records = []
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not records:
+                return
+
+            lines = []
+            for action, batch in records:
+                for unique_id, shape, coords, layer in batch:
+                    if action == "delete":
+                        self.state.pop(unique_id, None)
+                        lines.append(json.dumps({"op": action, "id": unique_id}))
+                        continue
+                    self.state[unique_id] = (shape, coords, layer)
+                    lines.append(json.dumps(self.__record(action, unique_id, shape, coords, layer)))
+            self.__file.write("\n".join(lines) + "\n")
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.records += len(lines)
+
+            if self.records > max(self.compact_records, len(self.state)):
+                self.__compact()
+
+    def compact(self):
+        """ Replaces the journal by a snapshot of the annotations"""
+        with self.lock:
+            self.__compact()
+
+    def __compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for unique_id, (shape, coords, layer) in self.state.items():
+                f.write(json.dumps(self.__record("add", unique_id, shape, coords, layer)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self.__file is not None:
+            self.__file.close()
+        os.replace(tmp_path, self.path)
+        self.__file = open(self.path, "a")
+        self.records = 0
+
+    @staticmethod
+    def __record(action, unique_id, shape, coords, layer):
+        record = {"op": action, "id": unique_id, "coords": json_values(coords)}
+        if action == "add":
+            record["shape"] = shape
+        if layer != DEFAULT_LAYER:
+            record["layer"] = layer
+        return record
+
+    def __run(self):
+        """ Writes the records every interval seconds, runs in a background thread"""
+        while not self.__stop.wait(self.interval):
+            try:
+                self.flush()
+            except OSError:
+                print("Could not write the annotation journal")
+
+    def close(self):
+        """ Stops journaling, the journal is left as a snapshot of the annotations"""
+        if self.data is None:
+            return
+        self.data.observers.remove(self.record)
+        self.data = None
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.flush()
+        self.compact()
+        self.__file.close()
+        self.__file = None
+
@@ -0,0 +1,240 @@
+"""
+Overview of the annotations: counts, areas and radii per shape.
+
+AnnotationStatistics observes an AnnotationsTkinter and updates its numbers for the annotations
+that were added, edited or deleted only. The areas and radii of a batch of changes are computed
+by the vectorized kernels of the AnnotationStore, values are kept sorted so percentiles are a
+lookup. StatisticsPanel shows them in a window.
+"""
+import heapq
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from tkinter import Label, Toplevel
+
+import numpy as np
+
+from annotation_store import SHAPE_NAMES
+
+SHAPES = ("polygon", "ellipse", "circle", "rectangle")
+
+
+class Distribution:
+    """ Sorted values with their sum, for counts, means and percentiles of changing values"""
+
+    BATCH = 64  # larger changes re-sort instead of inserting one by one
+
+    def __init__(self):
+        self.values = []
+        self.total = 0.0
+
+    def __len__(self):
+        return len(self.values)
+
+    def update(self, added=(), removed=()):
+        added, removed = list(added), list(removed)
+        self.total += sum(added) - sum(removed)
+        if len(added) + len(removed) <= self.BATCH:
+            for value in removed:
+                del self.values[bisect_left(self.values, value)]
+            for value in added:
+                insort(self.values, value)
+        else:
+            if removed:
+                removed = Counter(removed)
+                kept = []
+                for value in self.values:
+                    if removed[value]:
+                        removed[value] -= 1
+                    else:
+                        kept.append(value)
+                self.values = kept
+            self.values.extend(added)
+            self.values.sort()
+
+    @property
+    def mean(self):
+        if not self.values:
+            return None
+        return self.total / len(self.values)
+
+    def percentile(self, q):
+        """ Returns the q-th percentile (nearest rank), None without values"""
+        if not self.values:
+            return None
+        n = len(self.values)
+        return self.values[min(n - 1, int(round(q / 100 * (n - 1))))]
+
+
+class AnnotationStatistics:
+    """
+    Per layer and shape counts and distributions of the areas and mean radii (ellipses and
+    circles) of the annotations of data, kept up to date as annotations change. Also fills in
+    the area field of the annotations. version is incremented on every change, for views that poll.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.version = 0
+        self.recompute()
+        data.observers.append(self.update)
+
+    def close(self):
+        self.data.observers.remove(self.update)
+
+    def recompute(self):
+        """ Computes the statistics of all annotations at once"""
+        self.areas = defaultdict(Distribution)  # (layer, shape) -> areas
+        self.radii = defaultdict(Distribution)  # (layer, shape) -> mean radii
+        self.values = {}  # unique_id -> (layer, shape, area, mean radius or None)
+        self.update("add", list(self.data.annotations_tkinter.keys()))
+
+    def measure(self, unique_ids):
+        """ Returns the (shape, area, mean radius) of the annotations, vectorized over the store"""
+        store = self.data.store
+        areas = store.areas(unique_ids).tolist()
+        radii = store.radii(unique_ids).mean(axis=1)
+        radii = np.where(np.isnan(radii), None, radii).tolist()
+        types = store.types[store.get_rows(unique_ids)].tolist()
+        shapes = [SHAPE_NAMES[code] for code in types]
+        return zip(shapes, areas, radii)
+
+    def update(self, action, unique_ids):
+        """ Observer of AnnotationsTkinter"""
+        added, removed = defaultdict(list), defaultdict(list)
+        added_radii, removed_radii = defaultdict(list), defaultdict(list)
+
+        for unique_id in unique_ids:
+            old = self.values.pop(unique_id, None)
+            if old is not None:
+                layer, shape, area, radius = old
+                removed[layer, shape].append(area)
+                if radius is not None:
+                    removed_radii[layer, shape].append(radius)
+
+        if action != "delete":
+            annotations = self.data.annotations_tkinter
+            for unique_id, (shape, area, radius) in zip(unique_ids, self.measure(unique_ids)):
+                annotation = annotations[unique_id]
+                annotation.area = area
+                self.values[unique_id] = (annotation.layer, shape, area, radius)
+                added[annotation.layer, shape].append(area)
+                if radius is not None:
+                    added_radii[annotation.layer, shape].append(radius)
+
+        for key in set(added) | set(removed):
+            self.areas[key].update(added[key], removed[key])
+        for key in set(added_radii) | set(removed_radii):
+            self.radii[key].update(added_radii[key], removed_radii[key])
+        self.version += 1
+
+    def __len__(self):
+        return len(self.values)
+
+    @staticmethod
+    def merged(distributions):
+        """ Returns one distribution of several, the sorted values are merged"""
+        distributions = [d for d in distributions if len(d)]
+        if len(distributions) == 1:
+            return distributions[0]
+        merged = Distribution()
+        merged.values = list(heapq.merge(*(d.values for d in distributions)))
+        merged.total = sum(d.total for d in distributions)
+        return merged
+
+    def summary(self, layers=None, percentiles=(5, 50, 95)):
+        """
+        Returns a row of statistics per shape (with annotations) and for all annotations,
+        of the annotations in layers (all layers if None).
+        """
+        if layers is None:
+            layers = list(self.data.layers)
+        rows = []
+        for shape in SHAPES:
+            areas = self.merged(
+                self.areas[layer, shape] for layer in layers if (layer, shape) in self.areas
+            )
+            if not len(areas):
+                continue
+            row = {
+                "shape": shape,
+                "count": len(areas),
+                "total_area": areas.total,
+                "mean_area": areas.mean,
+            }
+            for q in percentiles:
+                row["p{}_area".format(q)] = areas.percentile(q)
+            row["mean_radius"] = self.merged(
+                self.radii[layer, shape] for layer in layers if (layer, shape) in self.radii
+            ).mean
+            rows.append(row)
+
+        if rows:
+            total = sum(row["total_area"] for row in rows)
+            count = sum(row["count"] for row in rows)
+            rows.append(
+                {"shape": "all", "count": count, "total_area": total, "mean_area": total / count}
+            )
+        return rows
+
+
+class StatisticsPanel:
+    """
+    Window with the statistics, redrawn at most every interval_ms when they changed.
+    layers is a callable that returns the names of the layers to include, e.g. the visible ones.
+    """
+
+    COLUMNS = (
+        ("shape", "shape"),
+        ("count", "count"),
+        ("total_area", "total area"),
+        ("mean_area", "mean area"),
+        ("p5_area", "p5 area"),
+        ("p50_area", "median area"),
+        ("p95_area", "p95 area"),
+        ("mean_radius", "mean radius"),
+    )
+
+    def __init__(self, master, statistics, layers=None, interval_ms=500):
+        self.statistics = statistics
+        self.layers = layers
+        self.interval_ms = interval_ms
+        self.window = Toplevel(master)
+        self.window.title("Annotation statistics")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.label = Label(self.window, font=("Courier", 11), justify="left", anchor="nw")
+        self.label.pack(fill="both", expand=True, padx=10, pady=10)
+        self.__version = None
+        self.__job = None
+        self.update()
+
+    def text(self):
+        def cell(value):
+            if value is None:
+                return "-"
+            if isinstance(value, float):
+                return "{:.1f}".format(value)
+            return str(value)
+
+        rows = self.statistics.summary(self.layers() if self.layers else None)
+        if not rows:
+            return "No annotations"
+        table = [[title for _, title in self.COLUMNS]]
+        table += [[cell(row.get(key)) for key, _ in self.COLUMNS] for row in rows]
+        widths = [max(len(line[i]) for line in table) for i in range(len(self.COLUMNS))]
+        return "\n".join(
+            "  ".join(value.rjust(width) for value, width in zip(line, widths)) for line in table
+        )
+
+    def update(self):
+        self.__job = None
+        version = (self.statistics.version, tuple(self.layers()) if self.layers else None)
+        if version != self.__version:
+            self.__version = version
+            self.label.configure(text=self.text())
+        self.__job = self.window.after(self.interval_ms, self.update)
+
+    def close(self):
+        if self.__job is not None:
+            self.window.after_cancel(self.__job)
+            self.__job = None
+        self.window.destroy()
@@ -0,0 +1,308 @@
+import numpy as np
+
+SHAPE_CODES = {"polygon": 0, "ellipse": 1, "circle": 2, "rectangle": 3}
+SHAPE_NAMES = {code: shape for shape, code in SHAPE_CODES.items()}
+
+
+def shortest_float64(values):
+    """
+    Returns float32 values as float64 of their shortest decimal representation, so they are
+    written as they were entered (10.1 instead of 10.100000381469727) and read back unchanged.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    result = values.astype(np.float64)
+    fraction = result != np.floor(result)  # integers are exact in float32 already
+    result[fraction] = values[fraction].astype(str).astype(np.float64)
+    return result
+
+
+def json_values(values):
+    """ Returns float32 values as (nested) lists for json, integral values as int"""
+    result = shortest_float64(values)
+    integral = np.isfinite(result) & (result == np.floor(result))
+    numbers = result.astype(object)
+    numbers[integral] = result[integral].astype(np.int64)
+    return numbers.tolist()
+
+
+class AnnotationStore:
+    """
+    Struct-of-arrays storage of annotation coordinates.
+    All vertices live in one flat float32 buffer, every annotation is a row with the start and
+    number of its vertices, a shape code and a bounding box. Ellipses, circles and rectangles
+    store the two points they were created with. Bulk operations work on all rows at once.
+    Edits that change the number of vertices and deletions leave garbage in the vertex buffer,
+    which is removed by compact().
+    """
+
+    def __init__(self, capacity=1024, vertex_capacity=16384):
+        self.vertices = np.empty((vertex_capacity, 2), dtype=np.float32)
+        self.n_vertices = 0
+        self.garbage = 0  # unused vertices in the buffer
+
+        self.starts = np.empty(capacity, dtype=np.int64)
+        self.counts = np.empty(capacity, dtype=np.int32)
+        self.types = np.empty(capacity, dtype=np.int8)
+        self.bboxes = np.empty((capacity, 4), dtype=np.float32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.n_rows = 0
+
+        self.rows = {}  # unique id -> row
+        self.ids = []  # row -> unique id (None for deleted rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, unique_id):
+        return unique_id in self.rows
+
+    @property
+    def nbytes(self):
+        arrays = (self.vertices, self.starts, self.counts, self.types, self.bboxes, self.alive)
+        return sum(array.nbytes for array in arrays)
+
+    def __grow_rows(self, n):
+        capacity = len(self.starts)
+        if self.n_rows + n <= capacity:
+            return
+        capacity = max(2 * capacity, self.n_rows + n)
+        for name in ("starts", "counts", "types", "bboxes", "alive"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[: self.n_rows] = old[: self.n_rows]
+            setattr(self, name, new)
+
+    def __grow_vertices(self, n):
+        capacity = len(self.vertices)
+        if self.n_vertices + n <= capacity:
+            return
+        vertices = np.empty((max(2 * capacity, self.n_vertices + n), 2), dtype=np.float32)
+        vertices[: self.n_vertices] = self.vertices[: self.n_vertices]
+        self.vertices = vertices
+
+    def __append_vertices(self, coords):
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        self.__grow_vertices(len(coords))
+        start = self.n_vertices
+        self.vertices[start : start + len(coords)] = coords
+        self.n_vertices += len(coords)
+        return start, len(coords)
+
+    def add(self, unique_id, coords, shape):
+        """ Adds an annotation, an existing annotation with the same id is replaced"""
+        if unique_id in self.rows:
+            self.delete(unique_id)
+        self.__grow_rows(1)
+        row = self.n_rows
+        self.n_rows += 1
+
+        self.starts[row], self.counts[row] = self.__append_vertices(coords)
+        self.types[row] = SHAPE_CODES[shape]
+        self.alive[row] = True
+        self.rows[unique_id] = row
+        self.ids.append(unique_id)
+        self.update_bboxes(np.array([row]))
+        return row
+
+    def extend(self, unique_ids, vertices, counts, types):
+        """ Adds many annotations at once from a (n, 2) vertex array, vertex counts and shape codes"""
+        for unique_id in unique_ids:
+            if unique_id in self.rows:
+                self.delete(unique_id)
+        n = len(unique_ids)
+        counts = np.asarray(counts, dtype=np.int64)
+        self.__grow_rows(n)
+        self.__grow_vertices(len(vertices))
+
+        rows = np.arange(self.n_rows, self.n_rows + n)
+        self.vertices[self.n_vertices : self.n_vertices + len(vertices)] = vertices
+        self.starts[rows] = self.n_vertices + np.cumsum(counts) - counts
+        self.counts[rows] = counts
+        self.types[rows] = types
+        self.alive[rows] = True
+        self.n_vertices += len(vertices)
+        self.n_rows += n
+
+        self.rows.update(zip(unique_ids, rows.tolist()))
+        self.ids.extend(unique_ids)
+        self.update_bboxes(rows)
+        return rows
+
+    def edit(self, unique_id, coords):
+        """ Replaces the coordinates of an annotation, in place if the number of vertices is the same"""
+        row = self.rows[unique_id]
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        if len(coords) == self.counts[row]:
+            start = self.starts[row]
+            self.vertices[start : start + len(coords)] = coords
+        else:
+            self.garbage += int(self.counts[row])
+            self.starts[row], self.counts[row] = self.__append_vertices(coords)
+        self.update_bboxes(np.array([row]))
+        self.__maybe_compact()
+
+    def delete(self, unique_id):
+        row = self.rows.pop(unique_id)
+        self.alive[row] = False
+        self.ids[row] = None
+        self.garbage += int(self.counts[row])
+        self.__maybe_compact()
+
+    def clear(self):
+        self.__init__()
+
+    def coords(self, unique_id):
+        """ Returns the vertices of an annotation as a (n, 2) view on the buffer"""
+        row = self.rows[unique_id]
+        start = self.starts[row]
+        return self.vertices[start : start + self.counts[row]]
+
+    def shape(self, unique_id):
+        return SHAPE_NAMES[int(self.types[self.rows[unique_id]])]
+
+    def bbox(self, unique_id):
+        return tuple(self.bboxes[self.rows[unique_id]].tolist())
+
+    def get_rows(self, unique_ids=None):
+        """ Returns the rows of the given ids, or all rows of living annotations"""
+        if unique_ids is None:
+            return np.flatnonzero(self.alive[: self.n_rows])
+        return np.fromiter((self.rows[i] for i in unique_ids), dtype=np.int64)
+
+    def vertex_index(self, rows):
+        """
+        Returns for all vertices of the rows their index in the buffer, the position of their row
+        in rows and their index inside the annotation.
+        """
+        counts = self.counts[rows].astype(np.int64)
+        owner = np.repeat(np.arange(len(rows)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.starts[rows][owner] + local, owner, local
+
+    def update_bboxes(self, rows):
+        """ Recomputes the bounding boxes of the rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return
+        types = self.types[rows]
+
+        polygons = rows[types == SHAPE_CODES["polygon"]]
+        if len(polygons):
+            index, _, _ = self.vertex_index(polygons)
+            counts = self.counts[polygons]
+            bounds = np.cumsum(counts) - counts
+            points = self.vertices[index]
+            self.bboxes[polygons, 0] = np.minimum.reduceat(points[:, 0], bounds)
+            self.bboxes[polygons, 1] = np.minimum.reduceat(points[:, 1], bounds)
+            self.bboxes[polygons, 2] = np.maximum.reduceat(points[:, 0], bounds)
+            self.bboxes[polygons, 3] = np.maximum.reduceat(points[:, 1], bounds)
+
+        # ellipses and circles are stored as center and a point on the outline
+        for shape in ("ellipse", "circle"):
+            selected = rows[types == SHAPE_CODES[shape]]
+            if not len(selected):
+                continue
+            center = self.vertices[self.starts[selected]]
+            delta = np.abs(self.vertices[self.starts[selected] + 1] - center)
+            if shape == "circle":
+                delta[:] = np.hypot(delta[:, 0], delta[:, 1])[:, None]
+            self.bboxes[selected, :2] = center - delta
+            self.bboxes[selected, 2:] = center + delta
+
+        rectangles = rows[types == SHAPE_CODES["rectangle"]]
+        if len(rectangles):
+            coord1 = self.vertices[self.starts[rectangles]]
+            coord2 = self.vertices[self.starts[rectangles] + 1]
+            self.bboxes[rectangles, :2] = np.minimum(coord1, coord2)
+            self.bboxes[rectangles, 2:] = np.maximum(coord1, coord2)
+
+    def translate(self, unique_ids, dx, dy):
+        """ Moves the annotations by (dx, dy)"""
+        rows = self.get_rows(unique_ids)
+        index, _, _ = self.vertex_index(rows)
+        self.vertices[index] += np.array([dx, dy], dtype=np.float32)
+        self.bboxes[rows] += np.array([dx, dy, dx, dy], dtype=np.float32)
+
+    def scale(self, unique_ids, factor, center=(0, 0)):
+        """ Scales the annotations by factor around center"""
+        rows = self.get_rows(unique_ids)
+        index, _, _ = self.vertex_index(rows)
+        center = np.asarray(center, dtype=np.float32)
+        self.vertices[index] = center + (self.vertices[index] - center) * factor
+        self.update_bboxes(rows)
+
+    def areas(self, unique_ids=None):
+        """ Returns the areas of the annotations, shoelace formula for polygons and analytic otherwise"""
+        rows = self.get_rows(unique_ids)
+        areas = np.zeros(len(rows), dtype=np.float64)
+        types = self.types[rows]
+
+        polygons = np.flatnonzero(types == SHAPE_CODES["polygon"])
+        if len(polygons):
+            index, owner, local = self.vertex_index(rows[polygons])
+            counts = self.counts[rows[polygons]].astype(np.int64)
+            following = index + np.where(local + 1 == counts[owner], 1 - counts[owner], 1)
+            points = self.vertices[index].astype(np.float64)
+            next_points = self.vertices[following].astype(np.float64)
+            cross = points[:, 0] * next_points[:, 1] - next_points[:, 0] * points[:, 1]
+            areas[polygons] = np.abs(np.bincount(owner, cross, minlength=len(polygons))) / 2
+
+        others = np.flatnonzero(types != SHAPE_CODES["polygon"])
+        if len(others):
+            coord1 = self.vertices[self.starts[rows[others]]].astype(np.float64)
+            coord2 = self.vertices[self.starts[rows[others]] + 1].astype(np.float64)
+            dx, dy = np.abs(coord2 - coord1).T
+            other_types = types[others]
+            areas[others] = np.select(
+                [
+                    other_types == SHAPE_CODES["ellipse"],
+                    other_types == SHAPE_CODES["circle"],
+                ],
+                [np.pi * dx * dy, np.pi * (dx * dx + dy * dy)],
+                default=dx * dy,
+            )
+        return areas
+
+    def radii(self, unique_ids=None):
+        """ Returns the (radius_x, radius_y) of ellipses and circles, nan for the other shapes"""
+        rows = self.get_rows(unique_ids)
+        radii = np.full((len(rows), 2), np.nan)
+        types = self.types[rows]
+
+        ellipses = np.flatnonzero(
+            (types == SHAPE_CODES["ellipse"]) | (types == SHAPE_CODES["circle"])
+        )
+        if len(ellipses):
+            coord1 = self.vertices[self.starts[rows[ellipses]]].astype(np.float64)
+            coord2 = self.vertices[self.starts[rows[ellipses]] + 1].astype(np.float64)
+            delta = np.abs(coord2 - coord1)
+            # circles are stored as center and a point on the outline
+            circles = types[ellipses] == SHAPE_CODES["circle"]
+            delta[circles] = np.hypot(delta[circles, 0], delta[circles, 1])[:, None]
+            radii[ellipses] = delta
+        return radii
+
+    def __maybe_compact(self):
+        if self.garbage > 4096 and self.garbage > self.n_vertices // 2:
+            self.compact()
+
+    def compact(self):
+        """ Removes deleted rows and unused vertices from the buffers"""
+        rows = self.get_rows()
+        index, _, _ = self.vertex_index(rows)
+        counts = self.counts[rows]
+
+        self.vertices[: len(index)] = self.vertices[index]
+        self.n_vertices = len(index)
+        self.garbage = 0
+
+        self.starts[: len(rows)] = np.cumsum(counts) - counts
+        self.counts[: len(rows)] = counts
+        self.types[: len(rows)] = self.types[rows]
+        self.bboxes[: len(rows)] = self.bboxes[rows]
+        self.alive[: len(rows)] = True
+        self.alive[len(rows) : self.n_rows] = False
+
+        self.ids = [self.ids[row] for row in rows]
+        self.rows = {unique_id: row for row, unique_id in enumerate(self.ids)}
+        self.n_rows = len(rows)
@@ -1,43 +1,98 @@
 import math
 import uuid
-import numpy as np
-import warnings
-from shapely.geometry import Polygon, LineString
-from shapely.ops import unary_union, split
-from PIL import Image, ImageTk
-from tkinter import Canvas, Frame, Menu, Tk, ALL, filedialog
-
-from utilities import find_coords
-from get_shapes import get_circle, get_ellipse, get_rectangle, oval2poly, rec2poly
-from data_tkinter_classes import AnnotationsTkinter
+from PIL import Image
+from tkinter import (
+    Canvas,
+    Frame,
+    Menu,
+    Tk,
+    ALL,
+    colorchooser,
+    filedialog,
+    messagebox,
+    simpledialog,
+)
+
+from get_shapes import extend_path, get_circle, get_ellipse, get_rectangle, oval2poly
+from annotation_engine import AnnotationEngine, canvas2norm, norm2canvas
+from annotation_journal import AnnotationJournal, journal_path, read_journal
+from annotation_statistics import AnnotationStatistics, StatisticsPanel
+from data_tkinter_classes import DEFAULT_LAYER
+from image_pyramid import ImagePyramid
+from tile_renderer import TileRenderer
+from render_scheduler import RenderScheduler
+from virtual_canvas import (
+    VirtualCanvas,
+    lod_level,
+    lod_tolerance,
+    project_lod,
+    project_point,
+)
+from progressive_loader import ProgressiveLoader
+from tracing import TRACER, TraceOverlay, traced
 
 
 class Annotator(Frame):
-    def __init__(self, master, height=1000, width=1000):
+    # tag and color of the selections of the modes
+    SELECTIONS = {
+        "delete": ("DELETE", "red"),
+        "combine": ("COMBINE", "yellow"),
+        "move": ("MOVE", "blue"),
+    }
+    FREEHAND_DISTANCE = 4  # canvas pixels between the vertices of a freehand trace, at least
+    FREEHAND_TOLERANCE = 1  # canvas pixels the simplified trace may deviate from the mouse path
+    POINT_SIZE = 3  # annotations smaller than this many canvas pixels are drawn as a dot
+
+    def __init__(
+        self,
+        master,
+        height=1000,
+        width=1000,
+        virtual=False,
+        engine=None,
+        path=None,
+        trace=False,
+        autosave=True,
+    ):
         self.master = master
         self.canvas = Canvas(self.master, height=height, width=width, bg="black")
         self.canvas.pack()
 
         self.shape = "circle"
-        self.state = False
+        self.state = False  # True while all annotations are toggled off
+        self.layer = DEFAULT_LAYER  # layer new annotations are created in
         self.do_polygon = False
 
         self.annotations_dict = {}
-        self.Data = AnnotationsTkinter()
-
-        self.delete_ids = []
-        self.combine_ids = []
-        self.move_id = None
+        # All annotation logic is done by the engine, the annotator only draws and handles events
+        self.engine = engine if engine is not None else AnnotationEngine()
+        self.Data = self.engine.Data
+        # Only draw the annotations in the viewport, for images with very many annotations
+        self.virtual_canvas = VirtualCanvas(self.canvas, self.Data) if virtual else None
+        self.loader = None  # progressive loader of the annotations that are being loaded
+        self.replaced_ids = set()  # unique ids that existed when the loader started
+        self.statistics = None  # kept up to date once the statistics were shown
+
+        self.delete_ids = set()  # unique ids selected for deleting
+        self.combine_ids = set()  # unique ids selected for combining
+        self.move_ids = set()  # unique ids selected for moving
+        self.drag_last = None  # last canvas point of the selection that is dragged
+        self.drag_delta = (0, 0)  # dragged distance in normalized coordinates
+        self.drag_clicked = None  # selected annotation that was pressed, deselected on a click
+        self.select_points = []  # canvas points of the box or lasso being dragged
+        self.select_lasso = False
 
         self.motion_id = None
         self.cut_points = []
         self.temp_coords = []
         self.temp_coords_norm = []
 
-        self.temp_polygon_points = []
         self.temp_polygon_points_norm = []
-        self.temp_polygon_point_ids = []
-        self.move_polygon_points = []
+        self.temp_polygon_point_ids = []  # vertex dots of the polygon being drawn
+        self.temp_polygon_id = None  # outline of the polygon being drawn
+        self.freehand_points = []  # simplified trace in normalized coordinates
+        self.freehand_skipped = []  # vertices the last segment of the trace replaced
+        self.freehand_id = None
 
         # Bind events to the Canvas
         self.canvas.bind("<ButtonPress-2>", self.move_from)
@@ -54,39 +109,33 @@ class Annotator(Frame):
         self.master.bind("i", lambda v: self.set_shape(shape="circle"))
         self.master.bind("p", lambda v: self.set_shape(shape="polygon"))
         self.master.bind("r", lambda v: self.set_shape(shape="rectangle"))
+        self.master.bind("h", lambda v: self.set_shape(shape="freehand"))
 
-        self.path = filedialog.askopenfilename()
-        self.image_id = None
+        self.path = path or filedialog.askopenfilename()
         self.imscale = 1.0
         self.delta = 0.75
-        self.__filter = Image.ANTIALIAS
+        self.__filter = Image.LANCZOS  # Image.ANTIALIAS was removed in Pillow 10
 
         Image.MAX_IMAGE_PIXELS = (
             1000000000  # suppress DecompressionBombError for big image
         )
-        with warnings.catch_warnings():  # suppress DecompressionBombWarning for big image
-            warnings.simplefilter("ignore")
-            self.image = Image.open(self.path)
-        self.imwidth, self.imheight = self.image.size
-        # Create image pyramid
-        self.__pyramid = [Image.open(self.path)]
+        # Create image pyramid, only the coarsest level is available right away.
+        # Tiled TIFF, Deep Zoom (.dzi) and .npy images are read region by region from the file
+        self.__pyramid = ImagePyramid(self.path, reduction=2, min_size=512, resample=self.__filter)
+        self.__pyramid.start()
+        self.imwidth, self.imheight = self.__pyramid.size
+        self.engine.image_size = self.__pyramid.size
+        self.__pyramid_version = None  # pyramid version that is shown on the canvas
         self.__ratio = 1.0
         self.__curr_img = 0  # current image from the pyramid
         self.__scale = self.imscale * self.__ratio  # image pyramide scale
-        self.__reduction = 2  # reduction degree of image pyramid
-        (w, h), m, j = self.__pyramid[-1].size, 512, 0
-        n = (
-            math.ceil(math.log(min(w, h) / m, self.__reduction)) + 1
-        )  # image pyramid length
-        while w > m and h > m:  # top pyramid image is around 512 pixels in size
-            j += 1
-            print("\rCreating image pyramid: {j} from {n}".format(j=j, n=n), end="")
-            w /= self.__reduction  # divide on reduction degree
-            h /= self.__reduction  # divide on reduction degree
-            self.__pyramid.append(
-                self.__pyramid[-1].resize((int(w), int(h)), self.__filter)
-            )
-        print("\r" + (40 * " ") + "\r", end="")  # hide printed string
+        self.__reduction = self.__pyramid.reduction  # reduction degree of image pyramid
+        self.__tiles = TileRenderer(self.canvas, self.__pyramid, resample=self.__filter)
+        self.__render = RenderScheduler(self.master, self.__show_image)
+        self.__tiles_job = None
+        self.__lod_zoom = None  # zoom the outlines on the canvas were simplified for
+        self.__lod_done = set()  # unique ids drawn at the current level of detail
+        self.__lod_points = set()  # unique ids drawn as a dot, they are too small to see
         # Put image into container rectangle and use it to set proper coordinates to the image
         self.container = self.canvas.create_rectangle(
             (0, 0, self.imwidth, self.imheight), width=0
@@ -133,13 +182,46 @@ class Annotator(Frame):
             label="Polygon (p)",
             command=lambda: self.set_shape(shape="polygon"),
         )
+        self.shape_options.add_command(
+            label="Freehand (h)",
+            command=lambda: self.set_shape(shape="freehand"),
+        )
         self.menubar.add_cascade(
             label="Load annotations", command=self.load_annotations
         )
         self.menubar.add_cascade(
             label="Save annotations", command=self.save_annotations
         )
+        self.menubar.add_cascade(label="Statistics", command=self.show_statistics)
+        self.layer_menu = Menu(self.menubar, tearoff=0)
+        self.menubar.add_cascade(label="Layers", menu=self.layer_menu)
+        # Opt-in latency tracing with a live overlay (also enabled by ANNOTATOR_TRACE=1)
+        if trace:
+            TRACER.enabled = True
+        self.trace_overlay = None
+        if TRACER.enabled:
+            self.trace_overlay = TraceOverlay(self.canvas)
+            self.menubar.add_cascade(label="Save trace", command=self.save_trace)
+        # Every change is journaled in the background, the annotations of the last session
+        # of this image (also after a crash) can be restored from the journal
+        self.journal = None
+        if autosave:
+            self.journal = AnnotationJournal(journal_path(self.path))
+            state = read_journal(self.journal.path)
+            if state and messagebox.askyesno(
+                "Restore annotations",
+                "Restore the {} annotations of the last session of this image?\n"
+                "Otherwise they are discarded.".format(len(state)),
+            ):
+                restored = self.journal.replay(self.Data, state)
+                if not self.virtual_canvas:
+                    for unique_id in restored:
+                        self.draw_annotation(unique_id)
+            self.journal.attach(self.Data)
+            self.master.protocol("WM_DELETE_WINDOW", self.close)
+        self.update_layer_menu()
         self.__show_image()
+        self.__poll_pyramid()
         self.canvas.focus_set()
         self.canvas.configure(scrollregion=self.canvas.bbox("all"))
         self.set_canvas_mode("create")
@@ -153,50 +235,140 @@ class Annotator(Frame):
         if mode == "create":
             # Create annotations
             self.canvas.bind("<ButtonPress-1>", self.create_annotation)
+            self.canvas.bind("<B1-Motion>", self.trace_freehand)
+            self.canvas.bind("<ButtonRelease-1>", self.save_freehand)
             self.canvas.bind("<Motion>", self.motion_create_annotation)
             self.canvas.bind("<ButtonPress-3>", self.save_polygons)
         elif mode == "move":
-            self.canvas.bind("<ButtonPress-1>", self.select_move)
+            # drag the selected annotations, or select them like in delete mode
+            self.canvas.bind("<ButtonPress-1>", self.drag_from)
             self.canvas.bind("<B1-Motion>", self.move_annotation)
-        elif mode == "delete":
-            self.canvas.bind("<ButtonPress-1>", self.select_delete)
-            self.canvas.bind("<ButtonPress-3>", self.delete_annotation)
-        elif mode == "combine":
-            self.canvas.bind("<ButtonPress-1>", self.select_combine)
-            self.canvas.bind("<ButtonPress-3>", self.combine_annotation)
+            self.canvas.bind("<ButtonRelease-1>", self.drag_to)
+        elif mode == "delete" or mode == "combine":
+            # click to (de)select one, drag a box or, with shift, a lasso to select many
+            self.canvas.bind("<ButtonPress-1>", self.select_from)
+            self.canvas.bind("<B1-Motion>", self.select_drag)
+            self.canvas.bind("<ButtonRelease-1>", self.select_to)
+            if mode == "delete":
+                self.canvas.bind("<ButtonPress-3>", self.delete_annotation)
+            else:
+                self.canvas.bind("<ButtonPress-3>", self.combine_annotation)
         elif mode == "cut":
             self.canvas.bind("<ButtonPress-1>", self.create_cut)
 
     def unbind(self):
         """ Unbind keys"""
         self.canvas.unbind("<ButtonPress-1>")
+        self.canvas.unbind("<B1-Motion>")
+        self.canvas.unbind("<ButtonRelease-1>")
         self.canvas.unbind("<Motion>")
         self.canvas.unbind("<ButtonPress 3>")
 
     def set_shape(self, shape):
-        """ Set shape of the annotations (circle, ellipse, rectangle or polygon)"""
+        """ Set shape of the annotations (circle, ellipse, rectangle, polygon or freehand)"""
         if len(self.temp_polygon_point_ids):
             self.save_polygons(None)
         self.shape = shape
 
     def hide_annotations(self, event):
-        """ Toggles on/off annotations"""
-        if self.state:
-            state = "normal"
-        else:
-            state = "hidden"
-
-        for _, unique_id in self.Data:
-            canvas_id = self.canvas.find_withtag(unique_id)
-            self.canvas.itemconfig(canvas_id, state=state)
-
+        """ Toggles on/off annotations, with one canvas call per layer"""
         self.state = not self.state
+        if self.virtual_canvas:
+            self.virtual_canvas.state = "hidden" if self.state else "normal"
+        for layer in self.Data.layers.values():
+            self.canvas.itemconfigure(layer.tag, state=self.layer_state(layer))
+
+    def layer_state(self, layer):
+        return "hidden" if self.state or not layer.visible else "normal"
+
+    def item_tags(self, unique_id, line=False):
+        """ Canvas tags of an annotation: its unique id first, then the tag of its layer"""
+        if unique_id not in self.Data.annotations_tkinter:
+            return () if unique_id is None else (unique_id,)  # previews
+        tags = (unique_id, self.Data.layer_of(unique_id).tag)
+        if self.virtual_canvas:
+            tags += (VirtualCanvas.TAG,)  # re-projected by the virtual canvas, never scaled
+        return tags + ("LINE",) if line else tags
+
+    def item_color(self, unique_id):
+        if unique_id not in self.Data.annotations_tkinter:
+            return "green"
+        return self.Data.layer_of(unique_id).color
+
+    def item_state(self, unique_id):
+        if unique_id not in self.Data.annotations_tkinter:
+            return "normal"
+        return self.layer_state(self.Data.layer_of(unique_id))
+
+    def update_layer_menu(self):
+        """ Rebuilds the Layers menu, with a submenu per layer"""
+        self.layer_menu.delete(0, "end")
+        self.layer_menu.add_command(label="New layer...", command=self.new_layer)
+        self.layer_menu.add_separator()
+        for name, layer in self.Data.layers.items():
+            submenu = Menu(self.layer_menu, tearoff=0)
+            submenu.add_command(
+                label="Draw in this layer", command=lambda name=name: self.set_layer(name)
+            )
+            submenu.add_command(
+                label="Hide" if layer.visible else "Show",
+                command=lambda name=name: self.show_layer(name, not self.Data.layers[name].visible),
+            )
+            submenu.add_command(
+                label="Unlock" if layer.locked else "Lock",
+                command=lambda name=name: self.lock_layer(name, not self.Data.layers[name].locked),
+            )
+            submenu.add_command(label="Color...", command=lambda name=name: self.color_layer(name))
+            label = name + (" (active)" if name == self.layer else "")
+            self.layer_menu.add_cascade(label=label, menu=submenu)
+
+    def new_layer(self):
+        name = simpledialog.askstring("New layer", "Name of the layer:", parent=self.master)
+        if name:
+            self.Data.add_layer(name)
+            self.set_layer(name)
+
+    def set_layer(self, name):
+        """ Sets the layer new annotations are created in"""
+        self.layer = name
+        self.update_layer_menu()
+
+    def show_layer(self, name, visible=True):
+        """ Shows or hides all annotations of a layer at once"""
+        layer = self.Data.layers[name]
+        layer.visible = visible
+        self.canvas.itemconfigure(layer.tag, state=self.layer_state(layer))
+        self.update_layer_menu()
+
+    def lock_layer(self, name, locked=True):
+        """ Annotations of locked layers cannot be selected, moved, deleted, combined or cut"""
+        self.Data.layers[name].locked = locked
+        self.update_layer_menu()
+
+    def color_layer(self, name, color=None):
+        """ Recolors all annotations of a layer at once, selected annotations keep their color"""
+        layer = self.Data.layers[name]
+        color = color or colorchooser.askcolor(color=layer.color, parent=self.master)[1]
+        if not color:
+            return
+        layer.color = color
+        unselected = "{}&&!MOVE&&!DELETE&&!COMBINE".format(layer.tag)
+        self.canvas.itemconfigure(unselected + "&&!LINE", fill=color, outline=color)
+        self.canvas.itemconfigure(unselected + "&&LINE", fill=color)
+
+    def editable_layers(self):
+        return [
+            name for name, layer in self.Data.layers.items() if layer.visible and not layer.locked
+        ]
 
+    @traced("create_annotation", input=True, paint=True)
     def create_annotation(self, event):
         """ Creates annotations using the coordinates of left mouse clicks"""
         unique_id = str(uuid.uuid4())
         if self.shape == "polygon":
             self.draw_polygon(event)
+        elif self.shape == "freehand":
+            self.start_freehand(event)
         else:
             # Get normalized coordinates
             x_norm, y_norm = self.get_coords(event)
@@ -208,20 +380,22 @@ class Annotator(Frame):
             self.temp_coords.append([x_canvas, y_canvas])
 
             if len(self.temp_coords) >= 2:
+                # Save annotation information
+                self.engine.create_annotation(
+                    self.temp_coords_norm[0],
+                    self.temp_coords_norm[1],
+                    self.shape,
+                    unique_id=unique_id,
+                    layer=self.layer,
+                )
+
                 # Draw annotation on canvas
                 canvas_id = self.create_annotation_func(
                     unique_id,
                     self.temp_coords[0],
                     self.temp_coords[1],
                 )
-
-                # Save annotation information
-                self.Data.add_annotation(
-                    unique_id,
-                    canvas_id,
-                    self.temp_coords_norm,
-                    self.shape,
-                )
+                self.Data.annotations_tkinter[unique_id].canvas_id = canvas_id
 
                 # Reset annotations creation
                 self.temp_coords = []
@@ -233,45 +407,31 @@ class Annotator(Frame):
         """ Depending on the shape of the functions draws a circle, ellipse, rectangle or polygon """
         if not shape:
             shape = self.shape
+        color = self.item_color(unique_id)
+        options = {
+            "fill": color,
+            "outline": color,
+            "width": 3,
+            "stipple": "gray12",
+            "tags": self.item_tags(unique_id),
+            "state": self.item_state(unique_id),
+        }
 
         if shape == "ellipse":
             x0, y0, x1, y1 = get_ellipse(coord1, coord2)
             point_list = oval2poly(x0, y0, x1, y1)
-            canvas_id = self.canvas.create_polygon(
-                point_list,
-                fill="green",
-                outline="green",
-                width=3,
-                stipple="gray12",
-                tags=unique_id,
-            )
+            canvas_id = self.canvas.create_polygon(point_list, **options)
         elif shape == "circle":
             x0, y0, x1, y1 = get_circle(coord1, coord2)
             point_list = oval2poly(x0, y0, x1, y1)
-            canvas_id = self.canvas.create_polygon(
-                point_list,
-                fill="green",
-                outline="green",
-                width=3,
-                stipple="gray12",
-                tags=unique_id,
-            )
+            canvas_id = self.canvas.create_polygon(point_list, **options)
         elif shape == "rectangle":
             x0, y0, x1, y1 = get_rectangle(coord1, coord2)
-            canvas_id = self.canvas.create_rectangle(
-                x0,
-                y0,
-                x1,
-                y1,
-                fill="green",
-                outline="green",
-                width=3,
-                stipple="gray12",
-                tags=unique_id,
-            )
+            canvas_id = self.canvas.create_rectangle(x0, y0, x1, y1, **options)
 
         return canvas_id
 
+    @traced("motion_create_annotation", input=True, paint=True)
     def motion_create_annotation(self, event):
         """ Track mouse position over the canvas """
         x_canvas = self.canvas.canvasx(event.x)
@@ -286,198 +446,197 @@ class Annotator(Frame):
                 (x_canvas, y_canvas),
             )
 
-    def select_delete(self, event):
-        """ Selects/deselects the closest annotation and adds/removes 'DELETE' tag"""
-        delete_canvas_id = self.canvas.find_withtag("current")[0]
+    def find_annotation(self, event, halo=2):
+        """ Returns the unique id of the topmost annotation under the mouse, halo is in canvas pixels"""
+        x_norm, y_norm = self.canvas2norm(
+            self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        )
+        unique_ids = self.Data.query_point(x_norm, y_norm, halo=halo / self.imscale)
+        for unique_id in unique_ids:
+            if self.selectable(unique_id):
+                return unique_id
+
+    def selectable(self, unique_id):
+        """
+        Annotations that are not drawn (too small or not loaded yet) cannot be selected,
+        neither can those in hidden or locked layers
+        """
+        layer = self.Data.layer_of(unique_id)
+        return layer.visible and not layer.locked and self.Data.get_canvas_id(unique_id) is not None
+
+    def is_line(self, unique_id):
+        """ Polygons of two points are drawn as line, which has no outline"""
+        return self.Data.annotations_tkinter[unique_id].shape == "polygon" and (
+            self.Data.store.counts[self.Data.store.rows[unique_id]] == 2
+        )
 
-        if delete_canvas_id != self.image_id and delete_canvas_id != self.container:
-            if delete_canvas_id in self.delete_ids:
-                self.canvas.itemconfigure(
-                    delete_canvas_id, outline="green", fill="green"
+    def update_items(self, commands):
+        """ Runs canvas subcommands for many items in one Tcl evaluation"""
+        if commands:
+            widget = str(self.canvas)
+            self.canvas.tk.eval(
+                "\n".join(
+                    " ".join([widget] + ["{%s}" % word for word in command]) for command in commands
                 )
-                self.canvas.dtag(delete_canvas_id, "DELETE")
-                self.delete_ids.pop(self.delete_ids.index(delete_canvas_id))
+            )
 
-            elif (
-                delete_canvas_id != self.move_id
-                and delete_canvas_id not in self.combine_ids
-            ):
-                self.canvas.itemconfigure(
-                    delete_canvas_id,
-                    outline="red",
-                    fill="red",
-                )
-                self.canvas.addtag_withtag("DELETE", delete_canvas_id)
-                self.delete_ids.append(delete_canvas_id)
-
-    def select_move(self, event):
-        """ Selects/deselects the closest annotation and adds/removes 'MOVE' tag"""
-        move_canvas_id = self.canvas.find_withtag("current")[0]
-
-        if move_canvas_id != self.image_id and move_canvas_id != self.container:
-            if move_canvas_id == self.move_id:
-                self.canvas.itemconfigure(move_canvas_id, outline="green", fill="green")
-                self.canvas.dtag(move_canvas_id, "MOVE")
-                self.move_id = None
-                self.move_polygon_points = []
-                self.canvas.delete("POINTS")
-
-            elif (
-                move_canvas_id not in self.delete_ids
-                and move_canvas_id not in self.combine_ids
-            ):  # TODO ADD points when you select
-                if not self.move_id:
-                    self.canvas.itemconfigure(
-                        move_canvas_id, outline="blue", fill="blue"
-                    )
-                    self.canvas.addtag_withtag("MOVE", move_canvas_id)
-                    self.move_id = move_canvas_id
-
-    def select_combine(self, event=None, canvas_id=None):
-        """ Selects/deselects the closest annotation and adds/removes 'COMBINE' tag"""
-        if event:
-            x = self.canvas.canvasx(event.x)
-            y = self.canvas.canvasy(event.y)
-            combine_canvas_id = event.widget.find_closest(x, y, halo=2)[0]
-        if canvas_id:
-            combine_canvas_id = canvas_id
-
-        if combine_canvas_id != self.image_id and combine_canvas_id != self.container:
-            if combine_canvas_id in self.combine_ids:
-                fill = "green"
-                self.canvas.itemconfigure(combine_canvas_id, outline="green", fill=fill)
-                self.canvas.dtag(combine_canvas_id, "COMBINE")
-                self.combine_ids.pop(self.combine_ids.index(combine_canvas_id))
-
-            elif (
-                combine_canvas_id != self.move_id
-                and combine_canvas_id not in self.delete_ids
-            ):
-                self.canvas.itemconfigure(
-                    combine_canvas_id,
-                    outline="yellow",
-                    fill="yellow",
+    def selection(self, mode):
+        """ Returns the set of selected unique ids of the delete, combine or move mode"""
+        return getattr(self, mode + "_ids")
+
+    def select(self, unique_ids, mode, toggle=False):
+        """
+        Adds annotations to the delete or combine selection, selected ones are removed instead
+        if toggle. The tags and colors of all items are changed in one batch.
+        """
+        tag, color = self.SELECTIONS[mode]
+        selected = self.selection(mode)
+        other = set().union(*(self.selection(m) for m in self.SELECTIONS if m != mode))
+
+        unique_ids = [i for i in unique_ids if i not in other and self.selectable(i)]
+        added = [i for i in unique_ids if i not in selected]
+        if toggle:
+            self.deselect([i for i in unique_ids if i in selected], mode)
+        selected.update(added)
+
+        commands = []
+        for unique_id in added:
+            canvas_id = self.Data.get_canvas_id(unique_id)
+            commands.append(("addtag", tag, "withtag", canvas_id))
+            commands.append(("itemconfigure", canvas_id, "-fill", color))
+            if not self.is_line(unique_id):
+                commands.append(("itemconfigure", canvas_id, "-outline", color))
+        self.update_items(commands)
+
+    def deselect(self, unique_ids, mode):
+        """ Removes annotations from the delete or combine selection, they get their layer color"""
+        tag, _ = self.SELECTIONS[mode]
+        selected = self.selection(mode)
+        commands = []
+        for unique_id in unique_ids:
+            selected.discard(unique_id)
+            canvas_id = self.Data.get_canvas_id(unique_id)
+            if canvas_id is None:
+                continue
+            color = self.item_color(unique_id)
+            commands.append(("dtag", canvas_id, tag))
+            commands.append(("itemconfigure", canvas_id, "-fill", color))
+            if not self.is_line(unique_id):
+                commands.append(("itemconfigure", canvas_id, "-outline", color))
+        self.update_items(commands)
+
+    def select_from(self, event):
+        """ Starts a click, box or (with shift) lasso selection"""
+        self.select_points = [(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))]
+        self.select_lasso = bool(event.state & 0x0001)
+
+    def select_drag(self, event):
+        """ Draws the box or lasso while the mouse is dragged"""
+        if not self.select_points:
+            return
+        point = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        self.canvas.delete("SELECT")
+        if self.select_lasso:
+            self.select_points.append(point)
+            if len(self.select_points) > 1:
+                self.canvas.create_line(
+                    self.select_points, fill="white", dash=(4, 2), tags=("SELECT")
                 )
-                self.canvas.addtag_withtag("COMBINE", combine_canvas_id)
-                self.combine_ids.append(combine_canvas_id)
+        else:
+            self.select_points[1:] = [point]
+            self.canvas.create_rectangle(
+                self.select_points[0], point, outline="white", dash=(4, 2), tags=("SELECT")
+            )
 
+    def select_to(self, event):
+        """ (De)selects the clicked annotation, or selects all annotations in the box or lasso"""
+        points = self.select_points
+        self.select_points = []
+        self.canvas.delete("SELECT")
+        if not points:
+            return
+        x0, y0 = points[0]
+        x1, y1 = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        mode = self.canvas_mode
+
+        if len(points) < 2 or max(abs(x1 - x0), abs(y1 - y0)) < 3:
+            unique_id = self.find_annotation(event, halo=0 if mode == "delete" else 2)
+            if unique_id is not None:
+                self.select([unique_id], mode, toggle=True)
+        elif self.select_lasso:
+            lasso = [self.canvas2norm(x, y) for x, y in points]
+            self.select(self.Data.query_polygon(lasso), mode)
+        else:
+            box = self.canvas2norm(x0, y0) + self.canvas2norm(x1, y1)
+            self.select(self.Data.query_box(*box, contained=True), mode)
+
+    def drag_from(self, event):
+        """
+        Starts dragging the move selection when an annotation is pressed (which is selected
+        first if it was not), otherwise starts a click, box or lasso selection
+        """
+        unique_id = self.find_annotation(event, halo=0)
+        if unique_id is None or unique_id in self.delete_ids or unique_id in self.combine_ids:
+            self.select_from(event)
+            return
+        self.drag_clicked = unique_id if unique_id in self.move_ids else None
+        self.select([unique_id], "move")
+        self.drag_last = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        self.drag_delta = (0, 0)
+
+        # a dashed box around the selection is shown instead of the vertices
+        bbox = self.canvas.bbox("MOVE")
+        if bbox:
+            self.canvas.create_rectangle(bbox, outline="white", dash=(4, 2), tags=("PREVIEW"))
+
+    @traced("move_annotation", input=True, paint=True)
     def move_annotation(self, event):
-        """ Moves annotations with tag 'MOVE' by presing the wheelmouse button and moving the mouse"""
-        if self.move_id:
-            unique_id = self.canvas.gettags(self.move_id)[0]
-            coords, shape = self.Data.get_coords_from_unique_id(unique_id)
-
-            if shape == "polygon":
-                self.move_polygon(event)
-            else:
-                # Image dimensions
-                x_dim = abs(coords[0][0] - coords[1][0])
-                y_dim = abs(coords[0][1] - coords[1][1])
-
-                # Create new annotations at new location
-                x_norm, y_norm = self.get_coords(event)
-                coord1_norm, coord2_norm = find_coords((x_norm, y_norm), x_dim, y_dim)
-
-                x_canvas = self.canvas.canvasx(event.x)
-                y_canvas = self.canvas.canvasy(event.y)
-                coord1_scaled, coord2_scaled = find_coords(
-                    (x_canvas, y_canvas),
-                    x_dim * self.imscale,
-                    y_dim * self.imscale,
-                )
-
-                if shape == "ellipse":
-                    x0, y0, x1, y1 = get_ellipse(coord1_scaled, coord2_scaled)
-                    point_list = oval2poly(x0, y0, x1, y1)
-
-                elif shape == "circle":
-                    x0, y0, x1, y1 = get_circle(coord1_scaled, coord2_scaled)
-                    point_list = oval2poly(x0, y0, x1, y1)
-
-                elif shape == "rectangle":
-                    x0, y0, x1, y1 = get_rectangle(coord1_scaled, coord2_scaled)
-                    point_list = [x0, y0, x1, y1]
-
-                self.canvas.delete("POINTS")
-                self.draw_points(
-                    [(x, y) for x, y in zip(point_list[0::2], point_list[1::2])],
-                    color="blue",
-                    tags=("POINTS"),
-                )
+        """ Moves the items of the selected annotations with the mouse, the data is not changed yet"""
+        if self.drag_last is None:
+            self.select_drag(event)
+            return
+        x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        dx, dy = x - self.drag_last[0], y - self.drag_last[1]
+        self.canvas.move("MOVE", dx, dy)
+        self.canvas.move("PREVIEW", dx, dy)
+        self.drag_last = (x, y)
+        # the delta is kept in image coordinates, so zooming while dragging is fine
+        self.drag_delta = (
+            self.drag_delta[0] + dx / self.imscale,
+            self.drag_delta[1] + dy / self.imscale,
+        )
 
-                self.canvas.coords(self.move_id, point_list)
-                self.Data.edit_annotation(
-                    unique_id,
-                    self.move_id,
-                    [coord1_norm, coord2_norm],
-                )
+    def drag_to(self, event):
+        """ Moves the selected annotations in the data by the dragged distance, in one batch"""
+        if self.drag_last is None:
+            self.select_to(event)
+            return
+        self.canvas.delete("PREVIEW")
+        self.drag_last = None
+        if self.drag_delta != (0, 0):
+            self.engine.translate_annotations(self.move_ids, *self.drag_delta)
+            self.__lod_done.difference_update(self.move_ids)
+        elif self.drag_clicked is not None:
+            self.deselect([self.drag_clicked], "move")  # a click on a selected annotation
+        self.drag_clicked = None
 
     def delete_annotation(self, event):
-        """ Deletes all canvas objects with the tag 'DELETE'"""
-        for canvas_id in self.canvas.find_withtag("DELETE"):
-            unique_id = self.canvas.gettags(canvas_id)[0]
-            self.canvas.delete(canvas_id)
-            self.Data.delete_annotation(unique_id)
+        """ Deletes all selected annotations, with one canvas call"""
+        self.canvas.delete("DELETE")
+        annotations = self.Data.annotations_tkinter
+        self.engine.delete_annotations([i for i in self.delete_ids if i in annotations])
+        self.delete_ids = set()
 
     def combine_annotation(self, event):
-        """ Combines annotations together"""
-        polygon_list = []
-        index_tags = []
-        index_canvas = []
-
-        for canvas_id in self.canvas.find_withtag("COMBINE"):
-            unique_id = self.canvas.gettags(canvas_id)[0]
-            index_canvas.append(canvas_id)
-            index_tags.append(unique_id)
-
-            coords_norm, shape = self.Data.get_coords_from_unique_id(unique_id)
-            if shape == "ellipse":
-                coord1, coord2 = coords_norm
-                x0, y0, x1, y1 = get_ellipse(coord1, coord2)
-                point_list = oval2poly(x0, y0, x1, y1)
-                point_list = [
-                    (x, y) for x, y in zip(point_list[0::2], point_list[1::2])
-                ]
-                polygon = Polygon(point_list)
-            elif shape == "circle":
-                coord1, coord2 = coords_norm
-                x0, y0, x1, y1 = get_circle(coord1, coord2)
-                point_list = oval2poly(x0, y0, x1, y1)
-                point_list = [
-                    (x, y) for x, y in zip(point_list[0::2], point_list[1::2])
-                ]
-                polygon = Polygon(point_list)
-            elif shape == "rectangle":
-                coord1, coord2 = coords_norm
-                x0, y0, x1, y1 = get_rectangle(coord1, coord2)
-                point_list = rec2poly(x0, y0, x1, y1)
-                point_list = [
-                    (x, y) for x, y in zip(point_list[0::2], point_list[1::2])
-                ]
-                polygon = Polygon(point_list)
-            else:
-                polygon = Polygon(coords_norm)
-            polygon_list.append(polygon)
-
-        union_polygon = unary_union(polygon_list)
-        if hasattr(union_polygon, "exterior"):
-            union_polygon = [tuple(x) for x in np.array(union_polygon.exterior)]
-            x_text, y_text = self.canvas.coords(self.text)
-            union_polygon_scale = [
-                (x_text + x[0] * self.imscale, y_text + x[1] * self.imscale)
-                for x in union_polygon
-            ]
-            unique_id = str(uuid.uuid4())
-            canvas_id = self.draw_polygon_func(
-                union_polygon_scale, False, unique_id=unique_id
-            )
-            self.Data.add_annotation(unique_id, canvas_id, union_polygon, "polygon")
-            for canvas_id, unique_id in zip(index_canvas, index_tags):
-                self.canvas.delete(canvas_id)
-                self.Data.delete_annotation(unique_id)
+        """ Combines the selected annotations together"""
+        unique_ids = [i for i in self.combine_ids if i in self.Data.annotations_tkinter]
+        unique_id = self.engine.combine_annotations(unique_ids)
+        if unique_id is not None:
+            self.canvas.delete("COMBINE")
+            self.combine_ids = set()
+            self.draw_annotation(unique_id)
         else:
-            for canvas_id in index_canvas:
-                self.select_combine(event=None, canvas_id=canvas_id)
+            self.deselect(unique_ids, "combine")
 
     def create_cut(self, event):
         # Get scaled coordinates
@@ -493,60 +652,83 @@ class Annotator(Frame):
             self.cut_points = []
 
     def cut_annotations(self, event, cut_line):
-        unique_id = self.canvas.find_withtag("current")[0]
-        coords_norm, shape = self.Data.get_coords_from_unique_id(unique_id)
-        if shape == "ellipse":
-            coord1, coord2 = coords_norm
-            x0, y0, x1, y1 = get_ellipse(coord1, coord2)
-            point_list = oval2poly(x0, y0, x1, y1)
-            point_list = [(x, y) for x, y in zip(point_list[0::2], point_list[1::2])]
-            polygon = Polygon(point_list)
-        elif shape == "circle":
-            coord1, coord2 = coords_norm
-            x0, y0, x1, y1 = get_circle(coord1, coord2)
-            point_list = oval2poly(x0, y0, x1, y1)
-            point_list = [(x, y) for x, y in zip(point_list[0::2], point_list[1::2])]
-            polygon = Polygon(point_list)
-        elif shape == "rectangle":
-            coord1, coord2 = coords_norm
-            x0, y0, x1, y1 = get_rectangle(coord1, coord2)
-            point_list = rec2poly(x0, y0, x1, y1)
-            point_list = [(x, y) for x, y in zip(point_list[0::2], point_list[1::2])]
-            polygon = Polygon(point_list)
-        else:
-            polygon = Polygon(coords_norm)
-        cut_line = LineString([(x, y) for x, y in zip(cut_line[0::2], cut_line[1::2])])
-        split_polygons = split(polygon, cut_line)
-        for split_polygon in split_polygons:
-            split_polygon = [tuple(x) for x in np.array(split_polygon.exterior)]
-            x_text, y_text = self.canvas.coords(self.text)
-            split_polygon_scale = [
-                (x_text + x[0] * self.imscale, y_text + x[1] * self.imscale)
-                for x in split_polygon
-            ]
-            unique_id = str(uuid.uuid4())
-            canvas_id = self.draw_polygon_func(
-                split_polygon_scale, False, unique_id=unique_id
-            )
-            self.Data.add_annotation(unique_id, canvas_id, split_polygon, "polygon")
-            self.canvas.delete(canvas_id)
-            self.Data.delete_annotation(unique_id)
+        """ Splits the annotations crossed by the cut line (canvas coordinates)"""
+        cut_line = [self.canvas2norm(x, y) for x, y in zip(cut_line[0::2], cut_line[1::2])]
+        cut = self.engine.cut_annotations(cut_line, layers=self.editable_layers())
+        for unique_id, split_ids in cut.items():
+            self.canvas.delete(unique_id)  # canvas items are tagged with their unique id
+            for split_id in split_ids:
+                self.draw_annotation(split_id)
 
     def draw_polygon(self, event):
-        """ Draws polygons"""
-        self.delete_polygons()
-
-        norm_x, norm_y = self.get_coords(event)
-        self.temp_polygon_points_norm.append((norm_x, norm_y))
+        """ Adds a vertex to the polygon, only its dot is drawn and the outline is updated"""
+        coords_norm = self.get_coords(event)
+        if coords_norm is None:
+            return
+        self.temp_polygon_points_norm.append(coords_norm)
 
         x_canvas = self.canvas.canvasx(event.x)
         y_canvas = self.canvas.canvasy(event.y)
-        self.temp_polygon_points.append((x_canvas, y_canvas))
-
-        points = self.draw_points(self.temp_polygon_points)
-        self.temp_polygon_point_ids.extend(points)
+        self.temp_polygon_point_ids.extend(self.draw_points([(x_canvas, y_canvas)]))
+        self.temp_polygon_id = self.update_outline(
+            self.temp_polygon_id, self.temp_polygon_points_norm
+        )
 
-        self.draw_polygon_func(self.temp_polygon_points, True)
+    def update_outline(self, canvas_id, points_norm):
+        """
+        Sets the coordinates of the outline of a polygon that is being drawn, a new item is only
+        created when the line of two points becomes a polygon. Returns the canvas id.
+        """
+        x, y, _, _ = self.canvas.coords(self.container)
+        centers = norm2canvas(points_norm, (x, y), self.imscale)
+        item_type = "polygon" if len(centers) > 2 else "line"
+        if canvas_id is not None and self.canvas.type(canvas_id) == item_type:
+            self.canvas.coords(canvas_id, [c for center in centers for c in center])
+            return canvas_id
+        if canvas_id is not None:
+            self.canvas.delete(canvas_id)
+        return self.draw_polygon_func(centers) or None
+
+    def start_freehand(self, event):
+        """ Starts tracing a polygon with the mouse"""
+        self.freehand_points = []
+        self.freehand_skipped = []
+        self.trace_freehand(event)
+
+    @traced("trace_freehand", input=True, paint=True)
+    def trace_freehand(self, event):
+        """
+        Adds the mouse position to the freehand trace, points that are too close or continue
+        the last segment are simplified away while tracing
+        """
+        if self.shape != "freehand":
+            return
+        x_canvas = self.canvas.canvasx(event.x)
+        y_canvas = self.canvas.canvasy(event.y)
+        x_norm, y_norm = self.canvas2norm(x_canvas, y_canvas)
+        if not self.engine.inside_image(x_norm, y_norm):
+            return
+        points = self.freehand_points
+        if extend_path(
+            points,
+            (x_norm, y_norm),
+            self.FREEHAND_DISTANCE / self.imscale,
+            tolerance=self.FREEHAND_TOLERANCE / self.imscale,
+            skipped=self.freehand_skipped,
+        ):
+            if len(points) >= 2:
+                self.freehand_id = self.update_outline(self.freehand_id, points)
+
+    def save_freehand(self, event):
+        """ Saves the freehand trace as polygon when the mouse is released"""
+        if self.freehand_id is not None:
+            self.canvas.delete(self.freehand_id)
+            self.freehand_id = None
+        points, self.freehand_points = self.freehand_points, []
+        if self.shape != "freehand" or len(points) < 3:
+            return
+        unique_id = self.engine.create_polygon(points, layer=self.layer)
+        self.draw_annotation(unique_id)
 
     def draw_points(self, centers, color="green", tags=()):
         """ Draws points at all points of polygons"""
@@ -563,91 +745,54 @@ class Annotator(Frame):
 
         return points
 
-    def draw_polygon_func(self, centers, do_temp=False, unique_id=None):
+    def draw_polygon_func(self, centers, unique_id=None):
         """ Function to draw polygon"""
         n_points = len(centers)
         canvas_id = 0
+        color = self.item_color(unique_id)
+        state = self.item_state(unique_id)
         if n_points > 2:
             canvas_id = self.canvas.create_polygon(
                 centers,
-                fill="green",
-                outline="green",
+                fill=color,
+                outline=color,
                 width=3,
                 stipple="gray12",
-                tags=unique_id,
+                tags=self.item_tags(unique_id),
+                state=state,
             )
         elif n_points == 2:
             canvas_id = self.canvas.create_line(
-                centers, fill="green", width=3, tags=unique_id
+                centers, fill=color, width=3, tags=self.item_tags(unique_id, line=True), state=state
             )
-
-        if do_temp:
-            self.temp_polygon_point_ids.append(canvas_id)
         return canvas_id
 
-    def move_polygon(self, event):
-        """ Moves polygon annotations"""
-        unique_id = self.canvas.gettags(self.move_id)[0]
-        if not len(self.move_polygon_points):
-            self.move_polygon_points = self.Data.annotations_tkinter[
-                unique_id
-            ].coords_norm
-
-        points_array = np.array(self.move_polygon_points)
-        center = np.average(points_array, 0)
-
-        norm_x, norm_y = self.get_coords(event)
-        move = np.array([norm_x, norm_y]) - center
-        point_centers = [
-            [x[0] + move[0], x[1] + move[1]] for x in self.move_polygon_points
-        ]
-
-        x_canvas = self.canvas.canvasx(event.x)
-        y_canvas = self.canvas.canvasy(event.y)
-
-        move_scaled = np.array([x_canvas, y_canvas]) - center * self.imscale
-        scaled_centers = [
-            [x[0] * self.imscale + move_scaled[0], x[1] * self.imscale + move_scaled[1]]
-            for x in self.move_polygon_points
-        ]
-        self.canvas.delete("POINTS")
-        self.draw_points(scaled_centers, color="blue", tags=("POINTS"))
-        self.canvas.coords(
-            self.move_id, [item for sublist in scaled_centers for item in sublist]
-        )
-
-        self.Data.edit_annotation(unique_id, self.move_id, point_centers)
-
     def save_polygons(self, event):
-        """ Saves current polygon, after this a new polygon can be saved"""
+        """
+        Saves current polygon, after this a new polygon can be saved.
+        A polygon of less than 3 points is discarded.
+        """
         if len(self.temp_polygon_point_ids):
-            unique_id = str(uuid.uuid4())
             self.delete_polygons()
-            canvas_id = self.draw_polygon_func(
-                self.temp_polygon_points, False, unique_id=unique_id
-            )
-            self.Data.add_annotation(
-                unique_id,
-                canvas_id,
-                self.temp_polygon_points_norm,
-                "polygon",
-            )
+            if len(self.temp_polygon_points_norm) >= 3:
+                points = self.temp_polygon_points_norm
+                unique_id = self.engine.create_polygon(points, layer=self.layer)
+                self.draw_annotation(unique_id)
             self.temp_polygon_point_ids = []
-            self.temp_polygon_points = []
+            self.temp_polygon_id = None
             self.temp_polygon_points_norm = []
 
     def delete_polygons(self):
-        """ Deletes all widged ids of temp_polygon"""
-        if len(self.temp_polygon_point_ids):
-            for canvas_id in self.temp_polygon_point_ids:
-                self.canvas.delete(canvas_id)
-
-    def __show_image(self):
+        """ Deletes the dots and the outline of the polygon being drawn, in one canvas call"""
+        canvas_ids = list(self.temp_polygon_point_ids)
+        if self.temp_polygon_id is not None:
+            canvas_ids.append(self.temp_polygon_id)
+        if canvas_ids:
+            self.canvas.delete(*canvas_ids)
+
+    @traced("show_image", "render")
+    def __show_image(self, fast=False):
         """ Show image on the Canvas. Implements correct image zoom almost like in Google Maps """
-        if self.image_id:
-            self.canvas.delete(self.image_id)
-            self.image_id = None
-            self.canvas.imagetk = None
         box_image = self.canvas.coords(self.container)  # get image area
         box_canvas = (
             self.canvas.canvasx(0),  # get visible area of the canvas
@@ -677,48 +822,138 @@ class Annotator(Frame):
         self.canvas.configure(
             scrollregion=tuple(map(int, box_scroll))
         )  # set scroll region
+        with TRACER.span("annotations", "canvas"):
+            if self.virtual_canvas:
+                self.virtual_canvas.update(
+                    (box_image[0], box_image[1]), self.imscale, box_canvas
+                )
+            elif not fast:
+                self.update_lod((box_image[0], box_image[1]))
         x1 = max(
             box_canvas[0] - box_image[0], 0
-        )  # get coordinates (x1,y1,x2,y2) of the image tile
+        )  # get coordinates (x1,y1,x2,y2) of the visible image area
         y1 = max(box_canvas[1] - box_image[1], 0)
         x2 = min(box_canvas[2], box_image[2]) - box_image[0]
         y2 = min(box_canvas[3], box_image[3]) - box_image[1]
         if (
             int(x2 - x1) > 0 and int(y2 - y1) > 0
         ):  # show image if it in the visible area
-
-            image = self.__pyramid[
-                max(0, self.__curr_img)
-            ].crop(  # crop current img from pyramid
-                (
-                    int(x1 / self.__scale),
-                    int(y1 / self.__scale),
-                    int(x2 / self.__scale),
-                    int(y2 / self.__scale),
+            # use the closest pyramid level that is already built
+            level = self.__pyramid.best_level(self.__curr_img)
+            self.__scale = self.__pyramid.scale(level, self.imscale * self.__ratio)
+            # only the tiles that are not yet on the canvas are rendered
+            with TRACER.span("tiles", "render", level=level, fast=fast):
+                self.__tiles.show(
+                    (box_image[0], box_image[1]), self.imscale, level, box_canvas, fast
                 )
-            )
-            #
-            imagetk = ImageTk.PhotoImage(
-                image.resize((int(x2 - x1), int(y2 - y1)), self.__filter)
-            )
-            self.image_id = self.canvas.create_image(
-                max(box_canvas[0], box_img_int[0]),
-                max(box_canvas[1], box_img_int[1]),
-                anchor="nw",
-                image=imagetk,
-            )
-            self.canvas.lower(self.image_id)  # set image into background
-            self.canvas.imagetk = (
-                imagetk  # keep an extra reference to prevent garbage-collection
-            )
+            self.__poll_tiles()
+        TRACER.painted()
+
+    def update_lod(self, origin):
+        """
+        Redraws the outlines of the visible annotations at the level of detail of the zoom.
+        Annotations smaller than POINT_SIZE pixels collapse to a dot, like in the virtual canvas.
+        """
+        zoom = math.floor(math.log(self.imscale, self.__reduction) + 1e-9)
+        if zoom != self.__lod_zoom:
+            self.__lod_zoom = zoom
+            self.__lod_done = set()
+        level = lod_level(self.imscale, self.__reduction)
+        tolerance = lod_tolerance(level, self.__reduction)
+
+        bboxes = self.Data.index.bboxes
+        for unique_id in self.Data.query_box(*self.visible_box()):
+            annotation = self.Data.annotations_tkinter[unique_id]
+            if annotation.canvas_id is None:
+                continue
+            bx0, by0, bx1, by1 = bboxes[unique_id]
+            tiny = max(bx1 - bx0, by1 - by0) * self.imscale < self.POINT_SIZE
+            collapsed = unique_id in self.__lod_points
+            if unique_id in self.__lod_done and tiny == collapsed:
+                continue
+            if tiny:
+                _, coords = project_point(annotation, bboxes[unique_id], origin, self.imscale)
+                self.__lod_points.add(unique_id)
+            elif annotation.shape == "rectangle" and not collapsed:
+                continue  # canvas.scale keeps rectangles exact
+            else:
+                _, coords = project_lod(annotation, origin, self.imscale, level, tolerance)
+                self.__lod_points.discard(unique_id)
+            self.canvas.coords(annotation.canvas_id, coords)
+            self.__lod_done.add(unique_id)
+
+    def __poll_tiles(self):
+        """ Places the tiles rendered by the worker threads, polls until all tiles are done"""
+        if self.__tiles_job is not None:
+            self.master.after_cancel(self.__tiles_job)
+            self.__tiles_job = None
+        if self.__tiles.poll():
+            self.__tiles_job = self.master.after(10, self.__poll_tiles)
+
+    def __poll_pyramid(self):
+        """ Redraws the image when the background thread finished a new pyramid level"""
+        if self.__pyramid.version != self.__pyramid_version:
+            self.__pyramid_version = self.__pyramid.version
+            self.__show_image()
+        if not self.__pyramid.complete:
+            self.master.after(100, self.__poll_pyramid)
 
     def load_annotations(self):
-        """ Load annotations"""
+        """ Load annotations, the canvas is filled in chunks while the file is parsed"""
         path = filedialog.askopenfilename()
-        loaded_annotations = self.Data.load_annotations(path=path)
-
-        for annotation, unique_id in loaded_annotations:
-            self.load_annotation(annotation, unique_id)
+        if not path:
+            return  # the dialog was cancelled
+        if self.loader:
+            self.loader.cancel()
+        # loaded annotations replace those with the same unique id, e.g. restored from the journal
+        self.replaced_ids = set(self.Data.annotations_tkinter)
+        self.loader = ProgressiveLoader(
+            self.master,
+            self.engine.iter_annotations(path),
+            self.draw_loaded,
+            self.Data,
+            self.visible_box,
+            progress=self.loading_progress,
+        )
+        self.loader.start()
+
+    def draw_loaded(self, unique_id):
+        """ Draws an annotation of the progressive loader"""
+        if unique_id in self.replaced_ids:
+            self.canvas.delete(unique_id)  # the item of the annotation it replaced
+            for mode in self.SELECTIONS:
+                self.selection(mode).discard(unique_id)
+        if self.virtual_canvas or unique_id not in self.Data.annotations_tkinter:
+            return  # the virtual canvas draws what is in view, or it was deleted meanwhile
+        self.load_annotation(self.Data.annotations_tkinter[unique_id], unique_id)
+
+    def visible_box(self):
+        """ Returns the visible area of the canvas in normalized coordinates"""
+        x0, y0 = self.canvas2norm(self.canvas.canvasx(0), self.canvas.canvasy(0))
+        x1, y1 = self.canvas2norm(
+            self.canvas.canvasx(self.canvas.winfo_width()),
+            self.canvas.canvasy(self.canvas.winfo_height()),
+        )
+        return x0, y0, x1, y1
+
+    def loading_progress(self, parsed, drawn, finished):
+        """ Shows the loading progress in the top left corner of the canvas"""
+        self.canvas.delete("PROGRESS")
+        if finished:
+            self.loader = None
+            self.replaced_ids = set()
+            self.update_layer_menu()  # the file may have added layers
+        else:
+            self.canvas.create_text(
+                self.canvas.canvasx(10),
+                self.canvas.canvasy(10),
+                anchor="nw",
+                fill="white",
+                text="Loading annotations: {} parsed, {} drawn".format(parsed, drawn),
+                tags=("PROGRESS"),
+            )
+        if self.virtual_canvas:
+            self.__render.request()
 
     def load_annotation(self, data, unique_id):
 
@@ -726,14 +961,10 @@ class Annotator(Frame):
         shape = data.shape
 
         x, y, _, _ = self.canvas.coords(self.container)
-        coords_scale = [
-            (x + i[0] * self.imscale, y + i[1] * self.imscale) for i in coords_norm
-        ]
+        coords_scale = norm2canvas(coords_norm, (x, y), self.imscale)
 
         if shape == "polygon":
-            canvas_id = self.draw_polygon_func(
-                coords_scale, do_temp=False, unique_id=unique_id
-            )
+            canvas_id = self.draw_polygon_func(coords_scale, unique_id=unique_id)
 
         else:
             coord1, coord2 = coords_scale
@@ -742,21 +973,57 @@ class Annotator(Frame):
             )
 
         data.canvas_id = canvas_id
+        return canvas_id
+
+    def draw_annotation(self, unique_id):
+        """ Draws an annotation that was made by the engine"""
+        return self.load_annotation(self.Data.annotations_tkinter[unique_id], unique_id)
 
     def save_annotations(self):
-        """ Saves annotations as json"""
-        save_path = filedialog.asksaveasfilename(defaultextension=".json")
-        self.Data.save_annotations(save_path)
+        """ Saves annotations as json or, for the .annb extension, in the binary format"""
+        save_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Json", "*.json"), ("Binary annotations", "*.annb")],
+        )
+        if not save_path:
+            return  # the dialog was cancelled
+        self.engine.save_annotations(save_path)
+
+    def show_statistics(self):
+        """ Opens a window with the counts and areas of the annotations"""
+        if self.statistics is None:
+            self.statistics = AnnotationStatistics(self.Data)
+
+        def visible_layers():  # hidden layers are left out of the overview
+            return [name for name, layer in self.Data.layers.items() if layer.visible]
+
+        StatisticsPanel(self.master, self.statistics, layers=visible_layers)
+
+    def close(self):
+        """ Writes the last changes to the autosave journal and closes the window"""
+        if self.journal:
+            self.journal.close()
+        self.master.destroy()
+
+    def save_trace(self):
+        """ Saves the recorded spans as Chrome trace json (chrome://tracing, ui.perfetto.dev)"""
+        save_path = filedialog.asksaveasfilename(
+            defaultextension=".json", filetypes=[("Chrome trace", "*.json")]
+        )
+        if save_path:
+            TRACER.save(save_path)
 
     def move_from(self, event):
         """ Remember previous coordinates for scrolling with the mouse """
         self.canvas.scan_mark(event.x, event.y)
 
+    @traced("move_to", input=True)
     def move_to(self, event):
         """ Drag (move) canvas to the new position """
         self.canvas.scan_dragto(event.x, event.y, gain=1)
-        self.__show_image()
+        self.__render.request()  # redrawn once per frame
 
+    @traced("wheel", input=True)
     def wheel(self, event):
         """ Zoom with mouse wheel """
         x = self.canvas.canvasx(event.x)  # get coordinates of the event on the canvas
@@ -774,31 +1041,32 @@ class Annotator(Frame):
         self.__curr_img = min(
             (-1) * int(math.log(k, self.__reduction)), len(self.__pyramid) - 1
         )
-        self.__scale = k * math.pow(self.__reduction, max(0, self.__curr_img))
+        self.__curr_img = max(0, self.__curr_img)
         #
-        self.canvas.scale("all", x, y, scale, scale)  # rescale all objects
+        # the virtual canvas re-projects its annotations from the normalized coordinates when it
+        # updates, scaling them here as well would be a pass over all of them on every step
+        tags = "!" + VirtualCanvas.TAG if self.virtual_canvas else "all"
+        self.canvas.scale(tags, x, y, scale, scale)  # rescale all objects
         # Redraw some figures before showing image on the screen
         self.redraw_figures()  # method for child classes
-        self.__show_image()
+        self.__render.request()  # redrawn once per frame
 
     def redraw_figures(self):
         pass
 
+    def canvas2norm(self, x_canvas, y_canvas):
+        """ Converts canvas coordinates to (unrounded) coordinates on the image without zoom"""
+        x0, y0, _, _ = self.canvas.coords(self.container)
+        return canvas2norm(x_canvas, y_canvas, (x0, y0), self.imscale)
+
     def get_coords(self, event):
         """ Get coordinates of the mouse click event on the image """
         x1 = self.canvas.canvasx(event.x)  # get coordinates of the event on the canvas
         y1 = self.canvas.canvasy(event.y)
         xy = self.canvas.coords(
-            self.image_id
+            self.container
         )  # get coords of image's upper left corner
-        x2 = round(
-            (x1 - xy[0]) / self.imscale
-        )  # get real (x,y) on the image without zoom
-        y2 = round((y1 - xy[1]) / self.imscale)
-        if 0 <= x2 <= self.image.size[0] and 0 <= y2 <= self.image.size[1]:
-            return (x2, y2)
-        else:
-            print("Outside of the image")
+        return self.engine.image_coords(x1, y1, xy[:2], self.imscale)
 
 
 # Main function
@@ -0,0 +1,410 @@
+"""
+Benchmarks of the annotator on synthetic fixtures.
+
+    python benchmark.py                         # pyramid, load/save and combine/cut benchmarks
+    python benchmark.py --sizes 10000           # a quick run, without the 25k and 50k pyramids
+    xvfb-run -a python benchmark.py --frames    # also the frame times of the Tk canvas
+    python benchmark.py --compare old.json new.json
+
+Results are written as json (with the git commit, python and library versions), by default to
+benchmark_results/<time>_<commit>.json, so runs of different commits can be compared.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+from annotation_engine import AnnotationEngine
+from image_pyramid import ImagePyramid
+from pyramid_cache import PyramidCache
+
+RESULTS_DIR = "benchmark_results"
+
+
+def git_commit():
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return output.stdout.strip()
+
+
+def metadata():
+    import shapely
+    import PIL
+
+    return {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "shapely": shapely.__version__,
+    }
+
+
+def peak_rss_mb():
+    """ Peak resident set size of this process in MB, None where it is not available"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10  # bytes on macOS
+
+
+def summary(times):
+    """ Statistics of a list of durations in seconds"""
+    times = sorted(times)
+    return {
+        "n": len(times),
+        "min_s": times[0],
+        "median_s": statistics.median(times),
+        "mean_s": statistics.mean(times),
+        "p95_s": times[min(len(times) - 1, int(round(0.95 * (len(times) - 1))))],
+        "max_s": times[-1],
+    }
+
+
+def timed(func, repeat=5, setup=None):
+    """ Runs func repeat times (setup() before every run, not timed), returns the summary"""
+    times = []
+    for _ in range(repeat):
+        arguments = (setup(),) if setup else ()
+        start = time.perf_counter()
+        func(*arguments)
+        times.append(time.perf_counter() - start)
+    return summary(times)
+
+
+# Fixtures
+
+
+def make_image(path, size, tile=1024, seed=0):
+    """ Writes a synthetic image of the given size, a noisy gradient tile repeated over the image"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:tile, 0:tile]
+    pattern = np.stack([x * 255 // tile, y * 255 // tile, (x + y) * 127 // tile], axis=-1)
+    pattern = (pattern + rng.integers(0, 32, pattern.shape)).clip(0, 255).astype(np.uint8)
+    block = Image.fromarray(pattern)
+
+    Image.MAX_IMAGE_PIXELS = None
+    image = Image.new("RGB", size)
+    for left in range(0, size[0], tile):
+        for top in range(0, size[1], tile):
+            image.paste(block, (left, top))
+    image.save(path, quality=90)
+    return path
+
+
+def make_annotations(n_vertices, image_size=(10000, 10000), vertices_per_polygon=50, seed=0):
+    """
+    Returns an engine with polygons (and one ellipse, circle and rectangle per 10 polygons)
+    with about n_vertices vertices in total, spread over the image.
+    """
+    rng = np.random.default_rng(seed)
+    engine = AnnotationEngine(image_size=image_size)
+    n_polygons = max(1, n_vertices // vertices_per_polygon)
+    angles = np.linspace(0, 2 * np.pi, vertices_per_polygon, endpoint=False)
+    centers = rng.uniform(100, np.array(image_size) - 100, (n_polygons, 2))
+    radii = rng.uniform(5, 60, n_polygons)
+    for i, (center, radius) in enumerate(zip(centers.round(), radii)):
+        jitter = rng.uniform(0.7, 1.0, vertices_per_polygon)
+        points = center + (radius * jitter)[:, None] * np.c_[np.cos(angles), np.sin(angles)]
+        engine.create_polygon(points.round().tolist())
+        if i % 10 == 0:
+            x, y = center.tolist()
+            engine.create_annotation((x, y), (x + 20, y + 10), "ellipse")
+            engine.create_annotation((x, y), (x + 15, y), "circle")
+            engine.create_annotation((x, y), (x + 30, y + 20), "rectangle")
+    return engine
+
+
+def overlapping_chain(n, size=40, step=30):
+    """ Returns an engine with n squares in a row, every square overlaps the next"""
+    engine = AnnotationEngine()
+    unique_ids = [
+        engine.create_polygon([(x, 0), (x + size, 0), (x + size, size), (x, size)])
+        for x in range(0, n * step, step)
+    ]
+    return engine, unique_ids
+
+
+# Benchmarks
+
+
+def pyramid_child(path, cache_dir, results, workers=None):
+    """ Builds a pyramid in a fresh process, so the peak RSS belongs to this build only"""
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    pyramid = ImagePyramid(path, cache=PyramidCache(cache_dir), workers=workers)
+    pyramid.start()
+    first_frame = time.perf_counter() - start
+    pyramid.wait()
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cached = ImagePyramid(path, cache=PyramidCache(cache_dir))
+    cached.start()
+    cached_start = time.perf_counter() - start
+    results.put(
+        {
+            "levels": len(pyramid),
+            "workers": workers or os.cpu_count(),
+            "first_frame_s": first_frame,
+            "build_s": build,
+            "cached_start_s": cached_start,
+            "peak_rss_mb": peak_rss_mb(),
+            "rss_before_mb": rss_before,
+        }
+    )
+
+
+def bench_pyramid(sizes, workdir, workers=None):
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        path = os.path.join(workdir, "image_{}.jpg".format(size))
+        start = time.perf_counter()
+        make_image(path, (size, size))
+        print("pyramid {size}x{size}: image written in {t:.1f} s".format(
+            size=size, t=time.perf_counter() - start
+        ))
+
+        queue = context.Queue()
+        process = context.Process(
+            target=pyramid_child, args=(path, os.path.join(workdir, "cache"), queue, workers)
+        )
+        process.start()
+        result = queue.get()
+        process.join()
+        result.update(size=size, file_mb=os.path.getsize(path) / 2 ** 20)
+        print("pyramid {size}x{size}: build {build_s:.2f} s, peak rss {peak_rss_mb:.0f} MB".format(
+            **result
+        ))
+        results.append(result)
+        os.remove(path)
+    return results
+
+
+def bench_io(vertex_counts, workdir, repeat):
+    results = []
+    for n_vertices in vertex_counts:
+        engine = make_annotations(n_vertices)
+        n_stored = int(engine.Data.store.counts[engine.Data.store.get_rows()].sum())
+        for extension in (".json", ".annb"):
+            path = os.path.join(workdir, "annotations_{}{}".format(n_vertices, extension))
+            save = timed(lambda: engine.save_annotations(path), repeat)
+            load = timed(lambda: AnnotationEngine().load_annotations(path), repeat)
+            result = {
+                "vertices": n_stored,
+                "annotations": len(engine),
+                "format": extension[1:],
+                "file_mb": os.path.getsize(path) / 2 ** 20,
+                "save": save,
+                "load": load,
+                "save_vertices_per_s": n_stored / save["median_s"],
+                "load_vertices_per_s": n_stored / load["median_s"],
+            }
+            print("io {vertices} vertices {format}: save {s:.3f} s, load {l:.3f} s".format(
+                s=save["median_s"], l=load["median_s"], **result
+            ))
+            results.append(result)
+            os.remove(path)
+    return results
+
+
+def bench_edit(selection_sizes, repeat):
+    results = []
+    for n in selection_sizes:
+        combine = timed(
+            lambda fixture: fixture[0].combine_annotations(fixture[1]),
+            repeat,
+            setup=lambda: overlapping_chain(n),
+        )
+        cut = timed(
+            lambda fixture: fixture[0].cut_annotations([(-10, 20), (n * 30 + 50, 20)]),
+            repeat,
+            setup=lambda: overlapping_chain(n, step=50),
+        )
+        print("edit {n} annotations: combine {c:.4f} s, cut {u:.4f} s".format(
+            n=n, c=combine["median_s"], u=cut["median_s"]
+        ))
+        results.append({"selected": n, "combine": combine, "cut": cut})
+    return results
+
+
+def bench_frames(size, n_frames, n_vertices, workdir, virtual):
+    """ Frame times of the annotator while panning and zooming, needs a display (e.g. Xvfb)"""
+    from types import SimpleNamespace
+    from tkinter import Tk
+    from annotator import Annotator
+
+    path = make_image(os.path.join(workdir, "frames.jpg"), (size, size))
+    engine = make_annotations(n_vertices, image_size=(size, size))
+    json_path = os.path.join(workdir, "frames.json")
+    engine.save_annotations(json_path)
+
+    root = Tk()
+    annotator = Annotator(root, virtual=virtual, path=path, autosave=False)
+    show_image = annotator._Annotator__show_image
+    tiles = annotator._Annotator__tiles
+    annotator._Annotator__pyramid.wait()
+    for annotation, unique_id in annotator.Data.load_annotations(json_path):
+        if not virtual:
+            annotator.load_annotation(annotation, unique_id)
+    root.update()
+
+    def settle():
+        """ Waits until the worker threads rendered every visible tile"""
+        while tiles.poll() or tiles.pending:
+            root.update()
+            time.sleep(0.001)
+
+    def frame(fast):
+        start = time.perf_counter()
+        show_image(fast)
+        root.update_idletasks()
+        drawn = time.perf_counter() - start
+        settle()
+        return drawn, time.perf_counter() - start
+
+    results = {"size": size, "vertices": n_vertices, "virtual": virtual}
+    for name, fast in (("pan_fast", True), ("pan_full", False)):
+        drawn, settled = [], []
+        annotator.move_from(SimpleNamespace(x=0, y=0))
+        for i in range(n_frames):
+            annotator.canvas.scan_dragto(-5 * (i + 1), -3 * (i + 1), gain=1)
+            times = frame(fast)
+            drawn.append(times[0])
+            settled.append(times[1])
+        results[name] = {"frame": summary(drawn), "settled": summary(settled)}
+
+    drawn, settled = [], []
+    for i in range(n_frames):
+        delta = 120 if (i // 5) % 2 else -120  # zoom out and in, 5 steps at a time
+        annotator.wheel(SimpleNamespace(x=500, y=500, delta=delta))
+        times = frame(False)
+        drawn.append(times[0])
+        settled.append(times[1])
+    results["zoom"] = {"frame": summary(drawn), "settled": summary(settled)}
+    results["tiles"] = tiles.stats()
+    print("frames ({}): pan {:.1f} ms, zoom {:.1f} ms".format(
+        "virtual" if virtual else "normal",
+        1000 * results["pan_full"]["frame"]["median_s"],
+        1000 * results["zoom"]["frame"]["median_s"],
+    ))
+    root.destroy()
+    return results
+
+
+# Comparison
+
+
+def flatten(results, prefix=""):
+    """ Returns {path: number} for all numbers in nested results, lists are keyed by position"""
+    flat = {}
+    items = results.items() if isinstance(results, dict) else enumerate(results)
+    for key, value in items:
+        path = "{}/{}".format(prefix, key) if prefix else str(key)
+        if isinstance(value, (dict, list)):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(old_path, new_path, threshold=0.1):
+    """ Prints the median times of two result files, changes larger than threshold are marked"""
+    with open(old_path) as f:
+        old = flatten(json.load(f)["results"])
+    with open(new_path) as f:
+        new = flatten(json.load(f)["results"])
+    for path in sorted(old.keys() & new.keys()):
+        if not path.endswith("median_s") or not old[path]:
+            continue
+        ratio = new[path] / old[path]
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "slower"
+        elif ratio < 1 - threshold:
+            mark = "faster"
+        print("{:<50} {:>10.4f} {:>10.4f} {:>6.2f}x {}".format(
+            path, old[path], new[path], ratio, mark
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--output", help="result file, default in benchmark_results/")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="*",
+        default=[10000, 25000, 50000],
+        help="pyramid image sizes, the largest needs about 10 GB of disk",
+    )
+    parser.add_argument(
+        "--vertices", type=int, nargs="*", default=[1000, 100000, 1000000], help="load/save sizes"
+    )
+    parser.add_argument(
+        "--selections", type=int, nargs="*", default=[10, 100, 1000], help="combine/cut sizes"
+    )
+    parser.add_argument("--workers", type=int, help="pyramid build processes, default every core")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--frames", action="store_true", help="frame times, needs a display")
+    parser.add_argument("--frame-size", type=int, default=10000)
+    parser.add_argument("--frame-count", type=int, default=50)
+    parser.add_argument("--frame-vertices", type=int, default=100000)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        results["pyramid"] = bench_pyramid(args.sizes, workdir, args.workers)
+        results["io"] = bench_io(args.vertices, workdir, args.repeat)
+        results["edit"] = bench_edit(args.selections, args.repeat)
+        if args.frames:
+            if not os.environ.get("DISPLAY") and sys.platform.startswith("linux"):
+                print("frames: no display, run with xvfb-run")
+                results["frames"] = None
+            else:
+                results["frames"] = [
+                    bench_frames(
+                        args.frame_size, args.frame_count, args.frame_vertices, workdir, virtual
+                    )
+                    for virtual in (False, True)
+                ]
+
+    meta = metadata()
+    output = args.output or os.path.join(
+        RESULTS_DIR, "{}_{}.json".format(meta["time"].replace(":", ""), meta["commit"])
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print("results written to {}".format(output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Binary annotation container (.annb)
+
+    MAGIC (4 bytes) | VERSION (uint16) | header length (uint32) | json header | arrays
+
+The json header lists every array with its dtype, shape, byte offset, byte length and compression.
+Uncompressed arrays are 64 byte aligned so they can be memory-mapped without copying.
+The arrays hold the annotations in the same form as the json schema:
+
+    types       int8 shape codes (see annotation_store.SHAPE_CODES)
+    offsets     int64, vertices of annotation i are vertices[offsets[i]:offsets[i + 1]]
+    vertices    float (n, 2); polygons: points, ellipses/circles: center and (radiusX, radiusY),
+                rectangles: coords and (width, height)
+    id_data     uint8 utf-8 encoded ids, id i is id_data[id_offsets[i]:id_offsets[i + 1]]
+    id_offsets  int64, ids of length 0 were not present in the json
+    area        float64, NaN if not present
+    accuracy    float64, NaN if not present
+    angle       float64 angleOfRotation of ellipses/circles, NaN if not present
+    layer       int32 (optional), index in the list of layer names in meta["layers"]
+"""
+import json
+import mmap
+import zlib
+import numpy as np
+
+from annotation_store import SHAPE_CODES, SHAPE_NAMES
+
+MAGIC = b"ANNB"
+VERSION = 1
+ALIGNMENT = 64
+EXTENSION = ".annb"
+
+
+def is_binary(path):
+    """ Returns True if the file is a binary annotation container"""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_arrays(path, arrays, meta=None, compress=False):
+    """ Writes named numpy arrays and a json serializable meta dict to a binary container"""
+    entries = {}
+    blobs = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        data = array.tobytes()
+        if compress:
+            data = zlib.compress(data, 6)
+        padding = (-offset) % ALIGNMENT
+        offset += padding
+        entries[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+            "length": len(data),
+            "compression": "zlib" if compress else None,
+        }
+        blobs.append((padding, data))
+        offset += len(data)
+
+    header = json.dumps({"arrays": entries, "meta": meta or {}}).encode("utf-8")
+    prefix = MAGIC + np.uint16(VERSION).tobytes() + np.uint32(len(header)).tobytes() + header
+    prefix += b"\0" * ((-len(prefix)) % ALIGNMENT)
+
+    with open(path, "wb") as f:
+        f.write(prefix)
+        for padding, data in blobs:
+            f.write(b"\0" * padding)
+            f.write(data)
+
+
+def read_arrays(path):
+    """
+    Reads a binary container, returns (arrays, meta).
+    Uncompressed arrays are read-only views on a memory map of the file.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a binary annotation file")
+        version = int(np.frombuffer(f.read(2), dtype=np.uint16)[0])
+        if version > VERSION:
+            raise ValueError(f"Binary annotation version {version} is not supported")
+        header_length = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+        header = json.loads(f.read(header_length).decode("utf-8"))
+        start = len(MAGIC) + 6 + header_length
+        start += (-start) % ALIGNMENT
+
+        entries = header["arrays"]
+        if any(entry["length"] for entry in entries.values()):
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buffer = b""
+
+    arrays = {}
+    for name, entry in entries.items():
+        begin = start + entry["offset"]
+        if entry["compression"] == "zlib":
+            data = zlib.decompress(buffer[begin : begin + entry["length"]])
+            array = np.frombuffer(data, dtype=entry["dtype"])
+        else:
+            count = entry["length"] // np.dtype(entry["dtype"]).itemsize
+            array = np.frombuffer(buffer, dtype=entry["dtype"], count=count, offset=begin)
+        arrays[name] = array.reshape(entry["shape"])
+    return arrays, header["meta"]
+
+
+def optional(data, key):
+    value = data.get(key)
+    return np.nan if value is None else value
+
+
+def json2arrays(annotations):
+    """ Converts annotations in the json schema to arrays, without loss"""
+    n = len(annotations)
+    types = np.empty(n, dtype=np.int8)
+    counts = np.empty(n, dtype=np.int64)
+    area = np.empty(n, dtype=np.float64)
+    accuracy = np.empty(n, dtype=np.float64)
+    angle = np.empty(n, dtype=np.float64)
+    layer = np.empty(n, dtype=np.int32)
+    layers = {"default": 0}
+    vertices = []
+    ids = []
+    integer = True
+
+    for i, annotation in enumerate(annotations):
+        shape = annotation["type"]
+        if shape == "ellipse" or shape == "circle":
+            points = [
+                (annotation["center"]["x"], annotation["center"]["y"]),
+                (annotation["radiusX"], annotation["radiusY"]),
+            ]
+        elif shape == "polygon":
+            points = [(point["x"], point["y"]) for point in annotation["points"]]
+        elif shape == "rectangle":
+            points = [tuple(annotation["coords"]), (annotation["width"], annotation["height"])]
+        else:
+            raise ValueError(f" Mode {shape} is not supported")
+
+        values = [v for point in points for v in point]
+        values += [annotation.get(key) for key in ("area", "accuracy", "angleOfRotation")]
+        integer = integer and all(v is None or isinstance(v, int) for v in values)
+        vertices.extend(points)
+        types[i] = SHAPE_CODES[shape]
+        counts[i] = len(points)
+        area[i] = optional(annotation, "area")
+        accuracy[i] = optional(annotation, "accuracy")
+        angle[i] = optional(annotation, "angleOfRotation")
+        ids.append(annotation.get("id", "").encode("utf-8"))
+        layer[i] = layers.setdefault(annotation.get("layer", "default"), len(layers))
+
+    id_lengths = np.fromiter((len(idx) for idx in ids), dtype=np.int64, count=n)
+    arrays = {
+        "types": types,
+        "offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "vertices": np.array(vertices, dtype=np.float64).reshape(-1, 2),
+        "id_data": np.frombuffer(b"".join(ids), dtype=np.uint8),
+        "id_offsets": np.concatenate([[0], np.cumsum(id_lengths)]).astype(np.int64),
+        "area": area,
+        "accuracy": accuracy,
+        "angle": angle,
+        "layer": layer,
+    }
+    return arrays, {"integer": integer, "layers": list(layers)}
+
+
+def decode_ids(arrays):
+    """ Returns the ids as list of strings, missing ids are None"""
+    data = arrays["id_data"].tobytes()
+    offsets = arrays["id_offsets"].tolist()
+    return [data[a:b].decode("utf-8") or None for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+def arrays2json(arrays, meta=None):
+    """ Converts arrays back to annotations in the json schema"""
+    number = int if (meta or {}).get("integer") else float
+    offsets = arrays["offsets"].tolist()
+    vertices = arrays["vertices"].tolist()
+    ids = decode_ids(arrays)
+    layers = (meta or {}).get("layers")
+    layer = arrays["layer"].tolist() if "layer" in arrays else None
+
+    annotations = []
+    for i, code in enumerate(arrays["types"].tolist()):
+        shape = SHAPE_NAMES[code]
+        points = [[number(v) for v in point] for point in vertices[offsets[i] : offsets[i + 1]]]
+        annotation = {"type": shape}
+        if shape == "ellipse" or shape == "circle":
+            if not np.isnan(arrays["angle"][i]):
+                annotation["angleOfRotation"] = number(arrays["angle"][i].item())
+            annotation["radiusX"], annotation["radiusY"] = points[1]
+            annotation["center"] = {"x": points[0][0], "y": points[0][1]}
+        elif shape == "polygon":
+            annotation["points"] = [{"x": x, "y": y} for x, y in points]
+        else:
+            annotation["coords"] = points[0]
+            annotation["width"], annotation["height"] = points[1]
+
+        for key in ("area", "accuracy"):
+            if not np.isnan(arrays[key][i]):
+                annotation[key] = number(arrays[key][i].item())
+        if ids[i] is not None:
+            annotation["id"] = ids[i]
+        if layer is not None and layers[layer[i]] != "default":
+            annotation["layer"] = layers[layer[i]]
+        annotations.append(annotation)
+    return annotations
+
+
+def convert_json_to_binary(json_path, binary_path, compress=False):
+    with open(json_path, "r") as f:
+        annotations = json.load(f)
+    arrays, meta = json2arrays(annotations)
+    write_arrays(binary_path, arrays, meta, compress=compress)
+
+
+def convert_binary_to_json(binary_path, json_path):
+    arrays, meta = read_arrays(binary_path)
+    with open(json_path, "w") as f:
+        json.dump(arrays2json(arrays, meta), f)
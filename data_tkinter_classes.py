@@ -1,52 +1,266 @@
+import os
 import json
 import uuid
 import numpy as np
-from copy import deepcopy  # dont know if this is the correct operation for this
+from shapely.geometry import LineString, Point, Polygon
+from shapely.prepared import prep
+
+from get_shapes import point_in_polygon, point_in_shape, shape2points, simplify_polygon
+from spatial_index import GridIndex
+from annotation_store import AnnotationStore, json_values, shortest_float64
+from json_stream import iter_json_array
+from annotation_store import SHAPE_CODES, SHAPE_NAMES
+from binary_format import EXTENSION, decode_ids, is_binary, read_arrays, write_arrays
+
+DEFAULT_LAYER = "default"
+
+
+class Layer:
+    """
+    Named group of annotations. All canvas items of a layer share its tag, so a layer is shown,
+    hidden or recolored with one canvas call. Locked layers cannot be selected.
+    """
+
+    __slots__ = ("name", "tag", "color", "visible", "locked")
+
+    def __init__(self, name, tag, color="green", visible=True, locked=False):
+        self.name = name
+        self.tag = tag
+        self.color = color
+        self.visible = visible
+        self.locked = locked
 
 
 class AnnotationsTkinter:
     def __init__(self):
         self.annotations_tkinter = {}
+        self.layers = {DEFAULT_LAYER: Layer(DEFAULT_LAYER, "LAYER_0")}
+        self.store = AnnotationStore()
+        self.index = GridIndex()
+        self.__keys = None  # cached list of the unique ids for indexing
+        # callables observer(action, unique_ids) called after "add", "edit" and "delete"
+        self.observers = []
 
     def __len__(self):
         return len(self.annotations_tkinter)
 
     def __getitem__(self, index):
-        idx = list(self.annotations_tkinter.keys())[
-            index
-        ]  # python 3.6+ dicts are ordered
+        if self.__keys is None:
+            self.__keys = list(self.annotations_tkinter.keys())  # python 3.6+ dicts are ordered
+        idx = self.__keys[index]
         return self.annotations_tkinter[idx], idx
 
+    def __iter__(self):
+        for idx, annotation in self.annotations_tkinter.items():
+            yield annotation, idx
+
+    def add_layer(self, name, color="green"):
+        """ Returns the layer with the name, it is created if it does not exist"""
+        if name not in self.layers:
+            self.layers[name] = Layer(name, "LAYER_{}".format(len(self.layers)), color)
+        return self.layers[name]
+
+    def layer_of(self, unique_id):
+        return self.layers[self.annotations_tkinter[unique_id].layer]
+
+    def set_layer(self, unique_ids, name):
+        """ Moves the annotations to a layer"""
+        unique_ids = list(unique_ids)
+        self.add_layer(name)
+        for unique_id in unique_ids:
+            self.annotations_tkinter[unique_id].layer = name
+        self.__notify("edit", unique_ids)
+
+    def __notify(self, action, unique_ids):
+        for observer in self.observers:
+            observer(action, unique_ids)
+
     def load_annotations(self, path):
+        if is_binary(path):
+            return self.__load_binary(path)
+        loaded_annotations = []
+        for batch in self.iter_annotations(path):
+            loaded_annotations.extend(batch)
+        return loaded_annotations
+
+    def iter_annotations(self, path, batch_size=1000, progress=None):
+        """
+        Loads the annotations of a json file incrementally.
+        Yields lists of (annotation, unique_id) with at most batch_size annotations,
+        progress is called with the loaded fraction of the file after every batch.
+        Observers are notified once per batch.
+        """
+        if is_binary(path):
+            loaded_annotations = self.__load_binary(path)
+            if progress:
+                progress(1.0)
+            for i in range(0, len(loaded_annotations), batch_size):
+                yield loaded_annotations[i : i + batch_size]
+            return
+
+        size = max(1, os.path.getsize(path))
         with open(path, "r") as f:
-            annotations = json.load(f)
-        return self.__convert2tkinter_format(annotations)
-
-    def save_annotations(self, path):
+            batch = []
+            for annotation, position in iter_json_array(f):
+                batch.append(self.__convert2tkinter(annotation))
+                if len(batch) == batch_size:
+                    self.__notify_batch(batch)
+                    if progress:
+                        progress(min(1.0, position / size))
+                    yield batch
+                    batch = []
+            if progress:
+                progress(1.0)
+            if batch:
+                self.__notify_batch(batch)
+                yield batch
+
+    def __notify_batch(self, batch):
+        # an id can occur twice in a file, the later annotation replaced the earlier one
+        self.__notify("add", list(dict.fromkeys(unique_id for _, unique_id in batch)))
+
+    def save_annotations(self, path, compress=False):
+        if path.endswith(EXTENSION):
+            self.__save_binary(path, compress=compress)
+            return
         annotations_json = self.__convert2json_format()
 
         with open(path, "w") as f:
             json.dump(annotations_json, f)
 
+    def __load_binary(self, path):
+        """ Loads a binary annotation file, the coordinates are copied into the store in one go"""
+        arrays, meta = read_arrays(path)
+        ids = [idx or str(uuid.uuid4()) for idx in decode_ids(arrays)]
+        for idx in ids:
+            if idx in self.annotations_tkinter:
+                self.delete_annotation(idx)
+
+        types = np.asarray(arrays["types"])
+        offsets = np.asarray(arrays["offsets"])
+        # the file stores the radius or size as second point, the store the second corner
+        vertices = np.array(arrays["vertices"], dtype=np.float64)
+        others = offsets[:-1][types != SHAPE_CODES["polygon"]]
+        vertices[others + 1] += vertices[others]
+        rows = self.store.extend(ids, vertices.astype(np.float32), np.diff(offsets), types)
+
+        shapes = [SHAPE_NAMES[code] for code in types.tolist()]
+        areas = [None if np.isnan(v) else v for v in arrays["area"].tolist()]
+        accuracies = [None if np.isnan(v) else v for v in arrays["accuracy"].tolist()]
+        sizes = np.asarray(arrays["vertices"])[offsets[:-1][types != SHAPE_CODES["polygon"]] + 1]
+        sizes = dict(zip(others.tolist(), sizes.tolist()))
+        starts = offsets.tolist()
+        if "layer" in arrays:
+            names = [self.add_layer(name).name for name in meta["layers"]]
+            layers = [names[code] for code in arrays["layer"].tolist()]
+        else:
+            layers = [DEFAULT_LAYER] * len(ids)
+        loaded_annotations = []
+        for i, idx in enumerate(ids):
+            shape = shapes[i]
+            if shape == "polygon":
+                annotation = AnnotationTkinter(None, area=areas[i], accuracy=accuracies[i])
+            elif shape == "rectangle":
+                width, height = sizes[starts[i]]
+                annotation = RectangleTkinter(
+                    None, area=areas[i], accuracy=accuracies[i], width=width, height=height
+                )
+            else:
+                radius_x, radius_y = sizes[starts[i]]
+                annotation = EllipseTkinter(
+                    None,
+                    shape,
+                    area=areas[i],
+                    accuracy=accuracies[i],
+                    radius_x=radius_x,
+                    radius_y=radius_y,
+                )
+            annotation.layer = layers[i]
+            annotation.bind(self.store, idx, add=False)
+            self.annotations_tkinter[idx] = annotation
+            loaded_annotations.append((annotation, idx))
+        self.index.insert_many(ids, self.store.bboxes[rows])
+        self.__keys = None
+        self.__notify("add", ids)
+        return loaded_annotations
+
+    def __save_binary(self, path, compress=False):
+        """ Writes all annotations to a binary annotation file"""
+        ids = list(self.annotations_tkinter.keys())
+        rows = self.store.get_rows(ids)
+        index, _, _ = self.store.vertex_index(rows)
+        # written as the decimals they were entered as, without float32 noise
+        vertices = shortest_float64(self.store.vertices[index])
+        counts = self.store.counts[rows].astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        types = self.store.types[rows]
+
+        # store the radius (as in the json) or size as second point
+        second = offsets[:-1][types != SHAPE_CODES["polygon"]] + 1
+        vertices[second] = shortest_float64(vertices[second] - vertices[second - 1])
+        ellipses = offsets[:-1][
+            (types == SHAPE_CODES["ellipse"]) | (types == SHAPE_CODES["circle"])
+        ] + 1
+        vertices[ellipses] = np.floor(np.abs(vertices[ellipses]))
+
+        def optional(values):
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+        annotations = [self.annotations_tkinter[idx] for idx in ids]
+        layer_codes = {name: code for code, name in enumerate(self.layers)}
+        encoded = [idx.encode("utf-8") for idx in ids]
+        id_lengths = np.array([len(idx) for idx in encoded], dtype=np.int64)
+        arrays = {
+            "types": types,
+            "offsets": offsets,
+            "vertices": vertices,
+            "id_data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "id_offsets": np.concatenate([[0], np.cumsum(id_lengths)]).astype(np.int64),
+            "area": optional([annotation.area for annotation in annotations]),
+            "accuracy": optional([annotation.accuracy for annotation in annotations]),
+            "angle": np.where(types == SHAPE_CODES["polygon"], np.nan, 0.0),
+            "layer": np.array(
+                [layer_codes[annotation.layer] for annotation in annotations], dtype=np.int32
+            ),
+        }
+        values = np.concatenate([vertices.ravel(), arrays["area"], arrays["accuracy"]])
+        values = values[~np.isnan(values)]
+        integer = bool(np.all(values == np.round(values)))
+        meta = {"integer": integer, "layers": list(self.layers)}
+        write_arrays(path, arrays, meta, compress=compress)
+
     def add_annotation(
         self,
         unique_id,
         canvas_id,
         coord_norm,
         shape,
+        layer=DEFAULT_LAYER,
     ):
         if shape == "polygon":
-            self.annotations_tkinter[unique_id] = AnnotationTkinter(
-                coord_norm, canvas_id=canvas_id
-            )
+            annotation = AnnotationTkinter(coord_norm, canvas_id=canvas_id)
         elif shape == "ellipse" or shape == "circle":
-            self.annotations_tkinter[unique_id] = EllipseTkinter(
-                coord_norm, shape, canvas_id=canvas_id
-            )
+            annotation = EllipseTkinter(coord_norm, shape, canvas_id=canvas_id)
         elif shape == "rectangle":
-            self.annotations_tkinter[unique_id] = RectangleTkinter(
-                coord_norm, canvas_id=canvas_id
-            )
+            annotation = RectangleTkinter(coord_norm, canvas_id=canvas_id)
+        else:
+            raise ValueError(f"shape {shape} is not supported")
+        annotation.layer = self.add_layer(layer).name
+        self.__register(unique_id, annotation)
+
+    def __register(self, unique_id, annotation, notify=True):
+        """
+        Stores the coordinates of an annotation in the columnar store and indexes it.
+        Without notify the caller notifies the observers, for a batch of annotations at once.
+        """
+        if unique_id in self.annotations_tkinter:
+            self.delete_annotation(unique_id)
+        self.annotations_tkinter[unique_id] = annotation
+        annotation.bind(self.store, unique_id)
+        self.index.insert(unique_id, self.store.bbox(unique_id))
+        self.__keys = None
+        if notify:
+            self.__notify("add", [unique_id])
 
     def edit_annotation(
         self,
@@ -55,9 +269,78 @@ class AnnotationsTkinter:
         coord_norm,
     ):
         self.annotations_tkinter[unique_id].edit_annotation(coord_norm, canvas_id)
+        self.index.insert(unique_id, self.store.bbox(unique_id))
+        self.__notify("edit", [unique_id])
 
     def delete_annotation(self, unique_id):
-        del self.annotations_tkinter[unique_id]
+        annotation = self.annotations_tkinter.pop(unique_id)
+        annotation.unbind()
+        self.store.delete(unique_id)
+        self.index.remove(unique_id)
+        self.__keys = None
+        self.__notify("delete", [unique_id])
+
+    def translate(self, unique_ids, dx, dy):
+        """ Moves the annotations by (dx, dy) in normalized coordinates"""
+        self.store.translate(unique_ids, dx, dy)
+        self.__reindex(unique_ids)
+
+    def scale(self, unique_ids, factor, center=(0, 0)):
+        """ Scales the annotations by factor around center in normalized coordinates"""
+        self.store.scale(unique_ids, factor, center)
+        self.__reindex(unique_ids)
+
+    def areas(self, unique_ids=None):
+        """ Returns the areas of the annotations (all annotations in store order if unique_ids is None)"""
+        return self.store.areas(unique_ids)
+
+    def bboxes(self, unique_ids=None):
+        """ Returns the (x0, y0, x1, y1) bounding boxes of the annotations as array"""
+        return self.store.bboxes[self.store.get_rows(unique_ids)]
+
+    def __reindex(self, unique_ids):
+        if unique_ids is None:
+            unique_ids = list(self.annotations_tkinter.keys())
+        for unique_id in unique_ids:
+            self.annotations_tkinter[unique_id].invalidate()
+            self.index.insert(unique_id, self.store.bbox(unique_id))
+        self.__notify("edit", unique_ids)
+
+    def get_geometry(self, unique_id):
+        return self.annotations_tkinter[unique_id].geometry
+
+    def get_prepared_geometry(self, unique_id):
+        return self.annotations_tkinter[unique_id].prepared
+
+    def get_canvas_id(self, unique_id):
+        return self.annotations_tkinter[unique_id].canvas_id
+
+    def query_point(self, x, y, halo=0):
+        """ Returns the ids of the annotations at (x, y) in normalized coordinates, topmost first"""
+        unique_ids = self.index.query_box((x - halo, y - halo, x + halo, y + halo))
+        return [
+            unique_id
+            for unique_id in unique_ids
+            if point_in_shape(x, y, *self.get_coords_from_unique_id(unique_id), halo=halo)
+        ]
+
+    def query_box(self, x0, y0, x1, y1, contained=False):
+        """ Returns the ids of the annotations that intersect (or lie inside) the box, topmost first"""
+        box = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        return self.index.query_box(box, contained=contained)
+
+    def query_polygon(self, points):
+        """ Returns the ids of the annotations whose bounding box center lies inside the polygon"""
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        unique_ids = self.index.query_box((min(xs), min(ys), max(xs), max(ys)))
+
+        selected = []
+        for unique_id in unique_ids:
+            x0, y0, x1, y1 = self.index.bboxes[unique_id]
+            if point_in_polygon((x0 + x1) / 2, (y0 + y1) / 2, points):
+                selected.append(unique_id)
+        return selected
 
     def get_coords_from_unique_id(self, unique_id):
         return (
@@ -65,30 +348,30 @@ class AnnotationsTkinter:
             self.annotations_tkinter[unique_id].shape,
         )
 
-    def __convert2tkinter_format(self, annotations):
-        tkinter_annotations = []
-        copy_annotations = deepcopy(annotations)
-        for annotation in copy_annotations:
-            if "id" in annotation:
-                idx = annotation["id"]
-            else:
-                idx = str(uuid.uuid4())
+    def __convert2tkinter(self, annotation):
+        """
+        Converts one json annotation and adds it, the json data is only read.
+        The observers are not notified, iter_annotations notifies them per batch.
+        """
+        if "id" in annotation:
+            idx = annotation["id"]
+        else:
+            idx = str(uuid.uuid4())
 
-            if annotation["type"] == "ellipse" or annotation["type"] == "circle":
+        if annotation["type"] == "ellipse" or annotation["type"] == "circle":
 
-                self.annotations_tkinter[idx] = self.__ellipse2tkinter(
-                    annotation, annotation["type"]
-                )
+            annotation_tkinter = self.__ellipse2tkinter(annotation, annotation["type"])
 
-            elif annotation["type"] == "polygon":
-                self.annotations_tkinter[idx] = self.__polygon2tkinter(annotation)
+        elif annotation["type"] == "polygon":
+            annotation_tkinter = self.__polygon2tkinter(annotation)
 
-            elif annotation["type"] == "rectangle":
-                self.annotations_tkinter[idx] = self.__rectangle2tkinter(annotation)
-            else:
-                raise ValueError(f" Mode {annotation['type']} is not supported")
-            tkinter_annotations.append((self.annotations_tkinter[idx], idx))
-        return tkinter_annotations
+        elif annotation["type"] == "rectangle":
+            annotation_tkinter = self.__rectangle2tkinter(annotation)
+        else:
+            raise ValueError(f" Mode {annotation['type']} is not supported")
+        annotation_tkinter.layer = self.add_layer(annotation.get("layer", DEFAULT_LAYER)).name
+        self.__register(idx, annotation_tkinter, notify=False)
+        return annotation_tkinter, idx
 
     @staticmethod
     def __ellipse2tkinter(data, shape):
@@ -166,7 +449,9 @@ class AnnotationsTkinter:
     def __convert2json_format(self):
         annotations_json = []
         for unique_id in list(self.annotations_tkinter.keys()):
-            annotation, shape = self.get_coords_from_unique_id(unique_id)
+            # float32 coordinates from the store, written without float32 noise
+            annotation = self.store.coords(unique_id)
+            shape = self.annotations_tkinter[unique_id].shape
 
             if shape == "ellipse" or shape == "circle":
                 json_annotation = self.__ellipse2json(annotation, shape)
@@ -177,6 +462,10 @@ class AnnotationsTkinter:
             else:
                 raise ValueError(f"shape {shape} is not supported")
 
+            json_annotation["id"] = unique_id  # loading the file again replaces, not duplicates
+            layer = self.annotations_tkinter[unique_id].layer
+            if layer != DEFAULT_LAYER:
+                json_annotation["layer"] = layer
             annotations_json.append(json_annotation)
 
         return annotations_json
@@ -197,8 +486,7 @@ class AnnotationsTkinter:
         json_annotation["radiusY"] = radius_y
 
         json_annotation["center"] = {}
-        json_annotation["center"]["x"] = x0
-        json_annotation["center"]["y"] = y0
+        json_annotation["center"]["x"], json_annotation["center"]["y"] = json_values(coord1)
 
         return json_annotation
 
@@ -208,7 +496,7 @@ class AnnotationsTkinter:
         json_annotation["type"] = "polygon"
 
         points = []
-        for point in data:
+        for point in json_values(data):
             json_point = {}
             json_point["x"] = point[0]
             json_point["y"] = point[1]
@@ -225,13 +513,28 @@ class AnnotationsTkinter:
 
         coord1, coord2 = data
 
-        json_annotation["coords"] = coord1
-        json_annotation["width"] = coord2[0] - coord1[0]
-        json_annotation["height"] = coord2[1] - coord1[1]
+        json_annotation["coords"] = json_values(coord1)
+        # the difference of the decimals, the float32 difference may be off by an ulp
+        size = shortest_float64(coord2) - shortest_float64(coord1)
+        json_annotation["width"], json_annotation["height"] = json_values(size)
         return json_annotation
 
 
 class AnnotationTkinter:
+    __slots__ = (
+        "_coords",
+        "_store",
+        "_unique_id",
+        "_geometry",
+        "_prepared",
+        "_simplified",
+        "shape",
+        "canvas_id",
+        "area",
+        "accuracy",
+        "layer",
+    )
+
     def __init__(
         self,
         coords_norm,
@@ -240,11 +543,81 @@ class AnnotationTkinter:
         area=None,
         accuracy=None,
     ):
-        self.coords_norm = coords_norm
+        self._coords = coords_norm
+        self._store = None
+        self._unique_id = None
+        self._geometry = None
+        self._prepared = None
+        self._simplified = None
         self.shape = shape
         self.canvas_id = canvas_id
         self.area = area
         self.accuracy = accuracy
+        self.layer = DEFAULT_LAYER
+
+    @property
+    def coords_norm(self):
+        if self._store is None:
+            return self._coords
+        return self._store.coords(self._unique_id).tolist()
+
+    @coords_norm.setter
+    def coords_norm(self, coords_norm):
+        if self._store is None:
+            self._coords = coords_norm
+        else:
+            self._store.edit(self._unique_id, coords_norm)
+        self.invalidate()
+
+    @property
+    def geometry(self):
+        """
+        Shapely polygon of the annotation, built on first use and cached until an edit.
+        Polygon annotations of two points are a LineString, of one point a Point.
+        """
+        if self._geometry is None:
+            points = shape2points(self.coords_norm, self.shape)
+            if len(points) >= 3:
+                self._geometry = Polygon(points)
+            elif len(points) == 2:
+                self._geometry = LineString(points)
+            else:
+                self._geometry = Point(points[0])
+        return self._geometry
+
+    @property
+    def prepared(self):
+        """ Prepared geometry for fast repeated predicates (intersects, contains)"""
+        if self._prepared is None:
+            self._prepared = prep(self.geometry)
+        return self._prepared
+
+    def simplified(self, level, tolerance):
+        """ Outline simplified for a level of detail, cached per level until an edit"""
+        if self._simplified is None:
+            self._simplified = {}
+        if level not in self._simplified:
+            self._simplified[level] = simplify_polygon(self.coords_norm, tolerance)
+        return self._simplified[level]
+
+    def invalidate(self):
+        self._geometry = None
+        self._prepared = None
+        self._simplified = None
+
+    def bind(self, store, unique_id, add=True):
+        """ Moves the coordinates into the columnar store, add=False if they are already in it"""
+        if add:
+            store.add(unique_id, self._coords, self.shape)
+        self._store = store
+        self._unique_id = unique_id
+        self._coords = None
+
+    def unbind(self):
+        """ Takes the coordinates back out of the store"""
+        self._coords = self.coords_norm
+        self._store = None
+        self._unique_id = None
 
     def edit_annotation(self, coord_norm, canvas_id):
         self.coords_norm = coord_norm
@@ -252,6 +625,8 @@ class AnnotationTkinter:
 
 
 class EllipseTkinter(AnnotationTkinter):
+    __slots__ = ("radius_x", "radius_y", "angle")
+
     def __init__(
         self,
         coords_norm,
@@ -263,7 +638,9 @@ class EllipseTkinter(AnnotationTkinter):
         radius_y=None,
         angle=None,
     ):
-        super().__init__(coords_norm, shape, canvas_id=None, area=None, accuracy=None)
+        super().__init__(
+            coords_norm, shape, canvas_id=canvas_id, area=area, accuracy=accuracy
+        )
 
         self.radius_x = radius_x
         self.radius_y = radius_y
@@ -277,6 +654,8 @@ class EllipseTkinter(AnnotationTkinter):
 
 
 class RectangleTkinter(AnnotationTkinter):
+    __slots__ = ("width", "height")
+
     def __init__(
         self,
         coords_norm,
@@ -289,9 +668,9 @@ class RectangleTkinter(AnnotationTkinter):
         super().__init__(
             coords_norm,
             shape="rectangle",
-            canvas_id=None,
-            area=None,
-            accuracy=None,
+            canvas_id=canvas_id,
+            area=area,
+            accuracy=accuracy,
         )
 
         self.width = width
@@ -1,4 +1,20 @@
 import math
+import numpy as np
+from functools import lru_cache
+
+
+def find_coords(center, xdim, ydim):
+    """
+    Finds the coordinates of the topleft
+    and bottomright corners of a region of interest (roi).
+    It uses the center and the roi dimension.
+    """
+    x0 = center[0] - int(xdim / 2)
+    x1 = center[0] + int(xdim / 2)
+
+    y0 = center[1] - int(ydim / 2)
+    y1 = center[1] + int(ydim / 2)
+    return (x0, y0), (x1, y1)
 
 
 def get_ellipse(coord1, coord2):
@@ -101,22 +117,283 @@ def oval2poly(x0, y0, x1, y1, steps=20, rotation=0):
     yc = y0 + b
 
     point_list = []
+    cos_theta, sin_theta = unit_circle_list(steps)
+    cos_rotation, sin_rotation = math.cos(rotation), math.sin(rotation)
 
     # create the oval as a list of points
     for i in range(steps):
 
-        # Calculate the angle for this step
-        # 360 degrees == 2 pi radians
-        theta = (math.pi * 2) * (float(i) / steps)
-
-        x1 = a * math.cos(theta)
-        y1 = b * math.sin(theta)
+        x1 = a * cos_theta[i]
+        y1 = b * sin_theta[i]
 
         # rotate x, y
-        x = (x1 * math.cos(rotation)) + (y1 * math.sin(rotation))
-        y = (y1 * math.cos(rotation)) - (x1 * math.sin(rotation))
+        x = (x1 * cos_rotation) + (y1 * sin_rotation)
+        y = (y1 * cos_rotation) - (x1 * sin_rotation)
 
         point_list.append(round(x + xc))
         point_list.append(round(y + yc))
 
-    return point_list
\ No newline at end of file
+    return point_list
+
+
+@lru_cache(maxsize=None)
+def unit_circle(steps):
+    """
+    Returns cos and sin of the angles of an oval with the given number of steps as arrays.
+    360 degrees == 2 pi radians
+    """
+    theta = (np.pi * 2) * (np.arange(steps) / steps)
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+    cos_theta.flags.writeable = False
+    sin_theta.flags.writeable = False
+    return cos_theta, sin_theta
+
+
+@lru_cache(maxsize=None)
+def unit_circle_list(steps):
+    cos_theta, sin_theta = unit_circle(steps)
+    return cos_theta.tolist(), sin_theta.tolist()
+
+
+def get_ellipses(coord1, coord2):
+    """
+    Batch version of get_ellipse, coord1 and coord2 are (n, 2) arrays.
+    Returns a (n, 4) array with the x0, y0, x1, y1 of every ellipse.
+    """
+    coord1 = np.asarray(coord1, dtype=np.float64).reshape(-1, 2)
+    coord2 = np.asarray(coord2, dtype=np.float64).reshape(-1, 2)
+    delta = coord2 - coord1
+    low = np.where(delta >= 0, coord1 - delta, coord2)
+    high = np.where(delta >= 0, coord2, coord1 - delta)
+    return np.column_stack([low[:, 0], low[:, 1], high[:, 0], high[:, 1]])
+
+
+def get_circles(coord1, coord2):
+    """
+    Batch version of get_circle, coord1 and coord2 are (n, 2) arrays.
+    Returns a (n, 4) array with the x0, y0, x1, y1 of every circle.
+    """
+    coord1 = np.asarray(coord1, dtype=np.float64).reshape(-1, 2)
+    coord2 = np.asarray(coord2, dtype=np.float64).reshape(-1, 2)
+    radius = np.hypot(*(coord1 - coord2).T)
+    return np.column_stack(
+        [coord1[:, 0] + radius, coord1[:, 1] - radius, coord1[:, 0] - radius, coord1[:, 1] + radius]
+    )
+
+
+def get_rectangles(coord1, coord2):
+    """
+    Batch version of get_rectangle, coord1 and coord2 are (n, 2) arrays.
+    Returns a (n, 4) array with the x0, y0, x1, y1 of every rectangle.
+    """
+    coord1 = np.asarray(coord1, dtype=np.float64).reshape(-1, 2)
+    coord2 = np.asarray(coord2, dtype=np.float64).reshape(-1, 2)
+    equal = coord1 == coord2
+    high = np.where(equal, 0, np.maximum(coord1, coord2))
+    low = np.where(equal, 0, np.minimum(coord1, coord2))
+    return np.column_stack([high[:, 0], high[:, 1], low[:, 0], low[:, 1]])
+
+
+def rec2polys(boxes):
+    """
+    Batch version of rec2poly, returns a (n, 8) array with the packed corners of every box.
+    """
+    x0, y0, x1, y1 = np.asarray(boxes, dtype=np.float64).reshape(-1, 4).T
+    return np.column_stack([x0, y0, x0, y1, x1, y1, x1, y0])
+
+
+def oval2polys(boxes, steps=20, rotation=0):
+    """
+    Batch version of oval2poly, boxes is a (n, 4) array as returned by get_ellipses.
+    Returns a (n, 2 * steps) array with the packed x, y coordinates of every oval.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    rotation = rotation * math.pi / 180.0
+    cos_theta, sin_theta = unit_circle(steps)
+
+    a = (boxes[:, 2] - boxes[:, 0])[:, None] / 2.0
+    b = (boxes[:, 3] - boxes[:, 1])[:, None] / 2.0
+    xc = boxes[:, 0][:, None] + a
+    yc = boxes[:, 1][:, None] + b
+
+    x1 = a * cos_theta
+    y1 = b * sin_theta
+    points = np.empty((len(boxes), 2 * steps))
+    points[:, 0::2] = np.round(x1 * math.cos(rotation) + y1 * math.sin(rotation) + xc)
+    points[:, 1::2] = np.round(y1 * math.cos(rotation) - x1 * math.sin(rotation) + yc)
+    return points
+
+
+def get_bbox(coords, shape):
+    """
+    Returns the bounding box (x0, y0, x1, y1) with x0 <= x1 and y0 <= y1 of an annotation.
+    For ellipses, circles and rectangles coords are the two points used to create them,
+    for polygons coords are the vertices.
+    """
+    if shape == "ellipse":
+        x0, y0, x1, y1 = get_ellipse(coords[0], coords[1])
+    elif shape == "circle":
+        x0, y0, x1, y1 = get_circle(coords[0], coords[1])
+    elif shape == "rectangle":
+        (x0, y0), (x1, y1) = coords[0], coords[1]
+    else:
+        xs = [point[0] for point in coords]
+        ys = [point[1] for point in coords]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def point_in_polygon(x, y, points):
+    """
+    Ray casting test, returns True if (x, y) lies inside the polygon given by its vertices.
+    """
+    inside = False
+    n = len(points)
+    for i in range(n):
+        xi, yi = points[i]
+        xj, yj = points[i - 1]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+    return inside
+
+
+def distance_to_polygon(x, y, points):
+    """
+    Returns the distance of (x, y) to the closest edge of the polygon.
+    """
+    distance = math.inf
+    for i in range(len(points)):
+        x0, y0 = points[i - 1]
+        x1, y1 = points[i]
+        dx, dy = x1 - x0, y1 - y0
+        length = dx * dx + dy * dy
+        t = 0 if length == 0 else max(0, min(1, ((x - x0) * dx + (y - y0) * dy) / length))
+        distance = min(distance, math.hypot(x - (x0 + t * dx), y - (y0 + t * dy)))
+    return distance
+
+
+def point_in_shape(x, y, coords, shape, halo=0):
+    """
+    Returns True if (x, y) lies inside the annotation or within halo of its outline.
+    """
+    x0, y0, x1, y1 = get_bbox(coords, shape)
+    if not (x0 - halo <= x <= x1 + halo and y0 - halo <= y <= y1 + halo):
+        return False
+
+    if shape == "rectangle":
+        return True
+    elif shape == "ellipse" or shape == "circle":
+        a = (x1 - x0) / 2 + halo
+        b = (y1 - y0) / 2 + halo
+        if a <= 0 or b <= 0:
+            return True
+        xc, yc = x0 + (x1 - x0) / 2, y0 + (y1 - y0) / 2
+        return ((x - xc) / a) ** 2 + ((y - yc) / b) ** 2 <= 1
+    else:
+        if len(coords) < 3:
+            return distance_to_polygon(x, y, coords) <= halo
+        return point_in_polygon(x, y, coords) or distance_to_polygon(x, y, coords) <= halo
+
+
+def shape2points(coords, shape):
+    """
+    Returns the outline of an annotation as list of (x, y) points.
+    Ellipses and circles are approximated by oval2poly, rectangles give their four corners.
+    """
+    if shape == "ellipse" or shape == "circle" or shape == "rectangle":
+        coord1, coord2 = coords
+        if shape == "ellipse":
+            point_list = oval2poly(*get_ellipse(coord1, coord2))
+        elif shape == "circle":
+            point_list = oval2poly(*get_circle(coord1, coord2))
+        else:
+            point_list = rec2poly(*get_rectangle(coord1, coord2))
+        return [(x, y) for x, y in zip(point_list[0::2], point_list[1::2])]
+    return [tuple(point) for point in coords]
+
+
+def ellipse_steps(radius, tolerance=0.5, min_steps=8, max_steps=64):
+    """
+    Returns the number of vertices needed to draw an oval with the given radius (in pixels),
+    so that no outline point is further than tolerance pixels from the polygon.
+    Works on scalars and arrays, the result is a multiple of 4.
+    """
+    radius = np.maximum(np.asarray(radius, dtype=np.float64), tolerance)
+    half_angle = np.arccos(np.clip(1 - tolerance / radius, -1, 1))
+    steps = np.ceil(np.pi / np.maximum(half_angle, 1e-9) / 4) * 4
+    steps = np.clip(steps, min_steps, max_steps).astype(np.int64)
+    return steps if steps.ndim else int(steps)
+
+
+def simplify_polygon(points, tolerance):
+    """
+    Douglas-Peucker simplification of a closed polygon.
+    Returns the points whose removal would move the outline more than tolerance, in order.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if tolerance <= 0 or len(points) <= 3:
+        return points.tolist()
+
+    closed = np.vstack([points, points[:1]])
+    keep = np.zeros(len(closed), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(closed) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = closed[first], closed[last]
+        inner = closed[first + 1 : last]
+        segment = end - start
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(*(inner - start).T)
+        else:
+            offset = inner - start
+            distances = np.abs(segment[0] * offset[:, 1] - segment[1] * offset[:, 0]) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            middle = first + 1 + index
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return closed[keep][:-1].tolist()
+
+
+def extend_path(
+    path, point, min_distance, max_angle=math.radians(10), tolerance=None, skipped=None
+):
+    """
+    Online simplification of a traced path, for points that arrive one at a time.
+    Points closer than min_distance to the last vertex are dropped, a point that continues the
+    last segment within max_angle (radians) moves the last vertex instead of adding one, as long
+    as every vertex the last segment replaced stays within tolerance (min_distance / 2 by
+    default) of it, like Douglas-Peucker. skipped holds those vertices between calls, it must
+    be the same list for the whole path (without it only the current last vertex is checked).
+    Changes path (and skipped) in place, returns "add", "move" or None if the point was dropped.
+    """
+    if skipped is None:
+        skipped = []
+    if not path:
+        path.append(point)
+        skipped.clear()
+        return "add"
+    x, y = point
+    x1, y1 = path[-1]
+    if math.hypot(x - x1, y - y1) < min_distance:
+        return None
+    if len(path) >= 2:
+        x0, y0 = path[-2]
+        turn = math.atan2(y - y1, x - x1) - math.atan2(y1 - y0, x1 - x0)
+        if abs((turn + math.pi) % (2 * math.pi) - math.pi) < max_angle:
+            if tolerance is None:
+                tolerance = min_distance / 2
+            chord = [path[-2], point]
+            if all(distance_to_polygon(*p, chord) <= tolerance for p in skipped + [path[-1]]):
+                skipped.append(path[-1])
+                path[-1] = point
+                return "move"
+    path.append(point)
+    skipped.clear()
+    return "add"
@@ -0,0 +1,237 @@
+import shutil
+import threading
+import warnings
+from PIL import Image
+
+from pyramid_cache import PyramidCache, display_mode
+from pyramid_builder import build_levels
+from image_sources import SourceLevel, array_level, open_source, pyramid_sizes
+
+
+def coarse_preview(path, size):
+    """
+    Returns a cheap low resolution version of a JPEG image with the given size, decoded directly
+    at a reduced scale (draft). Returns None for other formats, they can only be reduced after
+    the whole image is decoded.
+    """
+    with warnings.catch_warnings():  # suppress DecompressionBombWarning for big image
+        warnings.simplefilter("ignore")
+        image = Image.open(path)
+    if image.format != "JPEG":
+        return None
+    image.draft(image.mode, size)
+    return image.resize(size, Image.NEAREST)
+
+
+def reduced_preview(image, size):
+    """ Returns a low resolution version of a decoded image, box-reduced where the mode allows it"""
+    factor = max(1, min(image.size[0] // size[0], image.size[1] // size[1]))
+    if factor > 1:
+        try:
+            image = image.reduce(factor)
+        except ValueError:  # palette, bilevel and 16 bit images are only resized
+            pass
+    return image.resize(size, Image.NEAREST)
+
+
+class ImagePyramid:
+    """
+    Image pyramid that is available immediately.
+    On start only the top (coarsest) level exists as a cheap preview (a blank placeholder for
+    formats other than JPEG, until the background thread decoded the image), the finer levels
+    are built in a background thread and become available one by one. Finished pyramids are
+    written to the PyramidCache so the next session can skip building.
+    Images with their own levels (see image_sources) are not built, their levels read regions
+    from the file on demand.
+    The levels below level 0 are in mode L, RGB or RGBA (see display_mode), other modes are
+    converted once before building. Images of at least parallel_pixels pixels, and images whose
+    source reads regions (single level tiled TIFF), are built tile by tile in a pool of worker
+    processes (see pyramid_builder), directly into the cache. Level 0 of the latter is read by
+    region from the start and is never decoded at once.
+    """
+
+    def __init__(
+        self,
+        path,
+        reduction=2,
+        min_size=512,
+        resample=Image.LANCZOS,
+        cache=None,
+        source=None,
+        workers=None,
+        parallel_pixels=4096 * 4096,
+    ):
+        self.path = path
+        self.min_size = min_size
+        self.resample = resample
+        self.workers = workers  # None uses every core
+        self.parallel_pixels = parallel_pixels
+        self.cache = cache if cache is not None else PyramidCache()
+        self.source = source if source is not None else open_source(path, reduction, min_size)
+
+        self.size = self.source.size
+        if self.source.native:
+            self.reduction = self.source.reduction
+            self.sizes = list(self.source.sizes)
+        else:
+            self.reduction = reduction
+            self.sizes = pyramid_sizes(self.size, reduction, min_size)
+        self.levels = [None] * len(self.sizes)
+        self.complete = False
+        self.version = 0  # incremented every time a level becomes available
+        self.lock = threading.Lock()  # PIL images may load lazily, only one thread may crop them
+        self.placeholder = False  # the top level is blank until the image is decoded
+        self.__thread = None
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, index):
+        return self.levels[index]
+
+    def start(self):
+        """ Makes the top level available and starts building the other levels"""
+        if self.source.native:
+            self.levels = [SourceLevel(self.source, i) for i in range(len(self.sizes))]
+            self.set_complete()
+            return
+
+        cached_levels = self.cache.load(self.path, self.reduction, self.min_size)
+        if cached_levels is not None and len(cached_levels) == len(self.levels) - 1:
+            self.levels[0] = self.open()
+            self.levels[1:] = cached_levels
+            self.set_complete()
+            return
+
+        if len(self.levels) == 1:
+            self.levels[0] = self.open()
+            self.set_complete()
+            return
+
+        preview = coarse_preview(self.path, self.sizes[-1])
+        if preview is None:
+            preview = Image.new("L", self.sizes[-1])
+            self.placeholder = True
+        self.levels[-1] = preview
+        self.version += 1
+        self.__thread = threading.Thread(target=self.__build, daemon=True)
+        self.__thread.start()
+
+    def open(self):
+        """ Level 0: read by region where the source can, otherwise a (lazily decoded) PIL image"""
+        if self.source.regions:
+            return SourceLevel(self.source, 0)
+        with warnings.catch_warnings():  # suppress DecompressionBombWarning for big image
+            warnings.simplefilter("ignore")
+            return Image.open(self.path)
+
+    def wait(self, timeout=None):
+        """ Blocks until the background thread finished building, returns True if complete"""
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        return self.complete
+
+    def set_complete(self):
+        self.version += 1
+        self.complete = True
+
+    def best_level(self, wanted):
+        """ Returns the available level closest to the wanted level, coarser levels win ties"""
+        wanted = min(max(0, wanted), len(self.levels) - 1)
+        available = [i for i, level in enumerate(self.levels) if level is not None]
+        return min(available, key=lambda i: (abs(i - wanted), i < wanted))
+
+    def crop(self, index, box):
+        """ Crops a region from a level, safe to call from several threads"""
+        level = self.levels[index]
+        if isinstance(level, SourceLevel):
+            return level.crop(box)  # sources lock themselves where needed
+        with self.lock:
+            return level.crop(box)
+
+    def scale(self, index, imscale):
+        """ Returns the scale between the canvas and the pixels of a pyramid level"""
+        return imscale * self.size[0] / self.levels[index].size[0]
+
+    def __build(self):
+        """ Builds every level from the previous one, runs in a background thread"""
+        image = self.open()
+        if not self.source.regions:
+            image.load()
+        self.levels[0] = image
+        if self.placeholder and not self.source.regions:
+            self.levels[-1] = reduced_preview(image, self.sizes[-1])
+            self.placeholder = False
+        self.version += 1
+        mode = display_mode(image)
+
+        if self.source.regions or self.size[0] * self.size[1] >= self.parallel_pixels:
+            try:
+                self.__build_tiled(image, mode)  # the tiles convert to mode themselves
+                self.set_complete()
+                return
+            except (OSError, RuntimeError):  # no space for the levels or a broken worker pool
+                print("\rCould not build the image pyramid in parallel, building it serially")
+
+        if self.source.regions:
+            image = image.crop((0, 0) + self.size)  # decoded at once after all
+        if image.mode != mode:
+            image = image.convert(mode)  # palette, CMYK, 16 bit, ... images
+
+        n = len(self.levels)
+        for j in range(1, n):
+            print("\rCreating image pyramid: {j} from {n}".format(j=j, n=n - 1), end="")
+            image = image.resize(self.sizes[j], self.resample)
+            self.levels[j] = image
+            self.version += 1
+        print("\r" + (40 * " ") + "\r", end="")  # hide printed string
+
+        try:
+            self.cache.save(self.path, self.levels[1:], self.reduction, self.min_size)
+        except OSError:
+            print("Could not write the image pyramid cache")
+        self.set_complete()
+
+    def __build_tiled(self, image, mode):
+        """ Builds the levels tile by tile in worker processes, the level files become the cache entry"""
+        n = len(self.levels)
+
+        def progress(level, done, total):
+            print(
+                "\rCreating image pyramid: {j} from {n}, tile {done} from {total}".format(
+                    j=level, n=n - 1, done=done, total=total
+                ),
+                end="",
+            )
+
+        def level_done(level, array):
+            self.levels[level] = array_level(array, mode)
+            self.version += 1
+
+        build_dir = self.cache.build_dir(self.path, self.reduction, self.min_size)
+        try:
+            names = build_levels(
+                image,
+                self.sizes,
+                build_dir,
+                self.resample,
+                workers=self.workers,
+                progress=progress,
+                level_done=level_done,
+            )
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        finally:
+            print("\r" + (60 * " ") + "\r", end="")  # hide printed string
+
+        try:
+            self.cache.commit(
+                self.path, build_dir, names, mode, self.reduction, self.min_size
+            )
+        except OSError:
+            print("Could not write the image pyramid cache")
+            return
+        cached_levels = self.cache.load(self.path, self.reduction, self.min_size)
+        if cached_levels is not None:
+            self.levels[1:] = cached_levels  # the same files, at their final path
@@ -0,0 +1,356 @@
+"""
+Image sources that read regions of an image on demand.
+
+Every source describes a pyramid: sizes[level] is the (width, height) of a level, level 0 is the
+full resolution. read_region(level, box) returns the region (x0, y0, x1, y1) of a level, in pixels
+of that level, as PIL image. Sources with native levels (pyramidal TIFF, Deep Zoom, numpy
+arrays) are used as image pyramid directly; for other images the ImagePyramid builds the levels,
+from regions of level 0 where the source reads them without decoding the whole image (tiled TIFF).
+"""
+import math
+import os
+import threading
+import warnings
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageMode
+
+try:
+    import tifffile
+except ImportError:  # TIFF levels are then read with Pillow, one level at a time
+    tifffile = None
+
+
+def pyramid_sizes(size, reduction=2, min_size=512):
+    """ Returns the (width, height) of every pyramid level, the top level is around min_size pixels"""
+    w, h = size
+    sizes = [(w, h)]
+    while w > min_size and h > min_size:
+        w /= reduction  # divide on reduction degree
+        h /= reduction  # divide on reduction degree
+        sizes.append((int(w), int(h)))
+    return sizes
+
+
+def open_pil(path):
+    with warnings.catch_warnings():  # suppress DecompressionBombWarning for big image
+        warnings.simplefilter("ignore")
+        return Image.open(path)
+
+
+class ImageSource:
+    """ Base class of the image sources"""
+
+    native = True  # the source has its own pyramid levels
+    regions = True  # regions are read without decoding the whole level
+
+    def __init__(self, path, sizes):
+        self.path = path
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.sizes)
+
+    @property
+    def size(self):
+        return self.sizes[0]
+
+    @property
+    def reduction(self):
+        """ Size ratio between the first two levels"""
+        if len(self.sizes) < 2:
+            return 2
+        return max(2, int(round(self.sizes[0][0] / self.sizes[1][0])))
+
+    def clip(self, level, box):
+        w, h = self.sizes[level]
+        x0, y0, x1, y1 = (int(v) for v in box)
+        return max(0, x0), max(0, y0), min(w, max(x0, x1)), min(h, max(y0, y1))
+
+    def read_region(self, level, box):
+        raise NotImplementedError
+
+    def level_mode(self, level):
+        """ PIL mode of the regions of a level"""
+        return self.read_region(level, (0, 0, 1, 1)).mode
+
+    def close(self):
+        pass
+
+
+class SourceLevel:
+    """
+    Pyramid level read by region from an image source on demand, for the levels of sources and
+    the cached levels (see ArraySource) alike.
+    Behaves like the PIL images in the pyramid for the operations the annotator uses (size and crop).
+    """
+
+    def __init__(self, source, index):
+        self.source = source
+        self.index = index
+        self.size = source.sizes[index]
+
+    def crop(self, box):
+        return self.source.read_region(self.index, box)
+
+    @property
+    def mode(self):
+        return self.source.level_mode(self.index)
+
+    @property
+    def info(self):
+        return {}
+
+    def getbands(self):
+        return ImageMode.getmode(self.mode).bands
+
+    def resize(self, size, resample=None):
+        return self.crop((0, 0) + self.size).resize(size, resample)
+
+
+class ArraySource(ImageSource):
+    """
+    A single level held in a (memory-mapped) numpy array of the PIL mode mode, crops are views on
+    the array, so only the pixels of a region are read from disk.
+    """
+
+    def __init__(self, array, mode, path=None):
+        super().__init__(path, [(array.shape[1], array.shape[0])])
+        self.array = array
+        self.mode = mode
+
+    def level_mode(self, level):
+        return self.mode
+
+    def read_region(self, level, box):
+        x0, y0, x1, y1 = self.clip(level, box)
+        return Image.fromarray(np.ascontiguousarray(self.array[y0:y1, x0:x1]), self.mode)
+
+
+def array_level(array, mode):
+    """ Pyramid level of a numpy array, e.g. a memory-mapped level of the pyramid cache"""
+    return SourceLevel(ArraySource(array, mode), 0)
+
+
+class PillowSource(ImageSource):
+    """ Any image Pillow can open, only level 0 exists and the ImagePyramid builds the others"""
+
+    native = False
+    regions = False  # Pillow decodes the whole image for the first crop
+
+    def __init__(self, path):
+        super().__init__(path, [open_pil(path).size])
+        self.lock = threading.Lock()
+        self.__image = None
+
+    def read_region(self, level, box):
+        with self.lock:
+            if self.__image is None:
+                self.__image = open_pil(self.path)
+            return self.__image.crop(self.clip(level, box))
+
+
+class NpySource(ImageSource):
+    """
+    Raw .npy array (height, width) or (height, width, channels) of uint8, opened memory-mapped.
+    Crops are views on the memory map, coarser levels take every n-th pixel, so only the pixels
+    of a region are read from disk.
+    """
+
+    def __init__(self, path, reduction=2, min_size=512):
+        self.array = np.load(path, mmap_mode="r")
+        height, width = self.array.shape[:2]
+        self.factor = reduction
+        super().__init__(path, pyramid_sizes((width, height), reduction, min_size))
+
+    @property
+    def reduction(self):
+        return self.factor
+
+    def read_region(self, level, box):
+        x0, y0, x1, y1 = self.clip(level, box)
+        step = self.factor ** level
+        region = self.array[y0 * step : y1 * step : step, x0 * step : x1 * step : step]
+        return Image.fromarray(np.ascontiguousarray(region))
+
+
+class DziSource(ImageSource):
+    """
+    Deep Zoom image: a .dzi descriptor and a <name>_files folder with a folder of tiles per level.
+    Tiles are opened when a region needs them, the most recently used are kept in memory.
+    """
+
+    def __init__(self, path, max_tiles=256):
+        root = ET.parse(path).getroot()
+        size = root.find("{*}Size")
+        if size is None:
+            size = root.find("Size")
+        width, height = int(size.get("Width")), int(size.get("Height"))
+        self.tile_size = int(root.get("TileSize"))
+        self.overlap = int(root.get("Overlap", 0))
+        self.format = root.get("Format")
+        self.max_level = int(math.ceil(math.log2(max(width, height, 1))))
+        self.tiles_dir = os.path.splitext(path)[0] + "_files"
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()  # (level, col, row) -> PIL image
+        self.lock = threading.Lock()
+
+        sizes = [(width, height)]
+        while max(sizes[-1]) > self.tile_size and len(sizes) <= self.max_level:
+            factor = 2 ** len(sizes)
+            sizes.append((int(math.ceil(width / factor)), int(math.ceil(height / factor))))
+        super().__init__(path, sizes)
+
+    def tile(self, level, col, row):
+        key = (level, col, row)
+        with self.lock:
+            image = self.tiles.get(key)
+            if image is not None:
+                self.tiles.move_to_end(key)
+                return image
+
+        name = "{}_{}.{}".format(col, row, self.format)
+        image = Image.open(os.path.join(self.tiles_dir, str(self.max_level - level), name))
+        image.load()
+        with self.lock:
+            self.tiles[key] = image
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        return image
+
+    def read_region(self, level, box):
+        x0, y0, x1, y1 = self.clip(level, box)
+        t = self.tile_size
+        region = None
+        for row in range(y0 // t, max(y0, y1 - 1) // t + 1):
+            for col in range(x0 // t, max(x0, x1 - 1) // t + 1):
+                tile = self.tile(level, col, row)
+                if region is None:
+                    region = Image.new(tile.mode, (x1 - x0, y1 - y0))
+                # tiles start overlap pixels before their grid position, except the first ones
+                left = col * t - (self.overlap if col else 0)
+                top = row * t - (self.overlap if row else 0)
+                region.paste(tile, (left - x0, top - y0))
+        return region if region is not None else Image.new("RGB", (x1 - x0, y1 - y0))
+
+
+class TiffSource(ImageSource):
+    """
+    Pyramidal TIFF (including whole slide formats such as .svs).
+    With tifffile the tiles of a region are decoded individually; without it, Pillow decodes
+    a level at a time and keeps the decoded levels.
+    A tiled TIFF with a single level is not native, the ImagePyramid builds the other levels
+    from its tiles.
+    """
+
+    def __init__(self, path, max_tiles=256):
+        self.lock = threading.Lock()
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()  # (level, index) -> decoded tile
+        self.decoded = {}  # level -> PIL image of levels that are decoded at once
+
+        if tifffile is not None:
+            self.tif = tifffile.TiffFile(path)
+            self.pages = [level.keyframe for level in self.tif.series[0].levels]
+            sizes = [(page.imagewidth, page.imagelength) for page in self.pages]
+        else:
+            self.tif = None
+            image = open_pil(path)
+            self.frames, sizes = [], []
+            for frame in range(getattr(image, "n_frames", 1)):
+                image.seek(frame)
+                w, h = image.size
+                if sizes:
+                    # levels get smaller and keep the aspect ratio, other pages (labels) are skipped
+                    aspect = sizes[0][0] / sizes[0][1]
+                    if w >= sizes[-1][0] or abs(w / h - aspect) > 0.05 * aspect:
+                        continue
+                self.frames.append(frame)
+                sizes.append((w, h))
+            self.image = image
+        super().__init__(path, sizes)
+        self.native = len(sizes) > 1
+        self.tiled = self.tif is not None and self.pages[0].is_tiled  # level 0 is read by tiles
+
+    def close(self):
+        if self.tif is not None:
+            self.tif.close()
+
+    def read_region(self, level, box):
+        x0, y0, x1, y1 = self.clip(level, box)
+        if self.tif is not None and self.pages[level].is_tiled:
+            return self.__read_tiles(level, (x0, y0, x1, y1))
+        return self.__decoded(level).crop((x0, y0, x1, y1))
+
+    def __decoded(self, level):
+        with self.lock:
+            if level not in self.decoded:
+                if self.tif is not None:
+                    self.decoded[level] = Image.fromarray(self.pages[level].asarray())
+                else:
+                    self.image.seek(self.frames[level])
+                    self.image.load()
+                    self.decoded[level] = self.image.copy()
+            return self.decoded[level]
+
+    def __tile(self, level, index):
+        key = (level, index)
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                return tile
+            page = self.pages[level]
+            fh = self.tif.filehandle
+            fh.seek(page.dataoffsets[index])
+            data = fh.read(page.databytecounts[index])
+
+        tile, _, _ = page.decode(data, index, jpegtables=page.jpegtables)
+        tile = tile.reshape(page.tilelength, page.tilewidth, -1)
+        with self.lock:
+            self.tiles[key] = tile
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        return tile
+
+    def __read_tiles(self, level, box):
+        x0, y0, x1, y1 = box
+        page = self.pages[level]
+        tw, th = page.tilewidth, page.tilelength
+        columns = int(math.ceil(page.imagewidth / tw))
+        region = None
+        for row in range(y0 // th, max(y0, y1 - 1) // th + 1):
+            for col in range(x0 // tw, max(x0, x1 - 1) // tw + 1):
+                tile = self.__tile(level, row * columns + col)
+                if region is None:
+                    region = np.zeros((y1 - y0, x1 - x0, tile.shape[2]), dtype=tile.dtype)
+                # intersection of the tile and the region
+                ty0, tx0 = row * th, col * tw
+                sy0, sx0 = max(y0, ty0), max(x0, tx0)
+                sy1, sx1 = min(y1, ty0 + th), min(x1, tx0 + tw)
+                region[sy0 - y0 : sy1 - y0, sx0 - x0 : sx1 - x0] = tile[
+                    sy0 - ty0 : sy1 - ty0, sx0 - tx0 : sx1 - tx0
+                ]
+        if region is None:
+            return Image.new("RGB", (x1 - x0, y1 - y0))
+        return Image.fromarray(region[:, :, 0] if region.shape[2] == 1 else region)
+
+
+def open_source(path, reduction=2, min_size=512):
+    """ Returns the image source for a file, by extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        return NpySource(path, reduction, min_size)
+    if extension == ".dzi":
+        return DziSource(path)
+    if extension in (".tif", ".tiff", ".svs", ".ndpi", ".scn"):
+        source = TiffSource(path)
+        if source.native or source.tiled:
+            return source  # the pyramid of a single tiled level is built from its tiles
+        source.close()
+        print(
+            "{} has no tiles to read (a strip TIFF, or tifffile is not installed), "
+            "decoding the whole image".format(os.path.basename(path))
+        )
+    return PillowSource(path)
@@ -0,0 +1,63 @@
+import re
+import json
+
+WHITESPACE = " \t\n\r"
+NUMBER_TAIL = re.compile(r"[0-9+\-.eE]*\Z")  # characters that could still continue a number
+
+
+def iter_json_array(f, chunk_size=1 << 16):
+    """
+    Parses a json file that contains an array one element at a time.
+    Yields (element, position) where position is the number of characters read so far,
+    only the current element and one chunk of the file are kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    offset = 0  # characters dropped from the front of the buffer
+    eof = False
+
+    def read_more(size):
+        nonlocal buffer, pos, offset, eof
+        chunk = f.read(size)
+        if not chunk:
+            eof = True
+        offset += pos
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def next_char(skip):
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in skip:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else ""
+            read_more(chunk_size)
+
+    if next_char(WHITESPACE) != "[":
+        raise ValueError("Expected a json array")
+    pos += 1
+
+    while True:
+        char = next_char(WHITESPACE + ",")
+        if char == "]":
+            return
+        if char == "":
+            raise ValueError("Unexpected end of json array")
+
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more(max(chunk_size, len(buffer)))  # grow geometrically for big elements
+                continue
+            if not eof and NUMBER_TAIL.match(buffer, end):
+                read_more(chunk_size)  # a number may continue in the next chunk, e.g. "1e" "5"
+                continue
+            break
+
+        pos = end
+        yield element, offset + pos
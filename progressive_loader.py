@@ -0,0 +1,91 @@
+import time
+from collections import deque
+
+
+class ProgressiveLoader:
+    """
+    Fills the canvas with loaded annotations without blocking the Tk main loop.
+    Every step parses at most one batch and then draws annotations until the time budget is used,
+    annotations inside the current viewport are drawn first. Steps are scheduled with after(),
+    so panning and zooming keep working while a large file fills in.
+    """
+
+    def __init__(self, widget, batches, draw, data, viewport, progress=None, budget_ms=15):
+        self.widget = widget
+        self.batches = batches  # iterator over lists of (annotation, unique_id)
+        self.draw = draw  # draw(unique_id) creates the canvas item of an annotation
+        self.data = data  # AnnotationsTkinter the batches are loaded into
+        self.viewport = viewport  # returns the visible area (x0, y0, x1, y1) in normalized coordinates
+        self.progress = progress  # progress(parsed, drawn, finished) after every step
+        self.budget = budget_ms / 1000
+
+        self.pending = set()  # unique ids that are parsed but not drawn
+        self.order = deque()  # pending unique ids in file order
+        self.priority = []  # pending unique ids in the viewport
+        self.box = None  # viewport the priority list was made for
+        self.parsed = 0
+        self.drawn = 0
+        self.done_parsing = False
+        self.__job = None
+
+    @property
+    def finished(self):
+        return self.done_parsing and not self.pending
+
+    def start(self):
+        self.__job = self.widget.after_idle(self.step)
+
+    def cancel(self):
+        if self.__job is not None:
+            self.widget.after_cancel(self.__job)
+            self.__job = None
+
+    def in_view(self, unique_id):
+        bbox = self.data.index.bboxes.get(unique_id)
+        if bbox is None:
+            return False
+        x0, y0, x1, y1 = self.box
+        return bbox[0] <= x1 and x0 <= bbox[2] and bbox[1] <= y1 and y0 <= bbox[3]
+
+    def step(self):
+        """ Parses one batch and draws annotations until the time budget is used"""
+        self.__job = None
+        deadline = time.perf_counter() + self.budget
+
+        box = self.viewport()
+        if box != self.box:
+            self.box = box
+            self.priority = [i for i in self.data.query_box(*box) if i in self.pending]
+
+        if not self.done_parsing:
+            try:
+                batch = next(self.batches)
+            except StopIteration:
+                self.done_parsing = True
+            else:
+                self.parsed += len(batch)
+                self.pending.update(unique_id for _, unique_id in batch)
+                self.order.extend(unique_id for _, unique_id in batch)
+                self.priority.extend(
+                    unique_id for _, unique_id in batch if self.in_view(unique_id)
+                )
+
+        # annotations in the viewport first, then the rest in file order
+        while self.priority and time.perf_counter() < deadline:
+            unique_id = self.priority.pop()
+            if unique_id in self.pending:
+                self.pending.remove(unique_id)
+                self.draw(unique_id)
+                self.drawn += 1
+
+        while self.order and time.perf_counter() < deadline:
+            unique_id = self.order.popleft()
+            if unique_id in self.pending:
+                self.pending.remove(unique_id)
+                self.draw(unique_id)
+                self.drawn += 1
+
+        if self.progress:
+            self.progress(self.parsed, self.drawn, self.finished)
+        if not self.finished:
+            self.__job = self.widget.after(1, self.step)
@@ -0,0 +1,146 @@
+"""
+Tile-wise parallel building of image pyramid levels.
+
+Every level is a memory-mapped .npy file. A level is built from the previous one in tiles, each
+tile is downsampled in a worker process that maps both files, so the pixels are shared through
+the page cache instead of being copied to the workers.
+"""
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from PIL import Image
+
+from pyramid_cache import MODES, display_mode
+
+LEVEL_0 = "level_0.npy"
+
+__arrays = {}  # (path, mode) -> memory map, opened once per worker process
+
+
+def open_level(path, mode="r"):
+    key = (path, mode)
+    if key not in __arrays:
+        __arrays[key] = np.load(path, mmap_mode=mode)
+    return __arrays[key]
+
+
+def downsample_tile(src_path, dst_path, box, resample):
+    """
+    Computes the tile box (x0, y0, x1, y1) of the destination level from the source level.
+    Runs in the worker processes, the source region includes a margin for the filter support,
+    so tiles are the same as resizing the whole level at once.
+    """
+    src = open_level(src_path, "r")
+    dst = open_level(dst_path, "r+")
+    x0, y0, x1, y1 = box
+    sx = src.shape[1] / dst.shape[1]
+    sy = src.shape[0] / dst.shape[0]
+    margin = int(math.ceil(3 * max(sx, sy))) + 1  # support of the lanczos filter
+
+    ix0 = max(0, int(x0 * sx) - margin)
+    iy0 = max(0, int(y0 * sy) - margin)
+    ix1 = min(src.shape[1], int(math.ceil(x1 * sx)) + margin)
+    iy1 = min(src.shape[0], int(math.ceil(y1 * sy)) + margin)
+    region = Image.fromarray(np.ascontiguousarray(src[iy0:iy1, ix0:ix1]))
+    tile = region.resize(
+        (x1 - x0, y1 - y0),
+        resample,
+        box=(x0 * sx - ix0, y0 * sy - iy0, x1 * sx - ix0, y1 * sy - iy0),
+    )
+    dst[y0:y1, x0:x1] = np.asarray(tile).reshape(dst[y0:y1, x0:x1].shape)
+    return box
+
+
+def tiles_of(size, tile_size):
+    """ Splits a level in tiles of about tile_size, of about equal size so none is a thin strip"""
+    w, h = size
+    columns = max(1, int(round(w / tile_size)))
+    rows = max(1, int(round(h / tile_size)))
+    xs = [w * i // columns for i in range(columns + 1)]
+    ys = [h * i // rows for i in range(rows + 1)]
+    return [
+        (xs[i], ys[j], xs[i + 1], ys[j + 1]) for j in range(rows) for i in range(columns)
+    ]
+
+
+def write_level_0(image, path, strip=1024):
+    """
+    Writes a PIL image (or a level read by region) to a memory-mapped .npy file, a strip of rows
+    at a time. The strips are converted to the display mode of the image.
+    """
+    mode = display_mode(image)
+    channels = Image.getmodebands(mode)
+    shape = (image.size[1], image.size[0]) + ((channels,) if channels > 1 else ())
+    array = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=shape)
+    for y in range(0, image.size[1], strip):
+        y1 = min(image.size[1], y + strip)
+        region = image.crop((0, y, image.size[0], y1))
+        if region.mode != mode:
+            region = region.convert(mode)
+        array[y:y1] = np.asarray(region)
+    array.flush()
+    return array
+
+
+def build_levels(
+    image,
+    sizes,
+    directory,
+    resample=Image.LANCZOS,
+    workers=None,
+    tile_size=1024,
+    progress=None,
+    level_done=None,
+):
+    """
+    Builds the levels 1 .. len(sizes) - 1 of a pyramid of a PIL image (or of a level read by
+    region, see image_sources) into directory, in the display mode of the image (see
+    pyramid_cache.display_mode), returns the file names. progress(level, done, total) is called after every tile,
+    level_done(level, array) with the memory map of every finished level.
+    """
+    workers = workers or os.cpu_count() or 1
+    src_path = os.path.join(directory, LEVEL_0)
+    write_level_0(image, src_path)
+
+    executor = None
+    if workers > 1:
+        context = multiprocessing.get_context("spawn")  # Tk and threads do not survive a fork
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+    names = []
+    try:
+        for level in range(1, len(sizes)):
+            name = "level_{}.npy".format(level)
+            dst_path = os.path.join(directory, name)
+            channels = np.load(src_path, mmap_mode="r").shape[2:]
+            shape = (sizes[level][1], sizes[level][0]) + channels
+            np.lib.format.open_memmap(dst_path, mode="w+", dtype=np.uint8, shape=shape).flush()
+
+            boxes = tiles_of(sizes[level], tile_size)
+            if executor is None:
+                done = (downsample_tile(src_path, dst_path, box, resample) for box in boxes)
+            else:
+                futures = [
+                    executor.submit(downsample_tile, src_path, dst_path, box, resample)
+                    for box in boxes
+                ]
+                done = (future.result() for future in as_completed(futures))  # raises worker errors
+            for i, _ in enumerate(done, start=1):
+                if progress:
+                    progress(level, i, len(boxes))
+
+            names.append(name)
+            if level_done:
+                level_done(level, np.load(dst_path, mmap_mode="r"))
+            src_path = dst_path
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        __arrays.clear()
+        try:
+            os.remove(os.path.join(directory, LEVEL_0))
+        except OSError:
+            pass
+    return names
@@ -0,0 +1,146 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from PIL import Image
+
+from image_sources import array_level
+
+MODES = ("L", "RGB", "RGBA")  # image modes that map to uint8 arrays, levels are cached in these
+
+
+def cache_root():
+    """ Returns the directory of everything the annotator caches (~/.cache/tkinter-annotator)"""
+    base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "tkinter-annotator")
+
+
+def default_cache_dir():
+    """ Returns the default directory for the pyramid cache"""
+    return os.path.join(cache_root(), "pyramids")
+
+
+def display_mode(image):
+    """ Returns the mode of MODES an image is converted to before it is cached"""
+    if image.mode in MODES:
+        return image.mode
+    bands = image.getbands()
+    if "A" in bands or "a" in bands or "transparency" in image.info:
+        return "RGBA"
+    return "L" if Image.getmodebase(image.mode) == "L" else "RGB"  # palette, CMYK, YCbCr, ...
+
+
+class PyramidCache:
+    """
+    On-disk cache of image pyramid levels.
+    Every level is stored as a .npy file in a directory keyed by the path, size and mtime of the image,
+    so a changed image never reuses stale levels. Cached levels are opened memory-mapped.
+    Levels are stored in one of MODES, the mode is kept in the metadata of the entry.
+    The least recently used entries are evicted to keep the cache below max_bytes.
+    """
+
+    META = "meta.json"
+    TMP = ".tmp-"  # build directories are named <key>.tmp-<pid> until they are committed
+
+    def __init__(self, cache_dir=None, max_bytes=4 * 1024 ** 3):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def key(self, path, reduction=2, min_size=512):
+        stat = os.stat(path)
+        ident = "{}|{}|{}|{}|{}".format(
+            os.path.abspath(path), stat.st_size, stat.st_mtime_ns, reduction, min_size
+        )
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def entry_dir(self, path, reduction=2, min_size=512):
+        return os.path.join(self.cache_dir, self.key(path, reduction, min_size))
+
+    def load(self, path, reduction=2, min_size=512):
+        """ Returns the cached levels (without level 0) memory-mapped, None without a valid entry"""
+        entry = self.entry_dir(path, reduction, min_size)
+        try:
+            with open(os.path.join(entry, self.META), "r") as f:
+                meta = json.load(f)
+            mode = meta["mode"]  # entries without a mode may have been stored in another mode
+            if mode not in MODES:
+                return None
+            levels = [
+                array_level(np.load(os.path.join(entry, name), mmap_mode="r"), mode)
+                for name in meta["levels"]
+            ]
+        except (OSError, ValueError, KeyError):
+            return None
+
+        os.utime(entry)  # mark as recently used for eviction
+        return levels
+
+    def build_dir(self, path, reduction=2, min_size=512):
+        """ Returns a new directory to write levels to, committed to the cache with commit()"""
+        tmp_entry = self.entry_dir(path, reduction, min_size) + self.TMP + str(os.getpid())
+        os.makedirs(tmp_entry, exist_ok=True)
+        return tmp_entry
+
+    def commit(self, path, build_dir, names, mode, reduction=2, min_size=512):
+        """
+        Turns a build directory with the level files names, of the given mode,
+        into the cache entry of the image
+        """
+        entry = self.entry_dir(path, reduction, min_size)
+        with open(os.path.join(build_dir, self.META), "w") as f:
+            json.dump({"source": os.path.abspath(path), "levels": names, "mode": mode}, f)
+
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(build_dir, entry)
+        self.evict(keep=entry)
+
+    def save(self, path, levels, reduction=2, min_size=512):
+        """
+        Writes the levels (without level 0) to the cache and evicts old entries.
+        Levels that are not in one of MODES are converted first.
+        """
+        tmp_entry = self.build_dir(path, reduction, min_size)
+        mode = display_mode(levels[0])
+
+        names = []
+        for i, level in enumerate(levels, start=1):
+            name = "level_{}.npy".format(i)
+            if level.mode != mode:
+                level = level.convert(mode)
+            np.save(os.path.join(tmp_entry, name), np.asarray(level))
+            names.append(name)
+
+        self.commit(path, tmp_entry, names, mode, reduction, min_size)
+
+    def size_of(self, entry):
+        return sum(
+            os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry)
+        )
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the cache is below max_bytes.
+        Build directories are not entries yet, other processes may still be writing them.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if self.TMP in name or not os.path.isdir(entry):
+                continue
+            try:
+                entries.append((os.path.getmtime(entry), entry, self.size_of(entry)))
+            except OSError:  # removed by another process meanwhile
+                continue
+
+        total = sum(size for _, _, size in entries)
+        for _, entry, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -0,0 +1,57 @@
+class RenderScheduler:
+    """
+    Coalesces redraw requests from pan/zoom events.
+    Requests are merged into at most one redraw per display frame; the redraw reads the current
+    view, so requests superseded by a newer one are dropped. While input is active the redraw is
+    a fast preview, once no requests arrived for idle_ms a full quality redraw follows.
+    """
+
+    def __init__(self, widget, render, frame_ms=16, idle_ms=150):
+        self.widget = widget
+        self.render = render  # render(fast) draws the current view
+        self.frame_ms = frame_ms
+        self.idle_ms = idle_ms
+
+        self.generation = 0  # number of requests so far
+        self.rendered = 0  # generation that is on the screen
+        self.preview_shown = False
+        self.__frame_job = None
+        self.__idle_job = None
+
+    def request(self):
+        """ Requests a redraw of the current view"""
+        self.generation += 1
+        if self.__frame_job is None:
+            self.__frame_job = self.widget.after(self.frame_ms, self.__on_frame)
+
+        if self.__idle_job is not None:
+            self.widget.after_cancel(self.__idle_job)
+        self.__idle_job = self.widget.after(self.idle_ms, self.__on_idle)
+
+    def cancel(self):
+        """ Drops all pending redraws"""
+        for job in (self.__frame_job, self.__idle_job):
+            if job is not None:
+                self.widget.after_cancel(job)
+        self.__frame_job = None
+        self.__idle_job = None
+
+    def __on_frame(self):
+        """ Draws a fast preview of the newest requested view"""
+        self.__frame_job = None
+        if self.rendered == self.generation:
+            return
+        self.rendered = self.generation
+        self.render(True)
+        self.preview_shown = True
+
+    def __on_idle(self):
+        """ Replaces the preview with a full quality redraw once input stopped"""
+        self.__idle_job = None
+        if self.__frame_job is not None:
+            self.widget.after_cancel(self.__frame_job)
+            self.__frame_job = None
+        if self.preview_shown or self.rendered != self.generation:
+            self.rendered = self.generation
+            self.render(False)
+            self.preview_shown = False
@@ -0,0 +1,123 @@
+import math
+import numpy as np
+from collections import defaultdict
+
+
+class GridIndex:
+    """
+    Uniform grid over bounding boxes in normalized image coordinates.
+    Every key is stored in all cells its bounding box overlaps, so region queries only look at
+    the keys in the cells of the query box instead of at every annotation.
+    Keys that would cover more than max_cells cells are kept in a separate set that every
+    query checks.
+    """
+
+    def __init__(self, cell_size=256, max_cells=64):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.cells = defaultdict(set)
+        self.large = set()
+        self.bboxes = {}
+        self.order = {}  # insertion order, later keys are drawn on top
+        self.__counter = 0
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def __contains__(self, key):
+        return key in self.bboxes
+
+    def n_cells(self, bbox):
+        x0, y0, x1, y1 = bbox
+        c = self.cell_size
+        cols = int(math.floor(x1 / c)) - int(math.floor(x0 / c)) + 1
+        rows = int(math.floor(y1 / c)) - int(math.floor(y0 / c)) + 1
+        return cols * rows
+
+    def cells_of(self, bbox):
+        x0, y0, x1, y1 = bbox
+        c = self.cell_size
+        for col in range(int(math.floor(x0 / c)), int(math.floor(x1 / c)) + 1):
+            for row in range(int(math.floor(y0 / c)), int(math.floor(y1 / c)) + 1):
+                yield col, row
+
+    def insert(self, key, bbox):
+        """ Adds a key or moves it to its new bounding box"""
+        if key in self.bboxes:
+            self.remove(key, keep_order=True)
+        else:
+            self.__counter += 1
+            self.order[key] = self.__counter
+        self.bboxes[key] = bbox
+        if self.n_cells(bbox) > self.max_cells:
+            self.large.add(key)
+            return
+        for cell in self.cells_of(bbox):
+            self.cells[cell].add(key)
+
+    def insert_many(self, keys, bboxes):
+        """ Adds many keys at once, bboxes is a (n, 4) array"""
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        cells = np.floor(bboxes / self.cell_size).astype(np.int64)
+        n_cells = (cells[:, 2] - cells[:, 0] + 1) * (cells[:, 3] - cells[:, 1] + 1)
+
+        for key, bbox, (col0, row0, col1, row1), n in zip(
+            keys, bboxes.tolist(), cells.tolist(), n_cells.tolist()
+        ):
+            if key in self.bboxes:
+                self.remove(key)
+            self.__counter += 1
+            self.order[key] = self.__counter
+            self.bboxes[key] = tuple(bbox)
+            if n > self.max_cells:
+                self.large.add(key)
+            elif n == 1:
+                self.cells[col0, row0].add(key)
+            else:
+                for col in range(col0, col1 + 1):
+                    for row in range(row0, row1 + 1):
+                        self.cells[col, row].add(key)
+
+    def remove(self, key, keep_order=False):
+        bbox = self.bboxes.pop(key, None)
+        if bbox is None:
+            return
+        if key in self.large:
+            self.large.discard(key)
+        else:
+            for cell in self.cells_of(bbox):
+                keys = self.cells.get(cell)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.cells[cell]
+        if not keep_order:
+            del self.order[key]
+
+    def clear(self):
+        self.cells.clear()
+        self.large.clear()
+        self.bboxes.clear()
+        self.order.clear()
+
+    def query_box(self, bbox, contained=False):
+        """ Returns the keys whose bounding box intersects (or lies inside) bbox, topmost first"""
+        x0, y0, x1, y1 = bbox
+        candidates = set(self.large)
+        if self.n_cells(bbox) > len(self.cells):
+            cells = list(self.cells)  # query box is larger than the filled part of the grid
+        else:
+            cells = self.cells_of(bbox)
+        for cell in cells:
+            candidates.update(self.cells.get(cell, ()))
+
+        keys = []
+        for key in candidates:
+            bx0, by0, bx1, by1 = self.bboxes[key]
+            if contained:
+                hit = x0 <= bx0 and y0 <= by0 and bx1 <= x1 and by1 <= y1
+            else:
+                hit = bx0 <= x1 and x0 <= bx1 and by0 <= y1 and y0 <= by1
+            if hit:
+                keys.append(key)
+        return sorted(keys, key=self.order.get, reverse=True)
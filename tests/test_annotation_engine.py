@@ -0,0 +1,30 @@
+from annotation_engine import AnnotationEngine
+
+SQUARE = [(0, 0), (20, 0), (20, 20), (0, 20)]
+
+
+def test_cut_skips_lines_and_points():
+    engine = AnnotationEngine()
+    square = engine.create_polygon(SQUARE)
+    line = engine.create_polygon([(0, 0), (10, 10)])
+    point = engine.create_polygon([(5, 5)])
+
+    cut = engine.cut_annotations([(-5, 5), (50, 5)])
+    assert list(cut) == [square]
+    assert len(cut[square]) == 2
+    assert square not in engine.Data.annotations_tkinter
+    assert line in engine.Data.annotations_tkinter and point in engine.Data.annotations_tkinter
+
+
+def test_combine_with_a_line():
+    engine = AnnotationEngine()
+    square = engine.create_polygon(SQUARE)
+    inside = engine.create_polygon([(5, 5), (10, 10)])
+    outside = engine.create_polygon([(50, 50), (60, 60)])
+
+    assert engine.combine_annotations([square, outside]) is None
+    assert len(engine) == 3
+
+    combined = engine.combine_annotations([square, inside])
+    assert set(engine.Data.annotations_tkinter) == {combined, outside}
+    assert engine.Data.get_geometry(combined).area == 400
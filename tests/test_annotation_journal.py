@@ -0,0 +1,125 @@
+import json
+import os
+
+from annotation_engine import AnnotationEngine
+from annotation_journal import AnnotationJournal, default_journal_dir, journal_path, read_journal
+from pyramid_cache import default_cache_dir
+
+
+def annotations(engine):
+    return {
+        unique_id: (annotation.shape, engine.Data.store.coords(unique_id).tolist(), annotation.layer)
+        for unique_id, annotation in engine.Data.annotations_tkinter.items()
+    }
+
+
+def edit_session(engine):
+    ellipse = engine.create_annotation((10, 10), (20, 30), "ellipse")
+    polygon = engine.create_polygon([(0, 0), (10, 0), (10, 10)], layer="glands")
+    rectangle = engine.create_annotation((1, 1), (5, 5), "rectangle")
+    engine.translate_annotations([polygon, ellipse], 5, 7)
+    engine.delete_annotations([rectangle])
+    return ellipse, polygon
+
+
+def test_replay_restores_the_session(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    engine = AnnotationEngine()
+    journal = AnnotationJournal(path, interval=60)
+    journal.attach(engine.Data)
+    edit_session(engine)
+    journal.flush()
+
+    restored = AnnotationEngine()
+    assert AnnotationJournal(path).replay(restored.Data) == list(engine.Data.annotations_tkinter)
+    assert annotations(restored) == annotations(engine)
+    journal.close()
+    assert annotations(restored) == {
+        unique_id: (shape, coords, layer)
+        for unique_id, (shape, coords, layer) in read_journal(path).items()
+    }
+
+
+def test_compaction_and_torn_lines(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    engine = AnnotationEngine()
+    journal = AnnotationJournal(path, interval=60, compact_records=5)
+    journal.attach(engine.Data)
+    _, polygon = edit_session(engine)
+    for i in range(20):
+        engine.translate_annotations([polygon], 1, 0)
+    journal.flush()
+    with open(path) as f:
+        assert len(f.readlines()) == len(engine.Data)  # compacted to a snapshot
+
+    with open(path, "a") as f:
+        f.write('{"op": "add", "id": "torn", "sha')  # a crash while writing
+    assert list(read_journal(path)) == list(engine.Data.annotations_tkinter)
+    journal.close()
+
+
+def test_attach_without_replay_discards_the_journal(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    engine = AnnotationEngine()
+    journal = AnnotationJournal(path, interval=60)
+    journal.attach(engine.Data)
+    edit_session(engine)
+    journal.close()
+
+    journal = AnnotationJournal(path, interval=60)
+    journal.attach(AnnotationEngine().Data)
+    journal.close()
+    assert read_journal(path) == {}
+
+
+def test_saved_json_replaces_restored_annotations(tmp_path):
+    engine = AnnotationEngine()
+    edit_session(engine)
+    path = str(tmp_path / "annotations.json")
+    engine.save_annotations(path)
+    with open(path) as f:
+        assert all("id" in annotation for annotation in json.load(f))
+
+    expected = annotations(engine)
+    engine.load_annotations(path)
+    assert annotations(engine) == expected
+
+
+def test_journal_path_is_per_image(tmp_path):
+    first = journal_path("a.png", str(tmp_path))
+    assert first == journal_path("a.png", str(tmp_path))
+    assert first != journal_path("b.png", str(tmp_path))
+    assert first.endswith(".jsonl")
+
+
+def test_loading_notifies_once_per_batch(tmp_path):
+    engine = AnnotationEngine()
+    for i in range(25):
+        engine.create_annotation((i, i), (i + 2, i + 3), "rectangle", unique_id=str(i))
+    engine.create_polygon([(0, 0), (10, 0), (10, 10)], unique_id="p")
+    path = str(tmp_path / "annotations.json")
+    engine.save_annotations(path)
+
+    loaded = AnnotationEngine()
+    notifications = []
+    loaded.Data.observers.append(lambda *notification: notifications.append(notification))
+    journal_file = str(tmp_path / "journal.jsonl")
+    journal = AnnotationJournal(journal_file, interval=60)
+    journal.attach(loaded.Data)
+    batches = list(loaded.iter_annotations(path, batch_size=10))
+    assert [len(batch) for batch in batches] == [10, 10, 6]
+    assert [(action, len(unique_ids)) for action, unique_ids in notifications] == [
+        ("add", 10),
+        ("add", 10),
+        ("add", 6),
+    ]
+    journal.close()
+    assert annotations(loaded) == annotations(engine)
+    assert set(read_journal(journal_file)) == set(annotations(engine))
+
+
+def test_journals_and_pyramids_share_the_cache_root(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    root = str(tmp_path / "tkinter-annotator")
+    assert os.path.dirname(default_journal_dir()) == root
+    assert os.path.dirname(default_cache_dir()) == root
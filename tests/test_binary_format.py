@@ -0,0 +1,66 @@
+import json
+
+import numpy as np
+import pytest
+
+from annotation_engine import AnnotationEngine
+from binary_format import (
+    convert_binary_to_json,
+    convert_json_to_binary,
+    is_binary,
+    read_arrays,
+)
+
+ANNOTATIONS = [
+    {"id": "p", "type": "polygon", "points": [{"x": 10.1, "y": 0.3}, {"x": 100, "y": 7.25}, {"x": 3, "y": 1e-3}], "area": 12.5},
+    {"id": "e", "type": "ellipse", "angleOfRotation": 0.5, "radiusX": 5, "radiusY": 3, "center": {"x": 20.7, "y": 30}, "layer": "glands"},
+    {"type": "circle", "radiusX": 4, "radiusY": 4, "center": {"x": 1, "y": 2}, "accuracy": 0.9},
+    {"id": "r", "type": "rectangle", "coords": [1.1, 2.2], "width": 3.3, "height": 4},
+]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_converters_round_trip(tmp_path, compress):
+    json_path, binary_path = tmp_path / "a.json", str(tmp_path / "a.annb")
+    json_path.write_text(json.dumps(ANNOTATIONS))
+    convert_json_to_binary(str(json_path), binary_path, compress=compress)
+    assert is_binary(binary_path) and not is_binary(str(json_path))
+    convert_binary_to_json(binary_path, str(tmp_path / "b.json"))
+    assert json.loads((tmp_path / "b.json").read_text()) == ANNOTATIONS
+
+
+def test_integer_files_stay_integer(tmp_path):
+    annotations = [{"id": "r", "type": "rectangle", "coords": [1, 2], "width": 3, "height": 4}]
+    (tmp_path / "a.json").write_text(json.dumps(annotations))
+    convert_json_to_binary(str(tmp_path / "a.json"), str(tmp_path / "a.annb"))
+    convert_binary_to_json(str(tmp_path / "a.annb"), str(tmp_path / "b.json"))
+    converted = json.loads((tmp_path / "b.json").read_text())
+    assert converted == annotations
+    assert all(isinstance(v, int) for v in converted[0]["coords"] + [converted[0]["width"]])
+
+
+def test_uncompressed_arrays_are_memory_mapped(tmp_path):
+    (tmp_path / "a.json").write_text(json.dumps(ANNOTATIONS))
+    convert_json_to_binary(str(tmp_path / "a.json"), str(tmp_path / "a.annb"))
+    arrays, meta = read_arrays(str(tmp_path / "a.annb"))
+    assert not arrays["vertices"].flags.owndata
+    assert meta["layers"] == ["default", "glands"]
+
+
+def test_engine_round_trip(tmp_path):
+    (tmp_path / "a.json").write_text(json.dumps(ANNOTATIONS))
+    engine = AnnotationEngine()
+    engine.load_annotations(str(tmp_path / "a.json"))
+    engine.save_annotations(str(tmp_path / "a.annb"))
+
+    loaded = AnnotationEngine()
+    loaded.load_annotations(str(tmp_path / "a.annb"))
+    assert list(loaded.Data.annotations_tkinter) == list(engine.Data.annotations_tkinter)
+    for unique_id, annotation in engine.Data.annotations_tkinter.items():
+        other = loaded.Data.annotations_tkinter[unique_id]
+        assert (other.shape, other.layer) == (annotation.shape, annotation.layer)
+        assert np.array_equal(loaded.Data.store.coords(unique_id), engine.Data.store.coords(unique_id))
+
+    engine.save_annotations(str(tmp_path / "a.json"))
+    loaded.save_annotations(str(tmp_path / "b.json"))
+    assert (tmp_path / "a.json").read_text() == (tmp_path / "b.json").read_text()
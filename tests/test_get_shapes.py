@@ -0,0 +1,75 @@
+import math
+
+import numpy as np
+import pytest
+
+from get_shapes import (
+    distance_to_polygon,
+    extend_path,
+    get_circle,
+    get_circles,
+    get_ellipse,
+    get_ellipses,
+    get_rectangle,
+    get_rectangles,
+    oval2poly,
+    oval2polys,
+    rec2poly,
+    rec2polys,
+)
+
+
+def random_points(seed, n=200):
+    """ Pairs of points, half of them on a small integer grid so some coordinates are equal"""
+    rng = np.random.default_rng(seed)
+    coord1 = rng.uniform(-1000, 1000, (n, 2))
+    coord2 = rng.uniform(-1000, 1000, (n, 2))
+    coord1[::2] = rng.integers(0, 3, (n // 2, 2))
+    coord2[::2] = rng.integers(0, 3, (n // 2, 2))
+    return coord1, coord2
+
+
+@pytest.mark.parametrize(
+    "batch, scalar",
+    [(get_ellipses, get_ellipse), (get_circles, get_circle), (get_rectangles, get_rectangle)],
+)
+def test_batch_boxes_match_scalar_versions(batch, scalar):
+    coord1, coord2 = random_points(0)
+    expected = [scalar(a, b) for a, b in zip(coord1.tolist(), coord2.tolist())]
+    # hypot and sqrt of squares may differ in the last bit
+    assert np.allclose(batch(coord1, coord2), np.array(expected), rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize("steps, rotation", [(20, 0), (8, 30), (64, -45)])
+def test_batch_polygons_match_scalar_versions(steps, rotation):
+    boxes = get_ellipses(*random_points(1))
+    expected = [oval2poly(*box, steps=steps, rotation=rotation) for box in boxes.tolist()]
+    assert np.array_equal(oval2polys(boxes, steps, rotation), np.array(expected, dtype=np.float64))
+    expected = [rec2poly(*box) for box in boxes.tolist()]
+    assert np.array_equal(rec2polys(boxes), np.array(expected, dtype=np.float64))
+
+
+def trace(points, min_distance=0.5, tolerance=0.5):
+    path, skipped = [], []
+    for point in points:
+        extend_path(path, point, min_distance, tolerance=tolerance, skipped=skipped)
+    return path
+
+
+def max_deviation(points, path):
+    """ Largest distance of a traced point to the simplified path"""
+    segments = [[path[i], path[i + 1]] for i in range(len(path) - 1)]
+    return max(min(distance_to_polygon(*point, segment) for segment in segments) for point in points)
+
+
+def test_straight_traces_collapse_to_a_segment():
+    points = [(i, 0) for i in range(100)]
+    assert trace(points) == [(0, 0), (99, 0)]
+
+
+def test_slow_curves_stay_within_tolerance():
+    # every step turns by less than max_angle, the curve drifts away from a single chord
+    points = [(100 * math.sin(i / 100), 100 - 100 * math.cos(i / 100)) for i in range(300)]
+    path = trace(points)
+    assert len(path) > 2
+    assert max_deviation(points, path) <= 0.5 + 1e-9
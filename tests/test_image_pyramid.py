@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_pyramid import ImagePyramid, coarse_preview, reduced_preview
+from image_sources import ImageSource, PillowSource, SourceLevel, open_source
+from pyramid_cache import PyramidCache
+
+
+def noise(size=(1500, 1100)):
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+
+
+def test_only_jpeg_previews_are_decoded_at_start(tmp_path):
+    noise().save(tmp_path / "image.jpg")
+    noise().save(tmp_path / "image.png")
+    assert coarse_preview(str(tmp_path / "image.jpg"), (300, 200)).size == (300, 200)
+    assert coarse_preview(str(tmp_path / "image.png"), (300, 200)) is None
+
+
+@pytest.mark.parametrize("mode", ["RGB", "P", "1", "I;16", "CMYK"])
+def test_reduced_preview_of_every_mode(mode):
+    image = noise().convert(mode) if mode != "I;16" else noise().convert("L").convert("I;16")
+    assert reduced_preview(image, (375, 275)).size == (375, 275)
+
+
+def test_placeholder_is_replaced_after_decoding(tmp_path):
+    path = tmp_path / "image.png"
+    noise().convert("P").save(path)
+    pyramid = ImagePyramid(str(path), min_size=256, cache=PyramidCache(str(tmp_path / "cache")))
+    pyramid.start()
+    assert pyramid[-1].size == pyramid.sizes[-1]
+    assert pyramid.wait(30)
+    assert not pyramid.placeholder
+    assert np.asarray(pyramid[-1].crop((0, 0, 64, 64))).std() > 0
+
+
+class RegionSource(ImageSource):
+    """ A single level read by region, like a tiled TIFF, that counts the pixels it reads"""
+
+    native = False
+
+    def __init__(self, image):
+        super().__init__("regions", [image.size])
+        self.image = image
+        self.largest = 0
+
+    def read_region(self, level, box):
+        region = self.image.crop(self.clip(level, box))
+        self.largest = max(self.largest, region.size[0] * region.size[1])
+        return region
+
+
+def test_region_sources_are_built_without_decoding_at_once(tmp_path):
+    image = noise().convert("P")
+    source = RegionSource(image)
+    path = str(tmp_path / "image.tif")
+    image.save(path)  # only the cache key is read from the file
+    pyramid = ImagePyramid(
+        path, min_size=256, cache=PyramidCache(str(tmp_path / "cache")), source=source, workers=1
+    )
+    pyramid.start()
+    assert isinstance(pyramid[0], SourceLevel)
+    assert pyramid.wait(30)
+    assert source.largest < image.size[0] * image.size[1]
+    assert pyramid[1].mode == "RGB"
+    expected = image.convert("RGB").resize(pyramid.sizes[1], Image.LANCZOS)
+    level = pyramid[1].crop((0, 0) + pyramid.sizes[1])
+    difference = np.abs(np.asarray(level, int) - np.asarray(expected, int))
+    assert difference.max() <= 1
+
+
+def test_untiled_tiff_is_decoded_at_once(tmp_path, capsys):
+    path = str(tmp_path / "image.tif")
+    noise().save(path)
+    assert isinstance(open_source(path), PillowSource)
+    assert "decoding the whole image" in capsys.readouterr().out
@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+
+from annotation_engine import AnnotationEngine
+from annotation_store import json_values, shortest_float64
+
+ANNOTATIONS = [
+    {"id": "p", "type": "polygon", "points": [{"x": 10.1, "y": 0.3}, {"x": 100, "y": 7.25}, {"x": 3, "y": 1e-3}]},
+    {"id": "e", "type": "ellipse", "angleOfRotation": 0, "radiusX": 5, "radiusY": 3, "center": {"x": 20.7, "y": 30}},
+    {"id": "c", "type": "circle", "angleOfRotation": 0, "radiusX": 4, "radiusY": 4, "center": {"x": 1, "y": 2}},
+    {"id": "r", "type": "rectangle", "coords": [1.1, 2.2], "width": 3.3, "height": 4},
+]
+
+
+def save(engine, path):
+    engine.save_annotations(str(path))
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_json_values_are_written_as_entered():
+    values = np.array([10.1, 100, 0.3, -3.3, 12345.678, 1e-7], dtype=np.float32)
+    assert json_values(values) == [10.1, 100, 0.3, -3.3, 12345.678, 1e-7]
+    assert isinstance(json_values(values)[1], int)
+    assert np.array_equal(shortest_float64(values).astype(np.float32), values)
+
+
+def test_saving_does_not_change_a_file(tmp_path):
+    source = tmp_path / "source.json"
+    source.write_text(json.dumps(ANNOTATIONS))
+    engine = AnnotationEngine()
+    engine.load_annotations(str(source))
+    saved = save(engine, tmp_path / "saved.json")
+
+    by_id = {annotation["id"]: annotation for annotation in saved}
+    assert by_id["p"]["points"] == ANNOTATIONS[0]["points"]
+    assert by_id["e"]["center"] == ANNOTATIONS[1]["center"]
+    assert by_id["r"]["coords"] == [1.1, 2.2]
+    assert by_id["r"]["height"] == 4
+
+    engine = AnnotationEngine()
+    engine.load_annotations(str(tmp_path / "saved.json"))
+    assert save(engine, tmp_path / "again.json") == saved
@@ -0,0 +1,35 @@
+import io
+import json
+
+import pytest
+
+from json_stream import iter_json_array
+
+TEXT = '[1e5, 10.5, -3, 1E-2, 0, 12345678901234567890, true, null, "a\\"b]", {"x": [1.25, 2e-3]}, []]'
+
+
+class SplitFile:
+    """ Returns the text up to split on the first read, the rest in chunks of the asked size"""
+
+    def __init__(self, text, split):
+        self.text = text
+        self.split = split
+        self.pos = 0
+
+    def read(self, size):
+        end = self.split if self.pos < self.split else self.pos + size
+        chunk = self.text[self.pos : end]
+        self.pos = end
+        return chunk
+
+
+@pytest.mark.parametrize("split", range(len(TEXT) + 1))
+def test_elements_split_at_every_offset(split):
+    elements = [element for element, _ in iter_json_array(SplitFile(TEXT, split), chunk_size=3)]
+    assert elements == json.loads(TEXT)
+
+
+def test_positions_follow_the_elements():
+    text = '[1, 22, 333]'
+    positions = [position for _, position in iter_json_array(io.StringIO(text), chunk_size=4)]
+    assert [text[:p].rstrip()[-1] for p in positions] == ["1", "2", "3"]
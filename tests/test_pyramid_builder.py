@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_sources import pyramid_sizes
+from pyramid_builder import build_levels, tiles_of
+
+
+def noise(size=(1300, 1000)):
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+
+
+def test_tiles_cover_the_level():
+    boxes = tiles_of((1000, 700), 256)
+    coverage = np.zeros((700, 1000), dtype=int)
+    for x0, y0, x1, y1 in boxes:
+        coverage[y0:y1, x0:x1] += 1
+    assert (coverage == 1).all()
+    assert min(x1 - x0 for x0, _, x1, _ in boxes) > 128
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_tiled_levels_equal_serial_levels(tmp_path, workers):
+    image = noise()
+    sizes = pyramid_sizes(image.size, 2, 128)
+    done = []
+    names = build_levels(
+        image,
+        sizes,
+        str(tmp_path),
+        Image.LANCZOS,
+        workers=workers,
+        tile_size=200,
+        level_done=lambda level, array: done.append(level),
+    )
+    assert done == list(range(1, len(sizes)))
+    assert not (tmp_path / "level_0.npy").exists()
+
+    expected = image
+    for level, name in enumerate(names, start=1):
+        expected = expected.resize(sizes[level], Image.LANCZOS)
+        built = np.load(tmp_path / name)
+        assert built.shape == (sizes[level][1], sizes[level][0], 3)
+        assert np.abs(built.astype(int) - np.asarray(expected, int)).max() <= 1
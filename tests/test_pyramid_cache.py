@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_pyramid import ImagePyramid
+from pyramid_cache import MODES, PyramidCache, display_mode
+
+
+def gradient(size=(1200, 900)):
+    x = np.linspace(0, 255, size[0], dtype=np.uint8)
+    y = np.linspace(0, 255, size[1], dtype=np.uint8)
+    return np.dstack(np.broadcast_arrays(x[None, :], y[:, None], x[None, :] // 2 + y[:, None] // 2))
+
+
+def build(path, cache, parallel_pixels=4096 * 4096):
+    pyramid = ImagePyramid(
+        str(path), min_size=256, cache=cache, workers=2, parallel_pixels=parallel_pixels
+    )
+    pyramid.start()
+    assert pyramid.wait(30)
+    return pyramid
+
+
+@pytest.mark.parametrize("parallel_pixels", [4096 * 4096, 0], ids=["serial", "tiled"])
+@pytest.mark.parametrize(
+    "mode, extension",
+    [("RGB", ".png"), ("L", ".png"), ("RGBA", ".png"), ("P", ".png"), ("CMYK", ".jpg")],
+)
+def test_cached_levels_keep_colors(tmp_path, mode, extension, parallel_pixels):
+    image = Image.fromarray(gradient()).convert(mode)
+    path = tmp_path / ("image" + extension)
+    image.save(path)
+    cache = PyramidCache(str(tmp_path / "cache"))
+
+    built = build(path, cache, parallel_pixels)
+    cached = build(path, cache, parallel_pixels)
+    assert len(cached) == len(built) > 2
+    for level in range(1, len(built)):
+        expected = built[level].crop((0, 0, 64, 64))
+        reloaded = cached[level].crop((0, 0, 64, 64))
+        assert expected.mode == reloaded.mode == display_mode(image)
+        assert reloaded.mode in MODES
+        assert np.array_equal(np.asarray(expected), np.asarray(reloaded))
+
+    # the colors are those of the image, not its raw bands reinterpreted
+    shown = Image.open(path).convert(display_mode(image)).resize(cached[-1].size)
+    top = cached[-1].crop((0, 0) + cached[-1].size)
+    assert np.abs(np.asarray(top, float) - np.asarray(shown, float)).mean() < 4
+
+
+def test_entries_without_mode_are_not_used(tmp_path):
+    path = tmp_path / "image.png"
+    Image.fromarray(gradient()).save(path)
+    cache = PyramidCache(str(tmp_path / "cache"))
+    build(path, cache)
+
+    meta = tmp_path / "cache" / cache.key(str(path), 2, 256) / PyramidCache.META
+    meta.write_text(meta.read_text().replace('"mode"', '"old"'))
+    assert cache.load(str(path), 2, 256) is None
+
+
+def test_eviction_keeps_build_directories(tmp_path):
+    cache = PyramidCache(str(tmp_path / "cache"), max_bytes=0)
+    building = tmp_path / "cache" / ("0" * 40 + PyramidCache.TMP + "123")
+    building.mkdir(parents=True)
+    (building / "level_1.npy").write_bytes(b"\0" * 1000)
+    old = tmp_path / "cache" / ("1" * 40)
+    old.mkdir()
+    (old / "level_1.npy").write_bytes(b"\0" * 1000)
+
+    cache.evict()
+    assert building.exists()
+    assert not old.exists()
+
+
+def test_display_mode():
+    assert display_mode(Image.new("P", (4, 4))) == "RGB"
+    assert display_mode(Image.new("CMYK", (4, 4))) == "RGB"
+    assert display_mode(Image.new("I;16", (4, 4))) == "L"
+    assert display_mode(Image.new("1", (4, 4))) == "L"
+    assert display_mode(Image.new("LA", (4, 4))) == "RGBA"
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from spatial_index import GridIndex
+
+
+def random_boxes(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    corners = rng.uniform(-500, 5000, (n, 2))
+    sizes = rng.exponential(100, (n, 2))
+    sizes[:5] *= 100  # a few cover more than max_cells cells
+    return np.hstack([corners, corners + sizes])
+
+
+def brute_force(boxes, query, contained=False):
+    x0, y0, x1, y1 = query
+    if contained:
+        hit = (x0 <= boxes[:, 0]) & (y0 <= boxes[:, 1]) & (boxes[:, 2] <= x1) & (boxes[:, 3] <= y1)
+    else:
+        hit = (boxes[:, 0] <= x1) & (x0 <= boxes[:, 2]) & (boxes[:, 1] <= y1) & (y0 <= boxes[:, 3])
+    return set(np.flatnonzero(hit).tolist())
+
+
+@pytest.mark.parametrize("many", [False, True])
+@pytest.mark.parametrize("contained", [False, True])
+def test_queries_match_brute_force(many, contained):
+    boxes = random_boxes()
+    index = GridIndex(cell_size=256, max_cells=16)
+    if many:
+        index.insert_many(range(len(boxes)), boxes)
+    else:
+        for key, bbox in enumerate(boxes.tolist()):
+            index.insert(key, tuple(bbox))
+    assert index.large
+
+    for query in [(0, 0, 300, 300), (1000, 2000, 1001, 2001), (-1e4, -1e4, 1e4, 1e4)]:
+        keys = index.query_box(query, contained=contained)
+        assert set(keys) == brute_force(boxes, query, contained)
+        assert keys == sorted(keys, reverse=True)  # later keys are on top
+
+
+def test_moved_and_removed_keys():
+    index = GridIndex(cell_size=10)
+    index.insert("a", (0, 0, 5, 5))
+    index.insert("b", (0, 0, 5, 5))
+    index.insert("a", (100, 100, 105, 105))  # moved, keeps its place in the drawing order
+    assert index.query_box((0, 0, 10, 10)) == ["b"]
+    assert index.query_box((0, 0, 200, 200)) == ["b", "a"]
+    index.remove("b")
+    assert index.query_box((0, 0, 10, 10)) == []
+    assert len(index) == 1 and "b" not in index
+    assert all(index.cells.values())  # no empty cells are left behind
@@ -0,0 +1,45 @@
+import numpy as np
+from PIL import Image
+
+from tile_renderer import TileRenderer
+
+
+class OneLevelPyramid:
+    def __init__(self, image):
+        self.levels = [image]
+        self.size = image.size
+
+    def __getitem__(self, index):
+        return self.levels[index]
+
+    def scale(self, index, imscale):
+        return imscale * self.size[0] / self.levels[index].size[0]
+
+    def crop(self, index, box):
+        return self.levels[index].crop(box)
+
+
+def test_tiles_join_without_seams():
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (1000, 1000, 3), dtype=np.uint8))
+    imscale = 0.75
+    renderer = TileRenderer(None, OneLevelPyramid(image), tile_size=256, workers=1)
+
+    stitched = Image.new("RGB", (750, 750))
+    for row in range(3):
+        for col in range(3):
+            tile = renderer.render_tile((0, imscale, col, row), imscale)
+            stitched.paste(tile, (col * 256, row * 256))
+    whole = image.resize((750, 750), Image.LANCZOS)
+    difference = np.abs(np.asarray(stitched, int) - np.asarray(whole, int))
+    assert difference.max() <= 1
+    renderer.executor.shutdown()
+
+
+def test_visible_tiles():
+    image = Image.new("RGB", (1000, 600))
+    renderer = TileRenderer(None, OneLevelPyramid(image), tile_size=256, workers=1)
+    assert renderer.visible_tiles((0, 0), 1.0, (0, 0, 300, 300)) == [(0, 0), (1, 0), (0, 1), (1, 1)]
+    assert renderer.visible_tiles((-512, 0), 1.0, (0, 0, 300, 100)) == [(2, 0), (3, 0)]
+    assert renderer.tile_box((0, 0.5, 1, 2), (10, 20), 1.0) == (522, 1044, 1034, 1556)
+    renderer.executor.shutdown()
@@ -0,0 +1,95 @@
+from data_tkinter_classes import AnnotationsTkinter
+from virtual_canvas import VirtualCanvas
+
+
+class FakeCanvas:
+    """ The canvas calls of the virtual canvas, items are dicts"""
+
+    def __init__(self):
+        self.items = {}
+
+    def create(self, item_type, coords, **options):
+        canvas_id = len(self.items) + 1
+        self.items[canvas_id] = {"type": item_type, "coords": list(coords), **options}
+        return canvas_id
+
+    def create_polygon(self, coords, **options):
+        return self.create("polygon", coords, **options)
+
+    def create_rectangle(self, coords, **options):
+        return self.create("rectangle", coords, **options)
+
+    def create_line(self, coords, **options):
+        return self.create("line", coords, **options)
+
+    def coords(self, canvas_id, coords):
+        self.items[canvas_id]["coords"] = list(coords)
+
+    def itemconfigure(self, canvas_id, **options):
+        self.items[canvas_id].update(options)
+
+    def gettags(self, canvas_id):
+        return self.items[canvas_id]["tags"]
+
+    def type(self, canvas_id):
+        return self.items[canvas_id]["type"]
+
+    def tag_raise(self, canvas_id):
+        pass
+
+    def delete(self, canvas_id):
+        del self.items[canvas_id]
+
+    def drawn(self):
+        return [item for item in self.items.values() if item["state"] != "hidden"]
+
+
+def box(coords):
+    xs, ys = coords[0::2], coords[1::2]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def squares(data, n, size):
+    """ n rectangles in a row, the i-th is size * (i + 1) wide"""
+    for i in range(n):
+        x = i * 100
+        data.add_annotation(f"r{i}", None, [(x, 0), (x + size * (i + 1), size * (i + 1))], "rectangle")
+
+
+def test_only_the_largest_annotations_are_drawn_when_zoomed_out():
+    data = AnnotationsTkinter()
+    squares(data, 50, 1)
+    canvas = FakeCanvas()
+    virtual = VirtualCanvas(canvas, data, max_items=10)
+
+    virtual.update((0, 0), 1.0, (0, 0, 5000, 100))
+    drawn = canvas.drawn()
+    assert len(drawn) == 10
+    assert {item["tags"][0] for item in drawn} == {f"r{i}" for i in range(40, 50)}
+    assert all(VirtualCanvas.TAG in item["tags"] for item in canvas.items.values())
+
+
+def test_annotations_are_reprojected_on_zoom():
+    data = AnnotationsTkinter()
+    squares(data, 3, 10)
+    canvas = FakeCanvas()
+    virtual = VirtualCanvas(canvas, data)
+
+    virtual.update((0, 0), 1.0, (0, 0, 400, 100))
+    virtual.update((5, 5), 2.0, (0, 0, 400, 100))
+    canvas_id = data.annotations_tkinter["r1"].canvas_id
+    assert box(canvas.items[canvas_id]["coords"]) == [205, 5, 245, 45]
+
+
+def test_selected_annotations_follow_the_zoom_outside_of_the_view():
+    data = AnnotationsTkinter()
+    squares(data, 3, 10)
+    canvas = FakeCanvas()
+    virtual = VirtualCanvas(canvas, data, margin=0)
+
+    virtual.update((0, 0), 1.0, (0, 0, 400, 100))
+    canvas_id = data.annotations_tkinter["r2"].canvas_id
+    canvas.items[canvas_id]["tags"] += ("MOVE",)
+    virtual.update((0, 0), 0.5, (0, 0, 50, 50))  # r2 is outside of the view, but kept
+    assert data.annotations_tkinter["r2"].canvas_id == canvas_id
+    assert box(canvas.items[canvas_id]["coords"]) == [100, 0, 115, 15]
@@ -0,0 +1,306 @@
+import math
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from tkinter import PhotoImage
+from PIL import Image, ImageTk
+
+from tracing import TRACER
+
+
+class TileRenderer:
+    """
+    Draws the visible part of the image as a grid of fixed size tiles.
+    A tile is identified by (pyramid level, zoom, column, row) and rendered tiles are kept in a
+    bounded LRU cache, so panning only renders the tiles that newly enter the view.
+    Cropping and resampling runs in a thread pool; finished tiles are collected by poll() on the
+    Tk main loop, which is the only place where PhotoImages are created.
+    Tiles of another zoom or level stay on the canvas as preview, rescaled by Tk, until all
+    tiles of the view are placed, so zooming never shows a blank canvas.
+    """
+
+    TAG = "TILE"
+
+    def __init__(
+        self, canvas, pyramid, tile_size=256, max_tiles=512, resample=Image.LANCZOS, workers=4
+    ):
+        self.canvas = canvas
+        self.pyramid = pyramid
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.resample = resample
+
+        self.cache = OrderedDict()  # (tile key, resampling filter) -> PhotoImage
+        self.placed = {}  # tile key -> (canvas id, resampling filter) of the tiles on the canvas
+        self.photos = {}  # canvas id -> PhotoImage it shows, keeps the image alive
+        self.stale = {}  # canvas id -> (tile key, PhotoImage, shown scale) of preview tiles
+        self.wanted = {}  # tile key -> resampling filter of the tiles in the current view
+        self.sources = {}  # level -> pyramid level the tiles of the level were rendered from
+        self.origin = (0, 0)
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = {}  # (tile key, resampling filter) -> future
+        self.done = queue.Queue()  # finished (tile key, resampling filter, PIL image)
+
+    def stats(self):
+        """ Returns the cache counters, used to tune max_tiles"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "cached": len(self.cache),
+            "placed": len(self.placed),
+            "stale": len(self.stale),
+            "pending": len(self.pending),
+            "cancelled": self.cancelled,
+        }
+
+    def clear(self):
+        """ Removes all tiles from the canvas and the cache"""
+        self.cancel(set())
+        self.canvas.delete(self.TAG)
+        self.placed = {}
+        self.photos = {}
+        self.stale = {}
+        self.wanted = {}
+        self.sources = {}
+        self.cache.clear()
+
+    def forget(self, level):
+        """
+        Drops the cached tiles of a level whose image was replaced, e.g. a preview by the real level.
+        Placed tiles stay on the canvas until their new version is rendered.
+        """
+        for job_key in [k for k in self.pending if k[0] == level]:
+            self.pending.pop(job_key).cancel()
+        for cache_key in [k for k in self.cache if k[0] == level]:
+            del self.cache[cache_key]
+        for key, (canvas_id, _) in self.placed.items():
+            if key[0] == level:
+                self.placed[key] = (canvas_id, None)  # outdated, replaced when rendered
+
+    def visible_tiles(self, origin, imscale, box_canvas):
+        """ Returns the (column, row) of all tiles that intersect the visible canvas area"""
+        t = self.tile_size
+        width = self.pyramid.size[0] * imscale
+        height = self.pyramid.size[1] * imscale
+        x0, y0 = origin
+
+        col0 = max(0, int(math.floor((box_canvas[0] - x0) / t)))
+        row0 = max(0, int(math.floor((box_canvas[1] - y0) / t)))
+        col1 = min(int(math.ceil(width / t)), int(math.ceil((box_canvas[2] - x0) / t)))
+        row1 = min(int(math.ceil(height / t)), int(math.ceil((box_canvas[3] - y0) / t)))
+        return [(col, row) for row in range(row0, row1) for col in range(col0, col1)]
+
+    def show(self, origin, imscale, level, box_canvas, fast=False):
+        """
+        Places the cached tiles of the visible area on the canvas, removes the tiles outside of it
+        and queues the missing tiles for rendering.
+        With fast=True missing tiles are rendered with nearest neighbour resampling, a later call
+        with fast=False replaces these preview tiles with full quality ones.
+        """
+        source = self.pyramid[level]
+        if self.sources.get(level, source) is not source:
+            self.forget(level)
+        self.sources[level] = source
+
+        zoom = round(imscale, 9)
+        keys = [(level, zoom, col, row) for col, row in self.visible_tiles(origin, imscale, box_canvas)]
+        self.origin = origin
+        self.wanted = {key: Image.NEAREST if fast else self.resample for key in keys}
+
+        with TRACER.span("remove tiles", "canvas"):
+            for key in list(self.placed):
+                if key in self.wanted:
+                    continue
+                canvas_id, _ = self.placed.pop(key)
+                if key[:2] != (level, zoom):
+                    # preview until replaced, its image is rescaled from this one
+                    self.stale[canvas_id] = (key, self.photos[canvas_id], Fraction(1))
+                else:
+                    self.remove(canvas_id)  # left the view
+            self.update_stale(origin, imscale, box_canvas)
+        self.cancel(self.wanted)
+
+        for key in keys:
+            placed = self.placed.get(key)
+            if placed is not None and (fast or placed[1] == self.resample):
+                continue
+
+            options = [self.resample, Image.NEAREST] if fast else [self.resample]
+            for resample in options:
+                photo = self.cache.get(key + (resample,))
+                if photo is not None:
+                    self.hits += 1
+                    self.cache.move_to_end(key + (resample,))
+                    self.place(key, photo, resample)
+                    break
+            else:
+                self.submit(key, imscale, options[-1])
+        self.canvas.lower(self.TAG)  # set image into background
+        self.remove_stale()
+
+    def remove(self, canvas_id):
+        self.canvas.delete(canvas_id)
+        self.photos.pop(canvas_id, None)
+
+    def tile_box(self, key, origin, imscale):
+        """ Returns the canvas area of a tile of any zoom at the current origin and zoom"""
+        _, zoom, col, row = key
+        factor = imscale / zoom
+        t = self.tile_size * factor
+        x0, y0 = origin[0] + col * t, origin[1] + row * t
+        return x0, y0, x0 + t, y0 + t
+
+    def update_stale(self, origin, imscale, box_canvas):
+        """
+        Rescales the preview tiles to the current zoom, Tk zooms and subsamples the images of
+        their own zoom by the nearest small fraction. Previews outside of the view are removed.
+        """
+        for canvas_id, (key, photo, factor) in list(self.stale.items()):
+            x0, y0, x1, y1 = self.tile_box(key, origin, imscale)
+            outside = x1 < box_canvas[0] or y1 < box_canvas[1]
+            outside = outside or x0 > box_canvas[2] or y0 > box_canvas[3]
+            new_factor = Fraction(imscale / key[1]).limit_denominator(8)
+            if outside or new_factor.numerator == 0 or new_factor.numerator > 16:
+                del self.stale[canvas_id]  # not visible or not useful as preview
+                self.remove(canvas_id)
+                continue
+            self.canvas.coords(canvas_id, x0, y0)
+            if new_factor == factor:
+                continue
+            scaled = photo
+            if new_factor != 1:
+                scaled = PhotoImage(master=self.canvas)
+                self.canvas.tk.call(
+                    str(scaled),
+                    "copy",
+                    str(photo),
+                    "-subsample",
+                    new_factor.denominator,
+                    new_factor.denominator,
+                    "-zoom",
+                    new_factor.numerator,
+                    new_factor.numerator,
+                )
+            self.photos[canvas_id] = scaled
+            self.stale[canvas_id] = (key, photo, new_factor)
+            self.canvas.itemconfigure(canvas_id, image=scaled)
+
+    def remove_stale(self):
+        """ Removes the preview tiles once every tile of the view is placed"""
+        if self.stale and all(key in self.placed for key in self.wanted):
+            for canvas_id in self.stale:
+                self.remove(canvas_id)
+            self.stale = {}
+
+    def submit(self, key, imscale, resample):
+        """ Renders a tile in the thread pool unless it is already being rendered"""
+        if key + (resample,) in self.pending:
+            return
+        self.misses += 1
+        self.pending[key + (resample,)] = self.executor.submit(
+            self.__render_job, key, imscale, resample
+        )
+
+    def cancel(self, wanted):
+        """ Cancels the jobs of tiles that are not in wanted anymore"""
+        for job_key in list(self.pending):
+            if job_key[:4] not in wanted:
+                self.pending.pop(job_key).cancel()
+                self.cancelled += 1
+
+    def __render_job(self, key, imscale, resample):
+        """ Runs in a worker thread, the finished image is handed to the main loop through the queue"""
+        self.done.put((key, resample, self.render_tile(key, imscale, resample)))
+
+    def poll(self):
+        """
+        Places the tiles finished by the workers, must run on the Tk main loop.
+        Returns True while there are still tiles being rendered.
+        """
+        placed = False
+        while True:
+            try:
+                key, resample, image = self.done.get_nowait()
+            except queue.Empty:
+                break
+            if self.pending.pop(key + (resample,), None) is None:
+                continue  # cancelled while it was being rendered
+
+            with TRACER.span("PhotoImage", "render"):
+                photo = ImageTk.PhotoImage(image)
+            self.cache[key + (resample,)] = photo
+            while len(self.cache) > self.max_tiles:
+                self.cache.popitem(last=False)
+
+            current = self.placed.get(key)
+            if key in self.wanted and (current is None or current[1] != self.resample):
+                self.place(key, photo, resample)
+                placed = True
+
+        if placed:
+            self.canvas.lower(self.TAG)  # set image into background
+            self.remove_stale()
+        return bool(self.pending)
+
+    def place(self, key, photo, resample):
+        """ Puts a tile on the canvas or replaces the image of a placed tile"""
+        with TRACER.span("place tile", "canvas"):
+            self.__place(key, photo, resample)
+
+    def __place(self, key, photo, resample):
+        placed = self.placed.get(key)
+        if placed is not None:
+            self.canvas.itemconfigure(placed[0], image=photo)
+            self.placed[key] = (placed[0], resample)
+            self.photos[placed[0]] = photo
+            return
+
+        _, _, col, row = key
+        canvas_id = self.canvas.create_image(
+            self.origin[0] + col * self.tile_size,
+            self.origin[1] + row * self.tile_size,
+            anchor="nw",
+            image=photo,
+            tags=self.TAG,
+        )
+        self.placed[key] = (canvas_id, resample)
+        self.photos[canvas_id] = photo
+
+    def render_tile(self, key, imscale, resample=None):
+        """ Crops and resizes the region of a tile from its pyramid level"""
+        level, _, col, row = key
+        t = self.tile_size
+        width = self.pyramid.size[0] * imscale
+        height = self.pyramid.size[1] * imscale
+
+        # tile area in canvas pixels, clipped at the image border
+        x0, y0 = col * t, row * t
+        x1, y1 = min(x0 + t, width), min(y0 + t, height)
+
+        scale = self.pyramid.scale(level, imscale)
+        w, h = self.pyramid[level].size
+        # exact area of the tile in the level, read with a margin for the support of the filter
+        # so neighbouring tiles resample the same pixels and join without seams
+        fx0, fy0 = x0 / scale, y0 / scale
+        fx1, fy1 = min(w, x1 / scale), min(h, y1 / scale)
+        margin = int(math.ceil(3 * max(1, 1 / scale))) + 1
+        ix0, iy0 = max(0, int(fx0) - margin), max(0, int(fy0) - margin)
+        ix1 = min(w, int(math.ceil(fx1)) + margin)
+        iy1 = min(h, int(math.ceil(fy1)) + margin)
+        with TRACER.span("crop", "render", level=level):
+            image = self.pyramid.crop(level, (ix0, iy0, ix1, iy1))
+        if resample is None:
+            resample = self.resample
+        with TRACER.span("resize", "render", resample=int(resample)):
+            return image.resize(
+                (max(1, int(x1 - x0)), max(1, int(y1 - y0))),
+                resample,
+                box=(fx0 - ix0, fy0 - iy0, fx1 - ix0, fy1 - iy0),
+            )
@@ -0,0 +1,212 @@
+"""
+Opt-in latency tracing of the annotator.
+
+Tracing is off unless the ANNOTATOR_TRACE environment variable is set or the Annotator is
+created with trace=True. When it is off, every instrumented call costs one attribute lookup.
+Spans are kept in memory and can be saved as Chrome trace json, which opens in
+chrome://tracing and https://ui.perfetto.dev.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+
+
+class NullSpan:
+    """ Span that does nothing, returned while tracing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.complete(self.name, self.category, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class Tracer:
+    """
+    Records timed spans of the event handlers and of the rendering, and the latency from the
+    first input event to the paint that shows its result.
+    Only the newest max_events spans are kept, statistics use the newest window durations.
+    """
+
+    def __init__(self, enabled=False, max_events=200000, window=1000):
+        self.enabled = enabled
+        self.events = deque(maxlen=max_events)
+        self.durations = defaultdict(lambda: deque(maxlen=window))  # name -> seconds
+        self.frames = deque(maxlen=window)  # times of the paints
+        self.threads = {}  # thread id -> thread name
+        self.pending_input = None  # time of the oldest input that is not painted yet
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+
+    def span(self, name, category="handler", **args):
+        """ Context manager that records the duration of its block"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def complete(self, name, category, start, end, args=None):
+        """ Records a finished span, may be called from any thread"""
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self.pid,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+        self.durations[name].append(end - start)
+
+    def input(self):
+        """ Marks an input event, the latency is measured from the oldest unpainted input"""
+        if self.enabled and self.pending_input is None:
+            self.pending_input = time.perf_counter()
+
+    def painted(self):
+        """ Marks that the canvas shows the result of the inputs so far"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.frames.append(now)
+        if self.pending_input is not None:
+            self.complete("input_to_paint", "latency", self.pending_input, now)
+            self.pending_input = None
+
+    def percentile(self, names, q=95):
+        """ Returns the q-th percentile duration in seconds of the spans with the given names"""
+        if isinstance(names, str):
+            names = [names]
+        values = sorted(v for name in names for v in self.durations.get(name, ()))
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+    def fps(self, window_s=1.0):
+        """ Number of paints per second during the last window_s seconds"""
+        now = time.perf_counter()
+        return sum(1 for t in self.frames if now - t <= window_s) / window_s
+
+    def clear(self):
+        self.events.clear()
+        self.durations.clear()
+        self.frames.clear()
+        self.pending_input = None
+
+    def save(self, path):
+        """ Writes the spans as Chrome trace json"""
+        names = [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self.threads.items()
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": names + list(self.events), "displayTimeUnit": "ms"}, f)
+
+
+TRACER = Tracer(enabled=bool(os.environ.get("ANNOTATOR_TRACE")))
+
+
+def traced(name, category="handler", input=False, paint=False):
+    """
+    Decorator that records the duration of a method in TRACER.
+    input marks the call as input event, paint marks a paint once Tk is idle again (for handlers
+    that draw on self.canvas directly instead of through the render scheduler).
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return func(*args, **kwargs)
+            if input:
+                TRACER.input()
+            with TRACER.span(name, category):
+                result = func(*args, **kwargs)
+            if paint:
+                args[0].canvas.after_idle(TRACER.painted)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class TraceOverlay:
+    """ Shows the frame rate and the p95 handler and input-to-paint times in the canvas corner"""
+
+    TAG = "TRACE"
+    HANDLERS = (
+        "wheel",
+        "move_to",
+        "move_annotation",
+        "create_annotation",
+        "motion_create_annotation",
+        "trace_freehand",
+    )
+
+    def __init__(self, canvas, tracer=TRACER, interval_ms=500):
+        self.canvas = canvas
+        self.tracer = tracer
+        self.interval_ms = interval_ms
+        self.__job = None
+        self.update()
+
+    def text(self):
+        def ms(seconds):
+            return "-" if seconds is None else "{:.1f} ms".format(1000 * seconds)
+
+        return "FPS {:.0f}   p95 handler {}   p95 input to paint {}".format(
+            self.tracer.fps(),
+            ms(self.tracer.percentile(self.HANDLERS)),
+            ms(self.tracer.percentile("input_to_paint")),
+        )
+
+    def update(self):
+        self.__job = None
+        self.canvas.delete(self.TAG)
+        if self.tracer.enabled:
+            self.canvas.create_text(
+                self.canvas.canvasx(self.canvas.winfo_width() - 10),
+                self.canvas.canvasy(10),
+                anchor="ne",
+                fill="yellow",
+                text=self.text(),
+                tags=(self.TAG),
+            )
+        self.__job = self.canvas.after(self.interval_ms, self.update)
+
+    def cancel(self):
+        if self.__job is not None:
+            self.canvas.after_cancel(self.__job)
+            self.__job = None
+        self.canvas.delete(self.TAG)
@@ -0,0 +1,296 @@
+import math
+import numpy as np
+
+from annotation_store import SHAPE_CODES
+from get_shapes import (
+    get_circle,
+    get_circles,
+    get_ellipse,
+    get_ellipses,
+    get_rectangle,
+    get_rectangles,
+    ellipse_steps,
+    oval2poly,
+    oval2polys,
+)
+
+
+def lod_level(imscale, reduction=2):
+    """ Level of detail for a zoom, the same numbering as the levels of the image pyramid"""
+    if imscale >= 1:
+        return 0
+    return int(math.floor(math.log(1 / imscale, reduction) + 1e-9))
+
+
+def lod_tolerance(level, reduction=2, pixels=0.5):
+    """ Simplification tolerance in normalized coordinates, about pixels on screen at the level"""
+    return 0 if level == 0 else pixels * reduction ** level
+
+
+def project_annotation(coords_norm, shape, origin, imscale, steps=20):
+    """
+    Returns the canvas item type and the canvas coordinates of an annotation.
+    Coordinates are computed from the normalized coordinates, so they never drift with zooming.
+    """
+    x, y = origin
+    coords_scale = [(x + i[0] * imscale, y + i[1] * imscale) for i in coords_norm]
+
+    if shape == "polygon":
+        if len(coords_scale) == 2:
+            return "line", [v for point in coords_scale for v in point]
+        return "polygon", [v for point in coords_scale for v in point]
+
+    coord1, coord2 = coords_scale
+    if shape == "ellipse":
+        return "polygon", oval2poly(*get_ellipse(coord1, coord2), steps=steps)
+    elif shape == "circle":
+        return "polygon", oval2poly(*get_circle(coord1, coord2), steps=steps)
+    elif shape == "rectangle":
+        return "rectangle", list(get_rectangle(coord1, coord2))
+    raise ValueError(f"shape {shape} is not supported")
+
+
+def project_shapes(store, unique_ids, origin, imscale, adaptive=False):
+    """
+    Batch version of project_annotation for ellipses, circles and rectangles in the store.
+    With adaptive the number of vertices of ovals follows their radius on screen.
+    Returns a dict unique id -> canvas coordinates, polygons are skipped.
+    """
+    rows = store.get_rows(unique_ids)
+    types = store.types[rows]
+    ids = np.asarray(unique_ids, dtype=object)
+    origin = np.asarray(origin, dtype=np.float64)
+
+    projected = {}
+    batches = (("ellipse", get_ellipses), ("circle", get_circles), ("rectangle", get_rectangles))
+    for shape, get_boxes in batches:
+        selected = types == SHAPE_CODES[shape]
+        if not selected.any():
+            continue
+        starts = store.starts[rows[selected]]
+        coord1 = origin + store.vertices[starts].astype(np.float64) * imscale
+        coord2 = origin + store.vertices[starts + 1].astype(np.float64) * imscale
+        boxes = get_boxes(coord1, coord2)
+        if shape == "rectangle":
+            projected.update(zip(ids[selected].tolist(), boxes.tolist()))
+            continue
+
+        if adaptive:
+            radius = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) / 2
+            steps = ellipse_steps(np.abs(radius))
+        else:
+            steps = np.full(len(boxes), 20)
+        selected_ids = ids[selected]
+        for n in np.unique(steps).tolist():
+            same = steps == n
+            projected.update(zip(selected_ids[same].tolist(), oval2polys(boxes[same], n).tolist()))
+    return projected
+
+
+def project_point(annotation, bbox, origin, imscale):
+    """
+    Canvas item type and coordinates of the dot a tiny annotation collapses to, the item type
+    is the one of the full annotation so the item can be reused.
+    """
+    x = origin[0] + (bbox[0] + bbox[2]) / 2 * imscale
+    y = origin[1] + (bbox[1] + bbox[3]) / 2 * imscale
+    if annotation.shape == "rectangle":
+        return "rectangle", [x - 1, y - 1, x + 1, y + 1]
+    if annotation.shape == "polygon" and len(annotation.coords_norm) == 2:
+        return "line", [x - 1, y, x + 1, y]
+    return "polygon", [x - 1, y - 1, x + 1, y - 1, x + 1, y + 1, x - 1, y + 1]
+
+
+def project_lod(annotation, origin, imscale, level, tolerance):
+    """
+    Returns the canvas item type and the canvas coordinates of an annotation at a level of detail.
+    Polygons are simplified (cached per level on the annotation), ovals get as many vertices as
+    their size on screen needs. The full detail coordinates are not changed.
+    """
+    shape = annotation.shape
+    if shape == "polygon":
+        coords_norm = annotation.simplified(level, tolerance)
+        if len(coords_norm) < 3 <= len(annotation.coords_norm):
+            coords_norm = annotation.coords_norm  # keep polygons polygons
+        return project_annotation(coords_norm, shape, origin, imscale)
+    if shape == "rectangle":
+        return project_annotation(annotation.coords_norm, shape, origin, imscale)
+
+    (x0, y0), (x1, y1) = annotation.coords_norm
+    radius = math.hypot(x1 - x0, y1 - y0) if shape == "circle" else max(abs(x1 - x0), abs(y1 - y0))
+    steps = ellipse_steps(radius * imscale)
+    return project_annotation(annotation.coords_norm, shape, origin, imscale, steps=steps)
+
+
+class VirtualCanvas:
+    """
+    Keeps canvas items only for the annotations that intersect the viewport (plus a margin).
+    Items of annotations that leave the view are hidden and recycled for annotations that enter it.
+    Selected annotations (MOVE, DELETE, COMBINE tags) are never culled.
+    Outlines are drawn at a level of detail that follows the zoom: annotations smaller than
+    min_size pixels are not drawn, annotations smaller than point_size pixels are drawn as a dot.
+    Zoomed out over more than max_items annotations only the largest max_items are drawn, so a
+    frame costs about the same at every zoom. Items are re-projected from the normalized
+    coordinates on every zoom, the canvas must not scale the TAG items itself.
+    """
+
+    PINNED = ("MOVE", "DELETE", "COMBINE")
+    TAG = "VIRTUAL"  # every item of the virtual canvas, recycled ones included
+
+    def __init__(
+        self,
+        canvas,
+        data,
+        margin=0.25,
+        pool_size=2000,
+        reduction=2,
+        min_size=1,
+        point_size=3,
+        max_items=10000,
+    ):
+        self.canvas = canvas
+        self.data = data
+        self.margin = margin  # fraction of the viewport added on every side
+        self.pool_size = pool_size
+        self.reduction = reduction
+        self.min_size = min_size
+        self.point_size = point_size
+        self.max_items = max_items  # most annotations drawn at once, the largest win
+
+        self.placed = set()  # unique ids with a canvas item
+        self.pool = {"polygon": [], "rectangle": [], "line": []}
+        self.state = "normal"  # "hidden" while all annotations are toggled off
+        self.imscale = None
+        self.origin = None
+
+    def update(self, origin, imscale, box_canvas):
+        """ Creates, recycles and re-projects the canvas items of the visible annotations"""
+        x0, y0, x1, y1 = box_canvas
+        mx, my = (x1 - x0) * self.margin, (y1 - y0) * self.margin
+        box = (
+            (x0 - mx - origin[0]) / imscale,
+            (y0 - my - origin[1]) / imscale,
+            (x1 + mx - origin[0]) / imscale,
+            (y1 + my - origin[1]) / imscale,
+        )
+        sizes = self.query(box, imscale)  # the annotations to draw
+
+        reproject = imscale != self.imscale or origin != self.origin
+        self.imscale, self.origin = imscale, origin
+        annotations = self.data.annotations_tkinter
+        bboxes = self.data.index.bboxes
+
+        for unique_id in list(self.placed):
+            if unique_id not in annotations:
+                self.placed.discard(unique_id)  # deleted by the annotator
+            elif unique_id not in sizes:
+                self.cull(unique_id)
+        # selected annotations kept by cull follow the zoom as well, the canvas does not scale them
+        needed = [i for i in sizes if reproject or annotations[i].canvas_id is None]
+        if reproject:
+            for unique_id in self.placed.difference(sizes):
+                bx0, by0, bx1, by1 = bboxes[unique_id]
+                sizes[unique_id] = max(bx1 - bx0, by1 - by0) * imscale
+                needed.append(unique_id)
+
+        level = lod_level(imscale, self.reduction)
+        tolerance = lod_tolerance(level, self.reduction)
+
+        # ellipses, circles and rectangles of all visible annotations are projected at once
+        projected = project_shapes(self.data.store, needed, origin, imscale, adaptive=True)
+
+        for unique_id in needed:
+            annotation = annotations[unique_id]
+            if sizes[unique_id] < self.point_size:
+                item_type, coords = project_point(annotation, bboxes[unique_id], origin, imscale)
+            elif unique_id in projected:
+                item_type = "rectangle" if annotation.shape == "rectangle" else "polygon"
+                coords = projected[unique_id]
+            else:
+                item_type, coords = project_lod(annotation, origin, imscale, level, tolerance)
+
+            if annotation.canvas_id is None:
+                annotation.canvas_id = self.draw(unique_id, item_type, coords)
+            else:
+                self.canvas.coords(annotation.canvas_id, coords)
+        self.placed.update(sizes)
+
+    def query(self, box, imscale):
+        """
+        Returns a dict unique id -> largest side on screen of the annotations to draw in the box
+        (normalized coordinates): the ones of at least min_size pixels, only the max_items largest
+        of them when zoomed out that far. Boxes over a large part of the grid test the bounding
+        boxes of the store at once instead of the candidates of the index one by one.
+        """
+        store, index = self.data.store, self.data.index
+        if index.n_cells(box) * 4 <= len(index.cells):
+            rows = store.get_rows(index.query_box(box))
+        else:
+            rows = store.get_rows()
+            b = store.bboxes[rows]
+            x0, y0, x1, y1 = box
+            rows = rows[(b[:, 0] <= x1) & (x0 <= b[:, 2]) & (b[:, 1] <= y1) & (y0 <= b[:, 3])]
+
+        b = store.bboxes[rows].astype(np.float64)
+        sizes = np.maximum(b[:, 2] - b[:, 0], b[:, 3] - b[:, 1]) * imscale
+        drawn = sizes >= self.min_size
+        rows, sizes = rows[drawn], sizes[drawn]
+        if len(rows) > self.max_items:
+            largest = np.argpartition(sizes, len(sizes) - self.max_items)[-self.max_items :]
+            rows, sizes = rows[largest], sizes[largest]
+        return dict(zip([store.ids[row] for row in rows.tolist()], sizes.tolist()))
+
+    def draw(self, unique_id, item_type, coords):
+        """ Draws an annotation, reusing a recycled canvas item when one is available"""
+        layer = self.data.layer_of(unique_id)
+        state = self.state if layer.visible else "hidden"
+        options = {
+            "fill": layer.color,
+            "width": 3,
+            "tags": (unique_id, layer.tag, self.TAG),
+            "state": state,
+        }
+        if item_type != "line":
+            options.update(outline=layer.color, stipple="gray12")
+        else:
+            options["tags"] += ("LINE",)
+
+        if self.pool[item_type]:
+            canvas_id = self.pool[item_type].pop()
+            self.canvas.coords(canvas_id, coords)
+            self.canvas.itemconfigure(canvas_id, **options)
+            self.canvas.tag_raise(canvas_id)
+            return canvas_id
+        return getattr(self.canvas, "create_" + item_type)(coords, **options)
+
+    def cull(self, unique_id):
+        """ Removes the canvas item of an annotation outside of the view, unless it is selected"""
+        annotation = self.data.annotations_tkinter[unique_id]
+        canvas_id = annotation.canvas_id
+        if canvas_id is None:
+            self.placed.discard(unique_id)
+            return
+        if any(tag in self.PINNED for tag in self.canvas.gettags(canvas_id)):
+            return
+
+        item_type = self.canvas.type(canvas_id)
+        if item_type in self.pool and len(self.pool[item_type]) < self.pool_size:
+            self.canvas.itemconfigure(canvas_id, state="hidden", tags=(self.TAG,))
+            self.pool[item_type].append(canvas_id)
+        else:
+            self.canvas.delete(canvas_id)
+        annotation.canvas_id = None
+        self.placed.discard(unique_id)
+
+    def clear(self):
+        """ Removes all items, including the recycled ones"""
+        for unique_id in list(self.placed):
+            annotation = self.data.annotations_tkinter.get(unique_id)
+            if annotation is not None and annotation.canvas_id is not None:
+                self.canvas.delete(annotation.canvas_id)
+                annotation.canvas_id = None
+        for items in self.pool.values():
+            for canvas_id in items:
+                self.canvas.delete(canvas_id)
+            items.clear()
+        self.placed = set()